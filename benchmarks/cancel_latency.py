@@ -0,0 +1,176 @@
+"""How long a cancelled transfer takes to stop.
+
+Each run starts a transfer in a thread, waits until it's blocked on
+the other end, cancels it the way the GUI's Cancel button does, and
+times how long it takes for run() to return:
+
+- an XModem server get, and an XModem server send, to the stand-in
+  server in sim_server.py, which acknowledges the command and then
+  goes quiet like a calculator with its cable pulled
+- a Kermit send, with a stand-in Kermit (a short Python script in a
+  temporary directory) that prints progress until it's typed an E,
+  like the real one does. The time Kermit's read loop took to wake
+  up is the connector's woken_after.
+
+Before CancelPipe, the XModem cancels waited out the serial timeout
+(a second) and Kermit was killed. Exits 1 if the median of any of
+them is over budget:
+
+    python benchmarks/cancel_latency.py [--runs 10] [--budget-ms 50]
+"""
+import argparse
+import contextlib
+import io
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from hpex.kermit_pubsub import KermitConnector
+from hpex.settings import HPexSettingsTools
+from hpex.xmodem_pubsub import XModemConnector
+
+from sim_server import SimServer
+
+# what the stand-in Kermit does: progress every 200 ms, and an exit
+# once it's typed an E
+FAKE_KERMIT = '''import select, sys, tty
+tty.setraw(0)
+while True:
+    ready, _, _ = select.select([0], [], [], .2)
+    if ready and sys.stdin.read(1) == 'E':
+        print('error packet sent', flush=True)
+        sys.exit(1)
+    print('  155    1%   17132      94', flush=True)
+'''
+
+
+def settings() -> dict:
+    settings = HPexSettingsTools.create_settings_dict()
+    # a pty can't be tuned
+    settings['low_latency'] = False
+    return settings
+
+
+def cancel_after(start, cancel, wait) -> tuple:
+    """Run `start` in a thread, call `wait` until it's blocked, cancel
+    it, and return (ms to return, what it printed)."""
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        thread = threading.Thread(target=start)
+        thread.start()
+        wait()
+        if not thread.is_alive():
+            raise RuntimeError('it finished before it was cancelled')
+        begin = time.monotonic()
+        cancel()
+        thread.join(10)
+        elapsed = time.monotonic() - begin
+    if thread.is_alive():
+        raise RuntimeError('still running 10 s after cancel')
+    return elapsed * 1000, out.getvalue()
+
+
+def wait_for(server, command):
+    end = time.monotonic() + 5
+    while command not in server.log:
+        if time.monotonic() > end:
+            raise RuntimeError(f'the server never got {command!r}')
+        time.sleep(.01)
+    # long enough that the connector is waiting on the port
+    time.sleep(.2)
+
+
+def xmodem_get(tmp) -> float:
+    server = SimServer(stall=True)
+    try:
+        connector = XModemConnector()
+        ms, _ = cancel_after(
+            lambda: connector.run(server.port, None, 'A', 'get_connect', tmp,
+                                  'bench', False, settings()),
+            connector.cancel,
+            lambda: wait_for(server, b'G'))
+    finally:
+        server.close()
+    return ms
+
+
+def xmodem_send(tmp) -> float:
+    server = SimServer(stall=True)
+    obj = Path(tmp, 'OBJ')
+    obj.write_bytes(b'HPHP48-R' + bytes(range(256)) * 16)
+    try:
+        connector = XModemConnector()
+        ms, _ = cancel_after(
+            lambda: connector.run(server.port, None, str(obj), 'send_connect',
+                                  tmp, 'bench', False, settings()),
+            connector.cancel,
+            lambda: wait_for(server, b'P'))
+    finally:
+        server.close()
+    return ms
+
+
+def kermit_send(tmp) -> tuple:
+    """Returns (ms to return, ms for the read loop to wake up)."""
+    kermit = Path(tmp, 'kermit')
+    kermit.write_text(f'#!{sys.executable}\n' + FAKE_KERMIT)
+    kermit.chmod(0o755)
+    options = settings()
+    options['kermit_executable'] = str(kermit)
+
+    connector = KermitConnector()
+    ms, _ = cancel_after(
+        lambda: connector.run('/dev/null', None, 'send OBJ', 'bench',
+                              True, False, options),
+        connector.cancel_kermit,
+        # a couple of progress lines
+        lambda: time.sleep(.5))
+    woken = connector.woken_after
+    return ms, float('nan') if woken is None else woken * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10,
+                        help='Runs of each transfer (default 10)')
+    parser.add_argument('--budget-ms', type=float, default=50,
+                        help='Most a cancel may take to stop a transfer, in ms (default 50)')
+    args = parser.parse_args()
+
+    # the xmodem module logs each of the retries it makes after a
+    # cancelled get
+    logging.getLogger('xmodem').setLevel(logging.CRITICAL)
+
+    tmp = tempfile.mkdtemp(prefix='hpex-bench-')
+    results = {'xmodem get': [], 'xmodem send': [], 'kermit send': []}
+    woken = []
+    for _ in range(args.runs):
+        results['xmodem get'].append(xmodem_get(tmp))
+        results['xmodem send'].append(xmodem_send(tmp))
+        ms, wake = kermit_send(tmp)
+        results['kermit send'].append(ms)
+        woken.append(wake)
+
+    failed = False
+    for name, times in results.items():
+        median = statistics.median(times)
+        over = median > args.budget_ms
+        print(f'{name}: stopped {median:.1f} ms after cancel '
+              f'(median, worst {max(times):.1f} ms, budget {args.budget_ms:.0f} ms)'
+              f'{"  OVER BUDGET" if over else ""}')
+        failed |= over
+    print(f'kermit read loop woken {statistics.median(woken):.1f} ms after cancel (median)')
+
+    os.remove(Path(tmp, 'kermit'))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
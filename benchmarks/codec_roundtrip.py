@@ -0,0 +1,105 @@
+"""Checks that the hp48 codecs and pretranslate() lose nothing.
+
+- Every character of the calculator's set, and a list of awkward
+  strings (mostly backslashes: alone, doubled, trailing, and in front
+  of things that look like escapes), is encoded with each translate
+  mode and decoded again, in one go and a byte at a time.
+- pretranslate() of a T(2) or T(3) object has to give a T(1) object
+  that reads as the same characters, with \\\\ read as one backslash.
+- An object with a backslash pretranslate() doesn't know the meaning
+  of has to come back as it was, so the calculator translates it.
+
+Exits 1 if any check fails:
+
+    python benchmarks/codec_roundtrip.py
+"""
+import codecs
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from hpex.hp48_codec import DECODING_TABLE, X_BAR, pretranslate
+
+AWKWARD = [
+    '\\', '\\\\', '\\\\\\', 'a\\', '\\a', '\\GS', '\\\\GS', '\\\\\\GS',
+    '\\<<', '\\<)', '\\>>', '\\123', '\\\\123', '\\200', '\\x', '\\x-',
+    '«\\»', 'Σ\\', X_BAR + '\\', '\\' + X_BAR, 'x\\-', '"\\\\" "\\\\\\\\"',
+    '\\\n', '%%HP: T(3);',
+]
+CHARACTERS = [X_BAR if c == '\x81' else c for c in DECODING_TABLE]
+CHARSET = ''.join(CHARACTERS)
+
+
+class Checks:
+    def __init__(self):
+        self.failed = 0
+        self.run = 0
+
+    def check(self, ok, what):
+        self.run += 1
+        if not ok:
+            self.failed += 1
+            print('FAIL ', what)
+
+
+def decode_bytewise(data, encoding) -> str:
+    decoder = codecs.getincrementaldecoder(encoding)()
+    text = ''.join(decoder.decode(data[i:i + 1]) for i in range(len(data)))
+    return text + decoder.decode(b'', final=True)
+
+
+def check_codecs(checks):
+    for mode in range(4):
+        encoding = f'hp48-t{mode}'
+        for text in AWKWARD + [CHARSET] + CHARACTERS:
+            data = text.encode(encoding)
+            checks.check(data.decode(encoding) == text,
+                         f'{encoding}: {text!r} -> {data!r} -> {data.decode(encoding)!r}')
+            checks.check(decode_bytewise(data, encoding) == text,
+                         f'{encoding}, a byte at a time: {text!r} -> {data!r}')
+
+
+def check_pretranslate(checks):
+    for mode in (2, 3):
+        for text in AWKWARD + [CHARSET]:
+            if mode == 2:
+                # T(2) leaves 160 and up alone, so those come back
+                # as themselves whichever way they're read
+                text = ''.join(c for c in text if c == X_BAR[1] or ord(c) < 0xa0)
+            header = f'%%HP: T({mode})A(R)F(.);\n'.encode()
+            obj = header + text.encode(f'hp48-t{mode}')
+            sent = pretranslate(obj)
+            ok = sent.startswith(b'%%HP: T(1)A(R)F(.);\n') and \
+                sent[len(header):].decode('hp48-t1') == text
+            checks.check(ok, f'T({mode}) {text!r}: {obj!r} became {sent!r}')
+
+    # what the reviewer's example looks like on the calculator
+    checks.check(pretranslate(b'%%HP: T(3);\n"a\\\\b"') == b'%%HP: T(1);\n"a\\b"',
+                 '\\\\ is one backslash under T(1)')
+
+    # backslashes we can't be sure about are the calculator's to read
+    for obj in [b'%%HP: T(3);\n"\\foo"', b'%%HP: T(3);\n"\\065"',
+                b'%%HP: T(2);\n"\\200 \\GS"', b'%%HP: T(3);\n"\\GS\\"',
+                b'%%HP: T(2);\n"\\<<"']:
+        checks.check(pretranslate(obj) == obj,
+                     f'{obj!r} should be sent untouched, became {pretranslate(obj)!r}')
+
+    # nothing to translate, or not a translated object at all
+    for obj in [b'%%HP: T(1);\n"\\\\"', b'%%HP: T(0);\n"\\GS"',
+                b'HPHP48-R\\\\GS', b'%%HP: T(3);\n"plain"']:
+        expected = obj.replace(b'T(3)', b'T(1)') if b'plain' in obj else obj
+        checks.check(pretranslate(obj) == expected,
+                     f'{obj!r} became {pretranslate(obj)!r}')
+
+
+def main():
+    checks = Checks()
+    check_codecs(checks)
+    check_pretranslate(checks)
+    print(f'{checks.run - checks.failed} of {checks.run} checks passed')
+    sys.exit(1 if checks.failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""How long the GUI takes to put its main window up.
+
+Every run is a fresh interpreter that imports hpex_gui and builds
+HPexGUI, the way `hpex` with no arguments does, and records:
+
+  import   importing hpex.hpex_gui
+  shown    import plus the constructor, which ends with Show()
+  listed   until the callbacks queued at startup (the local listing)
+           have run
+  port     until the background port search has filled in the box
+
+It runs without a display. By default wx is replaced by a stand-in
+that accepts every call and does nothing, so what's timed is HPex's
+own code and imports rather than wxWidgets drawing; that's the part
+that regresses. With --real-wx it uses wxPython instead, under
+xvfb-run when there's no $DISPLAY.
+
+Whatever was imported by the time the window is shown is checked
+against the modules that only a dialog or a transfer needs. Exits 1
+if that check fails or `shown` is over budget:
+
+    python benchmarks/gui_startup.py [--runs 10] [--budget-ms 150] [--real-wx]
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from pathlib import Path
+from unittest import mock
+
+SRC = Path(__file__).resolve().parent.parent / 'src'
+
+# modules that only a dialog, the settings or a transfer needs
+FORBIDDEN = ('serial', 'xmodem', 'ptyprocess',
+             'hpex.xmodem_pubsub', 'hpex.kermit_pubsub',
+             'hpex.xmodem_xsend_pubsub', 'hpex.hp_xmodem', 'hpex.transport',
+             'hpex.dialogs', 'hpex.file_dialogs', 'hpex.settings_frame')
+
+# how long a child waits for the port search before giving up
+PORT_TIMEOUT = 10
+
+
+def mock_wx():
+    """A module that stands in for wx. Every CamelCase name is a class
+    whose methods do nothing, except that what's passed to SetX() comes
+    back from GetX(); every UPPER_CASE name is a distinct int.
+    CallAfter() queues its calls, for run_pending() to run."""
+    wx = types.ModuleType('wx')
+    wx.pending = []
+    classes = {}
+    constants = itertools.count(1000)
+
+    def anything():
+        # what an unset GetX() returns: it takes any call or
+        # arithmetic, and compares false with everything, so that
+        # checks like `index >= 0` just don't pass
+        value = mock.MagicMock()
+        for op in ('__lt__', '__le__', '__gt__', '__ge__'):
+            getattr(value, op).return_value = False
+        return value
+
+    class WidgetType(type):
+        # static methods, like wx.ArtProvider.GetBitmap()
+        def __getattr__(cls, name):
+            if name.startswith('_'):
+                raise AttributeError(name)
+            return mock.MagicMock(name=name)
+
+    class Widget(metaclass=WidgetType):
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def __getattr__(self, name):
+            if name.startswith('_'):
+                raise AttributeError(name)
+            values = self.__dict__.setdefault('_values', {})
+            if name.startswith('Set'):
+                return lambda value=None, *args, **kwargs: \
+                    values.__setitem__(name[3:], value)
+            if name.startswith('Get'):
+                value = values.setdefault(name[3:], anything())
+                return lambda *args, **kwargs: value
+            return mock.MagicMock(name=name)
+
+    def module_getattr(name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name.isupper():
+            value = next(constants)
+        else:
+            value = classes.setdefault(name, type(name, (Widget,), {}))
+        setattr(wx, name, value)
+        return value
+
+    def run_pending():
+        while wx.pending:
+            func, args, kwargs = wx.pending.pop(0)
+            func(*args, **kwargs)
+
+    wx.__getattr__ = module_getattr
+    wx.CallAfter = lambda func, *args, **kwargs: \
+        wx.pending.append((func, args, kwargs))
+    wx.run_pending = run_pending
+    return wx
+
+
+def child(real_wx):
+    """Start the GUI once and print the timings as JSON."""
+    start = time.perf_counter()
+    if real_wx:
+        import wx
+        app = wx.App(False)
+    else:
+        wx = sys.modules['wx'] = mock_wx()
+    # HPex prints a lot; keep it out of the result
+    out = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+
+    times = {}
+    port_found = threading.Event()
+
+    before = time.perf_counter()
+    from hpex.hpex_gui import HPexGUI
+    times['import'] = time.perf_counter() - before
+    # Wrapped on the class, before the constructor starts the search:
+    # with the port registry's list already there, the search can be
+    # done before the constructor returns.
+    found = HPexGUI.port_found
+
+    def port_found_hook(self, *args):
+        found(self, *args)
+        times['port'] = time.perf_counter() - before
+        port_found.set()
+    HPexGUI.port_found = port_found_hook
+
+    frame = HPexGUI(None)
+    times['shown'] = time.perf_counter() - before
+    loaded = sorted(m for m in FORBIDDEN if m in sys.modules)
+
+    if real_wx:
+        def listed():
+            times['listed'] = time.perf_counter() - before
+        # queued behind what the constructor queued
+        wx.CallAfter(listed)
+
+        def check():
+            if port_found.is_set() or time.perf_counter() - before > PORT_TIMEOUT:
+                frame.Destroy()
+                app.ExitMainLoop()
+            else:
+                wx.CallLater(10, check)
+        wx.CallLater(10, check)
+        app.MainLoop()
+    else:
+        wx.run_pending()
+        times['listed'] = time.perf_counter() - before
+        while not port_found.is_set() and \
+              time.perf_counter() - before < PORT_TIMEOUT:
+            time.sleep(0.001)
+            wx.run_pending()
+
+    times['total'] = time.perf_counter() - start
+    out.write(json.dumps({'times': times, 'forbidden': loaded}) + '\n')
+
+
+def environment() -> dict:
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [str(SRC)] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    # a HOME of its own, so a missing ~/.hpexrc doesn't get written
+    # into the real one, and every run sees the same state
+    env['HOME'] = env['USERPROFILE'] = tempfile.mkdtemp(prefix='hpex-bench-')
+    return env
+
+
+def command(real_wx) -> list:
+    cmd = [sys.executable, __file__, '--child']
+    if real_wx:
+        cmd.append('--real-wx')
+        if sys.platform.startswith('linux') and not os.environ.get('DISPLAY'):
+            if not shutil.which('xvfb-run'):
+                sys.exit('Error: --real-wx needs $DISPLAY or xvfb-run.')
+            cmd = ['xvfb-run', '-a'] + cmd
+    return cmd
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10,
+                        help='Times to start the GUI (default 10)')
+    parser.add_argument('--budget-ms', type=float, default=150,
+                        help='Most that importing hpex_gui and showing the window may take, in ms (default 150)')
+    parser.add_argument('--real-wx', action='store_true',
+                        help='Use wxPython instead of the stand-in')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.real_wx)
+        return
+
+    env = environment()
+    cmd = command(args.real_wx)
+    results = []
+    for _ in range(args.runs):
+        done = subprocess.run(cmd, env=env, stdout=subprocess.PIPE,
+                              text=True, check=True)
+        results.append(json.loads(done.stdout.splitlines()[-1]))
+
+    print(f'{"with wxPython" if args.real_wx else "with wx stubbed out"}, '
+          f'median of {args.runs} runs:')
+    for stage in ('import', 'shown', 'listed', 'port'):
+        samples = [r['times'][stage] for r in results if stage in r['times']]
+        if len(samples) < len(results):
+            print(f'  {stage:>8}  missing from {len(results) - len(samples)} runs')
+        if samples:
+            print(f'  {stage:>8}  {statistics.median(samples) * 1000:7.1f} ms')
+
+    shown = statistics.median(r['times']['shown'] for r in results) * 1000
+    over = shown > args.budget_ms
+    if over:
+        print(f'shown is over budget ({args.budget_ms:.0f} ms)')
+    bad = sorted(set(m for r in results for m in r['forbidden']))
+    if bad:
+        print(f'imported {", ".join(bad)} before the window was shown')
+    sys.exit(1 if over or bad else 0)
+
+
+if __name__ == '__main__':
+    main()
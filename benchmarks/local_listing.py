@@ -0,0 +1,91 @@
+"""How long listing a huge local directory takes.
+
+Makes a directory with --entries entries (one in ten a directory) and
+times, as the median of --runs:
+
+  glob     what the local pane did before: glob, a Path per entry, a
+           sort of the full paths and an is_dir() stat per entry
+  scan     LocalListing.scan() on a directory it hasn't seen
+  refresh  LocalListing.scan() again, with the previous snapshot
+
+None of these include wx. Before, the pane also inserted every row
+into the ListCtrl one at a time; now it's virtual and only draws the
+rows on screen, so the listing is all that grows with the directory.
+
+    python benchmarks/local_listing.py [--entries 100000] [--runs 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from hpex.local_listing import LocalListing
+
+
+def glob_listing(path):
+    # populate_local_files() before LocalListing, minus the ListCtrl
+    cdir = [str(i) for i in Path(path).expanduser().glob('*')
+            if not i.name.startswith('.')]
+    cdir.sort()
+    return [(Path(i).name, 0 if Path(i).expanduser().is_dir() else 1)
+            for i in cdir]
+
+
+def make_directory(path, entries):
+    for i in range(entries):
+        name = os.path.join(path, f'PRG{i:06d}.HP')
+        if i % 10 == 0:
+            os.mkdir(name)
+        else:
+            open(name, 'w').close()
+    # like a directory that's been sitting there a while: scan()
+    # doesn't trust snapshots of directories changed in the last
+    # couple of seconds
+    old = time.time() - 60
+    os.utime(path, (old, old))
+
+
+def median_time(func, runs) -> float:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=100_000,
+                        help='Entries in the directory (default 100000)')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Runs of each (default 5)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='hpex-bench-') as path:
+        print(f'creating {args.entries} entries...')
+        make_directory(path, args.entries)
+
+        snapshot = LocalListing.scan(path)
+        assert [(n, 0 if d else 1) for n, d in zip(snapshot.names, snapshot.dirs)] \
+            == glob_listing(path)
+
+        results = {
+            'glob': median_time(lambda: glob_listing(path), args.runs),
+            'scan': median_time(lambda: LocalListing.scan(path), args.runs),
+            'refresh': median_time(
+                lambda: LocalListing.scan(path, snapshot), args.runs),
+        }
+
+    for name, seconds in results.items():
+        print(f'  {name:>8}  {seconds * 1000:9.2f} ms')
+    print(f'scan is {results["glob"] / results["scan"]:.1f}x faster than glob')
+
+
+if __name__ == '__main__':
+    main()
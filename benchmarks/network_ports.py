@@ -0,0 +1,147 @@
+"""Checks that socket:// and rfc2217:// ports work end to end.
+
+The stand-in server from sim_server.py is put behind TcpBridge, which
+relays a local TCP port to it like a network serial server would.
+Then:
+
+- `hpex xsrv_send` of a 5000-byte object and `hpex xsrv_get`, once to
+  the pty and once to the socket:// URL, timing each, and checking
+  what arrived
+- the asyncio server over socket://: connect, a send, and disconnect
+- a read on loop://, which pyserial gives no fd for, so the Transport
+  polls it; cancelling it should still return within a poll or two
+- the Kermit command lines for socket:// and rfc2217://, since -l
+  can't take a URL
+
+Kermit itself isn't run. Exits 1 if any check fails:
+
+    python benchmarks/network_ports.py
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from hpex.async_connectors import AsyncXModemServer
+from hpex.kermit_pubsub import kermit_invocation
+from hpex.settings import HPexSettingsTools
+from hpex.transport import Transport, POLL_INTERVAL
+
+from sim_server import SimServer, TcpBridge
+from startup import command, environment
+
+SIZE = 5000
+
+
+class Checks:
+    def __init__(self):
+        self.failed = False
+
+    def check(self, ok, what):
+        print(f'{"ok  " if ok else "FAIL"}  {what}')
+        self.failed |= not ok
+
+
+def run_cli(argv, env, cwd) -> float:
+    """Run hpex with `argv` and return how long it took, in ms."""
+    start = time.perf_counter()
+    subprocess.run(command(argv), env=env, cwd=cwd, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.perf_counter() - start) * 1000
+
+
+def check_cli(checks, server, bridge, env, tmp):
+    obj = Path(tmp, 'OBJ')
+    obj.write_bytes(b'HPHP48-R' + os.urandom(SIZE - 8))
+    for name, port in [('pty', server.port), ('socket://', bridge.url)]:
+        server.files.clear()
+        ms = run_cli(['xsrv_send', '-p', port, str(obj)], env, tmp)
+        checks.check(server.files.get('OBJ', b'').startswith(obj.read_bytes()),
+                     f'xsrv_send of {SIZE} bytes over {name}: {ms:.0f} ms')
+
+        got = Path(tmp, 'A')
+        if got.exists():
+            got.unlink()
+        ms = run_cli(['xsrv_get', '-p', port, 'A'], env, tmp)
+        checks.check(got.exists() and got.read_bytes().startswith(b'HPHP48-'),
+                     f'xsrv_get over {name}: {ms:.0f} ms')
+
+
+def check_async(checks, bridge, settings):
+    async def session():
+        async with AsyncXModemServer.open(bridge.url, settings) as server:
+            memory, objects = await server.connect()
+            sent = await server.send_data('ASYNC', bytes(SIZE))
+            await server.disconnect(finish=False)
+            return memory, [o.name for o in objects], sent
+
+    start = time.perf_counter()
+    memory, names, sent = asyncio.run(session())
+    ms = (time.perf_counter() - start) * 1000
+    checks.check(memory == 12345 and names == ['A', 'PRG'] and sent,
+                 f'asyncio connect, send and disconnect over socket://: {ms:.0f} ms')
+
+
+def check_polled_cancel(checks, settings):
+    transport = Transport.open('loop://', settings, 1)
+    try:
+        transport.write(b'hello')
+        checks.check(transport.read_exact(5) == b'hello', 'read back on loop://')
+
+        cancelled_at = []
+        def cancel():
+            cancelled_at.append(time.monotonic())
+            transport.cancel()
+        threading.Timer(.2, cancel).start()
+        data = transport.read_exact(1, 5)
+        ms = (time.monotonic() - cancelled_at[0]) * 1000
+    finally:
+        transport.close()
+    checks.check(data == b'' and ms < POLL_INTERVAL * 2000,
+                 f'cancelled read on loop:// returned {ms:.0f} ms after cancel '
+                 f'(polled every {POLL_INTERVAL * 1000:.0f} ms)')
+
+
+def check_kermit(checks, settings):
+    socket_line = kermit_invocation(settings, 'send x', 'socket://lab:4001')
+    checks.check('-l' not in socket_line
+                 and 'set host lab 4001 /raw-socket,send x' in socket_line[-1],
+                 'Kermit opens socket:// with set host /raw-socket')
+
+    telnet_line = kermit_invocation(settings, 'send x', 'rfc2217://lab:4001')
+    checks.check('-l' not in telnet_line
+                 and 'set telopt com-port-control requested' in telnet_line[-1]
+                 and 'set host lab 4001 /telnet' in telnet_line[-1],
+                 'Kermit opens rfc2217:// with set host /telnet and COM-PORT-CONTROL')
+
+
+def main():
+    settings = HPexSettingsTools.create_settings_dict()
+    settings['low_latency'] = False
+    env = environment()
+    tmp = tempfile.mkdtemp(prefix='hpex-bench-')
+
+    server = SimServer()
+    bridge = TcpBridge(server.port)
+    print('stand-in server on', server.port, 'and', bridge.url)
+
+    checks = Checks()
+    try:
+        check_cli(checks, server, bridge, env, tmp)
+        check_async(checks, bridge, settings)
+    finally:
+        server.close()
+    check_polled_cancel(checks, settings)
+    check_kermit(checks, settings)
+
+    sys.exit(1 if checks.failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""How long parsing a huge XModem listing takes, and how much it keeps.
+
+Makes the server's reply to 'L' for --entries objects and measures,
+for the old parser (byte by byte, an HPVariable of strings per entry)
+and parse_listing():
+
+  parse    time to parse the reply (median of --runs)
+  format   time to parse it and then read every entry's name, size,
+           type and CRC, which is what showing all of it costs
+  memory   bytes the parsed listing holds on to (tracemalloc)
+
+and checks that both give the same strings for every entry.
+
+    python benchmarks/remote_listing.py [--entries 100000] [--runs 5]
+"""
+import argparse
+import random
+import statistics
+import struct
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from hpex.helpers import KermitProcessTools, XModemProcessTools
+from hpex.hp_variable import HPVariable
+from hpex.xmodem_listing import parse_listing, PATH_VAR
+
+PROLOGS = (0x2D9D, 0x2933, 0x2A2C, 0x2A96, 0x2B40, 0x2A74, 0x2E48)
+
+
+def old_parse_listing(l):
+    # parse_listing() before XModemListing
+    index = 0
+    objects = []
+    while index < len(l):
+        lsize = l[index]
+        index += 1
+        name = l[index:index + lsize]
+        index += lsize
+        prologstr = l[index:index + 2]
+        prolog = prologstr[1] * 256 + prologstr[0]
+        index += 2
+        objsize = l[index:index + 3]
+        size = objsize[2] * 65536 + objsize[1] * 256 + objsize[0]
+        size /= 2
+        index += 3
+        objcrc = l[index:index + 2]
+        crc = objcrc[1] * 256 + objcrc[0]
+        index += 2
+        if name == PATH_VAR.encode():
+            continue
+        objects.append(HPVariable(XModemProcessTools.bytes_to_utf8(name),
+                                  str(size),
+                                  XModemProcessTools.prolog_to_type(prolog),
+                                  KermitProcessTools.checksum_to_hexstr(crc)))
+    return objects
+
+
+def make_reply(entries) -> bytes:
+    rng = random.Random(48)
+    reply = bytearray()
+    for i in range(entries):
+        name = f'VAR{i}'.encode()
+        if i % 50 == 0:
+            # now and then a name with an HP 48 character in it
+            name += b'\x8d\x87'
+        size = rng.randrange(10, 1 << 24)
+        reply += bytes([len(name)]) + name
+        reply += struct.pack('<HHBH', rng.choice(PROLOGS),
+                             size & 0xffff, size >> 16, rng.randrange(1 << 16))
+    # and the one we hide
+    reply += bytes([len(PATH_VAR)]) + PATH_VAR.encode() + bytes(7)
+    return bytes(reply)
+
+
+def format_all(objects):
+    return [(o.name, o.size, o.vtype, o.crc) for o in objects]
+
+
+def median_time(func, runs) -> float:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def retained(func) -> int:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = func()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=100_000,
+                        help='Objects in the listing (default 100000)')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Runs of each (default 5)')
+    args = parser.parse_args()
+
+    reply = make_reply(args.entries)
+    print(f'{args.entries} objects, {len(reply)} bytes of reply')
+
+    new = parse_listing(reply)
+    assert format_all(new) == format_all(old_parse_listing(reply))
+
+    results = {}
+    for label, parse in (('old', old_parse_listing), ('new', parse_listing)):
+        results[label] = (
+            median_time(lambda: parse(reply), args.runs),
+            median_time(lambda: format_all(parse(reply)), args.runs),
+            retained(lambda: parse(reply)))
+
+    print(f'         {"parse":>10} {"format":>10} {"memory":>12}')
+    for label, (parse_s, format_s, memory) in results.items():
+        print(f'  {label:>5}  {parse_s * 1000:7.1f} ms {format_s * 1000:7.1f} ms'
+              f' {memory / 1e6:9.2f} MB')
+    old, new = results['old'], results['new']
+    print(f'parse is {old[0] / new[0]:.1f}x faster, '
+          f'and keeps {old[2] / new[2]:.1f}x less')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""A stand-in for the calculator's XModem server, for the benchmarks.
+
+SimServer answers the server's commands (E, M, L, G, P, Q) on one end
+of a pty, so anything in HPex can be pointed at its other end like a
+real serial port. It keeps a couple of objects in HOME, stores what's
+sent to it, and logs every command, so a script can check what went
+over the line as well as how long it took. TcpBridge puts a TCP
+listener in front of it, for socket:// ports.
+
+Nothing here emulates a real calculator's timing: it answers as fast
+as the pty goes, plus `delay` before each reply. That's enough to
+count round trips and see cancels land, not to predict real transfer
+times.
+
+Run on its own, it serves until interrupted, for trying the CLI or the
+GUI by hand:
+
+    python benchmarks/sim_server.py [--tcp] [--delay 0.01]
+"""
+import argparse
+import io
+import os
+import pty
+import select
+import socket
+import struct
+import threading
+import time
+import tty
+
+import xmodem
+
+ACK = b'\x06'
+CAN = b'\x18'
+EOT = b'\x04'
+
+
+def checksum(data) -> int:
+    return sum(data) & 0xff
+
+
+class SimServer:
+    """The XModem server on a pty; `port` is the end to open. With
+    `stall`, G and P are acknowledged and then nothing else is sent,
+    like a calculator whose cable was pulled mid-transfer."""
+    def __init__(self, delay=0.0, stray=b'', stall=False):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        # name: (prolog, size in bytes, CRC)
+        self.vars = {'A': (0x2933, 21, 0x1234), 'PRG': (0x2D9D, 100, 0xBEEF)}
+        self.files = {}
+        self.log = []
+        self.delay = delay
+        # sent after each E's ACK, like the junk some ROMs send
+        self.stray = stray
+        self.stall = stall
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def read(self, n, timeout=5) -> bytes:
+        out = b''
+        end = time.monotonic() + timeout
+        while len(out) < n:
+            ready, _, _ = select.select(
+                [self.master], [], [], max(0, end - time.monotonic()))
+            if not ready:
+                break
+            out += os.read(self.master, n - len(out))
+        return out
+
+    def write(self, data):
+        time.sleep(self.delay)
+        os.write(self.master, data)
+
+    def read_packet(self) -> bytes:
+        length = self.read(2)
+        data = self.read(length[0] << 8 | length[1])
+        check = self.read(1)
+        assert check[0] == checksum(data), (data, check)
+        return data
+
+    def send_packet(self, data):
+        self.write(bytes([len(data) >> 8, len(data) & 0xff]) + data
+                   + bytes([checksum(data)]))
+        # the ACK
+        self.read(1)
+
+    def listing(self) -> bytes:
+        body = b''
+        for name, (prolog, size, crc) in self.vars.items():
+            name = name.encode('latin-1')
+            body += bytes([len(name)]) + name + struct.pack('<H', prolog)
+            body += (size * 2).to_bytes(3, 'little') + struct.pack('<H', crc)
+        return body
+
+    def serve(self):
+        while self.running:
+            command = self.read(1, timeout=0.5)
+            if not command:
+                continue
+            self.log.append(command)
+            if command == b'E':
+                self.log.append(self.read_packet().decode('latin-1'))
+                self.write(ACK)
+                if self.stray:
+                    self.write(self.stray)
+            elif command == b'M':
+                self.send_packet(b'12345')
+            elif command == b'L':
+                self.send_packet(self.listing())
+            elif command == b'G':
+                name = self.read_packet().decode('latin-1')
+                self.write(ACK)
+                if self.stall:
+                    return self.swallow()
+                data = self.files.get(name, b'HPHP48-X' + bytes(20))
+                modem = xmodem.XMODEM(
+                    lambda size, timeout=1: self.read(size, timeout) or None,
+                    lambda data, timeout=1: os.write(self.master, data))
+                modem.send(io.BytesIO(data), quiet=True)
+            elif command == b'P':
+                name = self.read_packet().decode('latin-1')
+                self.write(ACK)
+                self.write(b'D')
+                if self.stall:
+                    return self.swallow()
+                self.files[name] = self.receive()
+            elif command == b'Q':
+                self.log.append('quit')
+
+    def swallow(self):
+        # read everything and answer nothing, until close()
+        while self.running:
+            self.read(1024, timeout=0.5)
+
+    def receive(self) -> bytes:
+        # the 'D'-mode XModem HPXModem sends: no checksum byte to
+        # check, just the HP CRC, which we trust
+        data = b''
+        while True:
+            header = self.read(1)
+            if header == EOT or not header:
+                return data
+            if header == CAN:
+                self.log.append('CAN')
+                return data
+            size = 128 if header == b'\x01' else 1024
+            packet = self.read(2 + size + 2)
+            data += packet[2:2 + size]
+            self.write(ACK)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+
+class TcpBridge:
+    """Relays each TCP connection to the pty at `port`, like a network
+    serial server would; `url` is the socket:// URL to use."""
+    def __init__(self, port):
+        self.port = port
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen()
+        self.url = f'socket://127.0.0.1:{self.sock.getsockname()[1]}'
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            conn, _ = self.sock.accept()
+            threading.Thread(target=self.relay, args=(conn,), daemon=True).start()
+
+    def relay(self, conn):
+        fd = os.open(self.port, os.O_RDWR | os.O_NOCTTY)
+        tty.setraw(fd)
+        try:
+            while True:
+                ready, _, _ = select.select([conn, fd], [], [])
+                if conn in ready:
+                    data = conn.recv(4096)
+                    if not data:
+                        break
+                    os.write(fd, data)
+                if fd in ready:
+                    conn.sendall(os.read(fd, 4096))
+        finally:
+            os.close(fd)
+            conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tcp', action='store_true',
+                        help='Also listen on a local TCP port')
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help='Seconds to wait before each reply (default 0)')
+    args = parser.parse_args()
+
+    server = SimServer(delay=args.delay)
+    print('XModem server on', server.port)
+    if args.tcp:
+        print('and on', TcpBridge(server.port).url)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print('commands:', server.log)
+
+
+if __name__ == '__main__':
+    main()
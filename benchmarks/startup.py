@@ -0,0 +1,158 @@
+"""How long `hpex --help` and `hpex -i` take from start to exit.
+
+Every run is a fresh interpreter, like a script calling hpex would
+start. We time the whole thing, take the median, and subtract the
+median of a bare `python -c pass`, so the budget is for what hpex
+itself adds and doesn't depend on how fast the machine starts Python.
+A run with -X importtime then lists the slowest imports, and checks
+that none of the protocol modules were imported: neither command
+talks to a calculator.
+
+Then one real `hpex xsrv_send`, to the stand-in server in
+sim_server.py, checks that a transfer imports the XModem connector it
+uses and still none of Kermit's modules or wx. That part needs the
+xmodem package and a pty, so it's skipped where either is missing.
+
+Exits 1 if a command is over budget or imports something it
+shouldn't, so it can gate a CI job:
+
+    python benchmarks/startup.py [--runs 20] [--budget-ms 40]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parent.parent / 'src'
+
+# what the console script does
+RUNNER = 'from hpex.__main__ import run_as_main; run_as_main()'
+
+# modules that only a transfer (or the GUI) needs
+FORBIDDEN = ('pubsub', 'serial', 'xmodem', 'ptyprocess', 'wx', 'asyncio',
+             'hpex.xmodem_pubsub', 'hpex.kermit_pubsub',
+             'hpex.xmodem_xsend_pubsub', 'hpex.port_coordinator')
+
+# an XModem server send needs its connector, but never these
+TRANSFER_NEEDS = ('hpex.xmodem_pubsub', 'xmodem', 'serial')
+TRANSFER_FORBIDDEN = ('ptyprocess', 'wx', 'hpex.kermit_pubsub',
+                      'hpex.xmodem_xsend_pubsub')
+
+
+def command(args) -> list:
+    return [sys.executable, '-c', RUNNER, *args]
+
+
+def environment() -> dict:
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [str(SRC)] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    # a HOME of its own, so a missing ~/.hpexrc doesn't get written
+    # into the real one, and every run sees the same state
+    env['HOME'] = env['USERPROFILE'] = tempfile.mkdtemp(prefix='hpex-bench-')
+    return env
+
+
+def time_runs(cmd, env, runs) -> float:
+    """Median wall-clock seconds for `cmd` to run and exit."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def import_times(cmd, env) -> dict:
+    """{module: cumulative microseconds} from -X importtime."""
+    result = subprocess.run(
+        [cmd[0], '-X', 'importtime', *cmd[1:]], env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+        check=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def check_transfer(env, obj) -> bool:
+    """Send `obj` to a stand-in server and check what the send imported."""
+    try:
+        from sim_server import SimServer
+    except ImportError as e:
+        print(f'\nskipping the xsrv_send check: {e}')
+        return True
+
+    server = SimServer()
+    try:
+        modules = import_times(
+            command(['xsrv_send', '-p', server.port, str(obj)]), env)
+    finally:
+        server.close()
+
+    print(f'\nhpex xsrv_send: the server got {", ".join(server.files) or "nothing"}')
+    ok = obj.name in server.files
+    missing = sorted(m for m in TRANSFER_NEEDS if m not in modules)
+    if missing:
+        print(f'  never imported {", ".join(missing)}; did it send at all?')
+    bad = sorted(m for m in modules if m in TRANSFER_FORBIDDEN)
+    if bad:
+        print(f'  imported {", ".join(bad)}, which an XModem server send should never need')
+    return ok and not missing and not bad
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20,
+                        help='Runs of each command (default 20)')
+    parser.add_argument('--budget-ms', type=float, default=40,
+                        help='Most that hpex may add to a bare interpreter start, in ms (default 40)')
+    parser.add_argument('--top', type=int, default=8,
+                        help='How many of the slowest imports to list (default 8)')
+    args = parser.parse_args()
+
+    env = environment()
+    # something for -i to look at
+    obj = Path(env['HOME'], 'OBJ')
+    obj.write_bytes(b'HPHP48-R' + bytes(range(256)) * 4)
+
+    scenarios = {
+        'hpex --help': ['--help'],
+        'hpex -i': ['xsrv_send', '-i', str(obj)],
+    }
+
+    baseline = time_runs([sys.executable, '-c', 'pass'], env, args.runs)
+    print(f'bare interpreter: {baseline * 1000:.1f} ms')
+
+    failed = False
+    for name, argv in scenarios.items():
+        cmd = command(argv)
+        elapsed = time_runs(cmd, env, args.runs)
+        extra = (elapsed - baseline) * 1000
+        over = extra > args.budget_ms
+        print(f'\n{name}: {elapsed * 1000:.1f} ms to exit, '
+              f'{extra:.1f} ms over the interpreter '
+              f'(budget {args.budget_ms:.0f} ms){"  OVER BUDGET" if over else ""}')
+
+        modules = import_times(cmd, env)
+        for module, us in sorted(modules.items(), key=lambda m: -m[1])[:args.top]:
+            print(f'  {us / 1000:7.1f} ms  {module}')
+        bad = sorted(m for m in modules if m in FORBIDDEN)
+        if bad:
+            print(f'  imported {", ".join(bad)}, which {name} should never need')
+        failed |= over or bool(bad)
+
+    failed |= not check_transfer(env, obj)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
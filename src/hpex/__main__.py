@@ -1,6 +1,5 @@
 import sys
 import platform
-import logging
 
 _system = platform.system()
 
@@ -10,20 +9,141 @@ class HPex(object):
     # parses them and sends them to HPexCLI. Without arguments, it
     # calls HPexGUI and runs from there.
     def __init__(self):
-        # Disable logging from the xmodem package.
-       # logging.disable()
-        if len(sys.argv) > 1:
+        if len(sys.argv) > 1 and sys.argv[1] == 'deploy':
+            # deploy takes several ports and several files, so it has
+            # a parser of its own
+            import argparse
+            parser = argparse.ArgumentParser(
+                prog='hpex deploy',
+                description='Send the same files to several calculators at once. Every calculator should be running the XModem server.',
+                epilog="Give --ports once per port, or several separated by commas, and quote wildcards so that hpex expands them, for example:\n  hpex deploy --ports '/dev/ttyUSB*' LIB1.LIB LIB2.LIB\n  hpex deploy -p /dev/ttyUSB0 -p socket://lab:4000 LIB1.LIB",
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+
+            parser.add_argument(
+                '-p', '--ports', action='append', required=True, metavar='PORTS',
+                help='Serial ports (or socket:// URLs) to send to, separated by commas; quoted wildcards are expanded; can be given more than once')
+
+            parser.add_argument(
+                'files', metavar='FILES', nargs='+', help='Files to send')
+
+            parser.add_argument(
+                '-b', '--baud',
+                help='Baud rate for every port (default from settings)')
+
+            parser.add_argument(
+                '-r', '--retries', type=int, default=3,
+                help='Times to try each port before giving up (default 3)')
+
+            parser.add_argument(
+                '-f', '--finish',
+                action='store_true',
+                help='End the XModem servers after sending')
+
+            from hpex.deploy import HPexDeploy
+            HPexDeploy(parser.parse_args(sys.argv[2:]))
+
+        elif len(sys.argv) > 1 and sys.argv[1] == 'daemon':
+            import argparse
+            parser = argparse.ArgumentParser(
+                prog='hpex daemon',
+                description="Keep XModem server sessions open and take commands from 'hpex client'.")
+
+            parser.add_argument(
+                '-p', '--port', help='Default serial port (autodiscovered if not given)')
+
+            parser.add_argument(
+                '-b', '--baud',
+                help='Baud rate for every port (default from settings)')
+
+            from hpex.daemon import HPexDaemon
+            HPexDaemon(parser.parse_args(sys.argv[2:]))
+
+        elif len(sys.argv) > 1 and sys.argv[1] == 'shell':
+            import argparse
+            parser = argparse.ArgumentParser(
+                prog='hpex shell',
+                description='Run an FTP-style shell on one calculator, with one connection for the whole session.')
+
+            parser.add_argument(
+                'port', metavar='PORT', nargs='?',
+                help='Serial port to connect to (autodiscovered if not given)')
+
+            parser.add_argument(
+                '-b', '--baud',
+                help='Baud rate for port (default from settings)')
+
+            mode = parser.add_mutually_exclusive_group()
+            mode.add_argument(
+                '-x', '--xmodem', action='store_true',
+                help='Talk to the XModem server')
+            mode.add_argument(
+                '-k', '--kermit', action='store_true',
+                help='Talk to the Kermit server')
+
+            args = parser.parse_args(sys.argv[2:])
+            if not args.port:
+                from hpex.helpers import FileTools
+                args.port = FileTools.get_serial_ports(None)
+                if args.port == '':
+                    print("Error: could not autodiscover serial port. Specify one as PORT.")
+                    sys.exit(1)
+
+            from hpex.shell import HPexShell
+            HPexShell(args)
+
+        elif len(sys.argv) > 1 and sys.argv[1] == 'client':
+            # this has to stay quick, so nothing but argparse and
+            # daemon_client is imported
+            import argparse
+            parser = argparse.ArgumentParser(
+                prog='hpex client',
+                description="Run a command in a running 'hpex daemon'.")
+
+            parser.add_argument(
+                '-p', '--port', help="Port to use (default: the daemon's)")
+
+            parser.add_argument(
+                '--json', action='store_true', help='Print the raw JSON result')
+
+            methods = parser.add_subparsers(dest='method', metavar='METHOD', required=True)
+            list_parser = methods.add_parser('list', help='List the current directory')
+            list_parser.add_argument(
+                '-r', '--refresh', action='store_true', help="Don't use the daemon's cached listing")
+            cd_parser = methods.add_parser('cd', help="Change directory ('..' and 'HOME' work)")
+            cd_parser.add_argument('name', metavar='DIR')
+            get_parser = methods.add_parser('get', help='Get files into the current directory')
+            get_parser.add_argument('names', metavar='NAME', nargs='+')
+            get_parser.add_argument(
+                '-o', '--overwrite', action='store_true', help='Overwrite local files')
+            put_parser = methods.add_parser('put', help='Send files to the current directory')
+            put_parser.add_argument('files', metavar='FILE', nargs='+')
+            methods.add_parser('stats', help='Show sessions and timings')
+            shutdown_parser = methods.add_parser('shutdown', help='Stop the daemon')
+            shutdown_parser.add_argument(
+                '-f', '--finish', action='store_true', help='End the XModem servers too')
+
+            from hpex.daemon_client import HPexClient
+            HPexClient(parser.parse_args(sys.argv[2:]))
+
+        elif len(sys.argv) > 1:
             # import argparse later and only if needed
             import argparse
             desc = \
             """Transfer file to calculator. If a serial port is not specified, HPex will try to find one automatically.
 
 Commands:
-ksend       send FILE to Kermit server
-kget        get FILE from Kermit server and place in current directory
-xsend       send FILE to XRECV on calculator
-xsrv_send   send FILE to XModem server
-xsrv_get    get FILE from XModem server"""
+ksend       send FILEs to Kermit server
+kget        get FILEs from Kermit server and place in current directory
+xsend       send FILE to XRECV on calculator (one file only)
+xsrv_send   send FILEs to XModem server
+xsrv_get    get FILEs from XModem server
+
+Several FILEs go over one connection. Quoted wildcards are expanded
+for sends, and matched against the calculator's listing for xsrv_get.
+
+Run 'hpex deploy -h' to send files to several calculators at once,
+'hpex shell -h' for an interactive shell, and 'hpex daemon -h' and
+'hpex client -h' to keep a session open between commands."""
             
             # RawHelpTextFormatter https://stackoverflow.com/a/3853776
             parser = argparse.ArgumentParser(description=desc, formatter_class=argparse.RawTextHelpFormatter)
@@ -36,10 +156,10 @@ xsrv_get    get FILE from XModem server"""
             
             parser.add_argument(
                 'input_file', metavar='FILE',
-                nargs=1, help='File to send or receive')
+                nargs='+', help='Files to send or receive')
 
             parser.add_argument(
-                '-p', '--port', help='Serial port to connect to')
+                '-p', '--port', help='Serial port to connect to, or a socket://host:port or rfc2217://host:port URL')
             
             parser.add_argument(
                 '-b', '--baud',
@@ -60,9 +180,12 @@ xsrv_get    get FILE from XModem server"""
                 action='store_true',
                 help='Overwrite file if it already exists on local side')
             
+            # parse first, so --help and bad arguments don't wait
+            # for hpex_cli to import
+            args = parser.parse_args()
             from hpex.hpex_cli import HPexCLI
             #print(sys.modules.keys())
-            HPexCLI(parser.parse_args())
+            HPexCLI(args)
 
         else:
             # otherwise, do GUI
@@ -0,0 +1,565 @@
+import asyncio
+import binascii
+import codecs
+import os
+import pty
+import signal
+import threading
+from pathlib import Path
+
+from pubsub import pub
+
+from hpex.async_io import AsyncSerialTransport, run_in_background
+from hpex.hp_xmodem import hp_packet, hp_packet_count, read_payload, \
+    PreparedFile
+from hpex.kermit_pubsub import kermit_invocation, KERMIT_CANCEL_GRACE
+from hpex.settings import HPexSettingsTools
+from hpex.transport import is_network_port
+from hpex.tty_tuning import tune_port
+from hpex.xmodem_pubsub import parse_listing, DRAIN_IDLE_GAP, PATH_VAR, \
+    SAVE_PATH, RESTORE_PATH, DISCARD_PATH
+
+# asyncio versions of the protocols in xmodem_pubsub.py, hp_xmodem.py
+# and kermit_pubsub.py, built on AsyncSerialTransport. Nothing here
+# needs a thread, so something like
+#
+#     async with AsyncXModemServer.open(port, settings) as server:
+#         await server.send_file(path)
+#
+# can run on as many ports at once as there are calculators, and
+# wrapping a call in asyncio.wait_for() or cancelling its task works
+# the way you'd expect. Cancelling a transfer sends the CANs (or
+# Kermit's error packet) on the way out.
+#
+# At the bottom are adapters with the same run() and cancel() as the
+# threaded connectors, which publish the same pubsub topics. The GUI
+# uses them wherever async_io.can_drive() says the port allows it.
+
+SOH = b'\x01'
+STX = b'\x02'
+EOT = b'\x04'
+ACK = b'\x06'
+NAK = b'\x15'
+CAN = b'\x18'
+CRC = b'C'
+
+class XModemServerException(Exception):
+    """Raised when the XModem server doesn't answer, or answers with
+    something we can't use."""
+    pass
+
+
+class AsyncXModemServer:
+    def __init__(self, transport: AsyncSerialTransport, timeout=1):
+        self.transport = transport
+        # Sending 1029 bytes (one 1024-byte XModem packet) at 9600
+        # baud takes .86 seconds.
+        self.timeout = timeout
+        # whether connect() saved the calculator's path for
+        # disconnect() to go back to
+        self.path_saved = False
+
+    @classmethod
+    def open(cls, port, settings):
+        return _XModemServerContext(cls, port, settings)
+
+    @staticmethod
+    def checksum(s: bytes) -> int:
+        return sum(s) & 0xff
+
+    async def clear_extra_bytes(self):
+        """Wait for the line to go quiet, ACKing each burst of extra
+        data."""
+        while await self.transport.drain_input(DRAIN_IDLE_GAP):
+            self.transport.write(ACK)
+
+    async def send_command_packet(self, instr: str, command: bytes = b''):
+        """Send command packet `instr`, prefixed by the command byte
+        if there is one, and wait for the server to ACK it."""
+        # the calculator's character set (see hp48_codec.py), which
+        # xmodem_pubsub has registered
+        data = instr.encode('hp48')
+        packet = bytearray(command)
+        packet += len(data).to_bytes(2, 'big')
+        packet += data
+        packet.append(self.checksum(data))
+        self.transport.write(bytes(packet))
+        await self.transport.drain()
+
+        for _ in range(4):
+            try:
+                await self.transport.expect(ACK, self.timeout)
+                return
+            except asyncio.TimeoutError:
+                pass
+        raise XModemServerException(f'no ACK for {command + data}')
+
+    async def run_program(self, *programs: str):
+        """Run `programs` on the calculator, joined into one program,
+        with the 'E' command."""
+        await self.send_command_packet(' '.join(programs), command=b'E')
+
+    async def get_command_packet(self) -> bytes:
+        size = int.from_bytes(
+            await self.transport.read_exact(2, self.timeout), 'big')
+        data = await self.transport.read_exact(size + 1, self.timeout)
+        data, chk = data[:-1], data[-1]
+        if chk != self.checksum(data):
+            raise XModemServerException('bad checksum in command packet')
+        self.transport.write(ACK)
+        return data
+
+    async def memory_and_listing(self):
+        """Return (free memory, list of HPVariables) for the current
+        directory."""
+        await self.clear_extra_bytes()
+        self.transport.write(b'M')
+        memory = int(await self.get_command_packet())
+        await self.clear_extra_bytes()
+        self.transport.write(b'L')
+        return memory, parse_listing(await self.get_command_packet())
+
+    async def connect(self, reset_directory=False):
+        """Home the calculator, saving its path first if it should be
+        restored on disconnect, and return memory_and_listing()."""
+        await self.clear_extra_bytes()
+        await self.run_program(SAVE_PATH if reset_directory else DISCARD_PATH)
+        self.path_saved = reset_directory
+        return await self.memory_and_listing()
+
+    async def disconnect(self, finish=True):
+        """Put the calculator's path back if connect() saved it, and
+        end the server unless `finish` is False."""
+        await self.clear_extra_bytes()
+        if self.path_saved:
+            await self.run_program(RESTORE_PATH)
+            self.path_saved = False
+        if finish:
+            self.transport.write(b'Q')
+        await self.transport.drain()
+
+    async def send_file(self, path, retry=4, callback=None,
+                        pretranslate=False) -> bool:
+        """Send the file at `path` into the current directory with the
+        'P' command."""
+        return await self.send_data(
+            Path(path).name, read_payload(path, pretranslate),
+            retry=retry, callback=callback)
+
+    async def send_data(self, name, data: bytes, retry=4,
+                        callback=None) -> bool:
+        """send_file() for data that's already in memory, so one copy
+        can go to any number of calculators."""
+        await self.clear_extra_bytes()
+        await self.send_command_packet(name, command=b'P')
+        return await hp_xmodem_send(
+            self.transport, data, retry=retry, timeout=self.timeout,
+            callback=callback)
+
+    async def get_file(self, name, stream, retry=9, callback=None):
+        """Copy `name` from the current directory into `stream` with
+        the 'G' command. Returns the number of bytes received."""
+        await self.send_command_packet(name, command=b'G')
+        return await xmodem_receive(
+            self.transport, stream, retry=retry, timeout=self.timeout,
+            callback=callback)
+
+
+class _XModemServerContext:
+    def __init__(self, cls, port, settings):
+        self.cls = cls
+        self.port = port
+        self.settings = settings
+
+    async def __aenter__(self):
+        self.transport = await AsyncSerialTransport.open(
+            self.port, self.settings)
+        return self.cls(self.transport)
+
+    async def __aexit__(self, *exc):
+        self.transport.close()
+
+
+async def hp_xmodem_send(transport, data: bytes, retry=4, timeout=1,
+                         callback=None) -> bool:
+    """Send `data` with HP's 'D'-mode XModem. This is HPXModem.send()
+    in hp_xmodem.py, without the thread."""
+    # the calculator asks for the transfer with 'D'
+    for _ in range(retry):
+        try:
+            await transport.expect(b'D', timeout)
+            break
+        except asyncio.TimeoutError:
+            pass
+    else:
+        return False
+
+    total_packets = 0
+    success_count = 0
+    error_count = 0
+    offset = 0
+    try:
+        while offset < len(data):
+            # 1024-byte packets as much as possible, so that
+            # cancelling works quickly
+            size = 1024 if len(data) - offset >= 1024 else 128
+            chunk = data[offset:offset + size].ljust(size, b'\x00')
+            packet = hp_packet(success_count + 1, chunk)
+
+            acked = False
+            transport.write(packet)
+            for _ in range(retry):
+                try:
+                    reply = await transport.expect(ACK + NAK + CAN, timeout)
+                except asyncio.TimeoutError:
+                    continue
+                if reply == ACK:
+                    acked = True
+                    break
+                if reply == CAN:
+                    return False
+                # NAK: the same packet again
+                transport.write(packet)
+
+            total_packets += 1
+            if acked:
+                error_count = 0
+                success_count += 1
+                offset += size
+            else:
+                if error_count == retry:
+                    return False
+                error_count += 1
+
+            if callable(callback):
+                callback(total_packets, success_count, error_count)
+
+        transport.write(EOT)
+        await transport.drain()
+        return True
+
+    except asyncio.CancelledError:
+        # in place of the next packet
+        transport.write(CAN * 3)
+        await transport.drain()
+        raise
+
+
+async def xmodem_receive(transport, stream, retry=9, timeout=1,
+                         callback=None) -> int:
+    """Receive a standard XModem transfer into `stream`, in CRC mode
+    if the sender does it, and return how many bytes came in. Raises
+    XModemServerException on failure."""
+    income_size = 0
+    sequence = 1
+    error_count = 0
+    # ask for CRC mode first, like the xmodem module does
+    start = CRC
+    try:
+        transport.write(start)
+        while True:
+            try:
+                header = await transport.read(1, timeout)
+            except asyncio.TimeoutError:
+                error_count += 1
+                if error_count > retry:
+                    raise XModemServerException('sender stopped responding')
+                if sequence == 1 and error_count > retry // 2:
+                    start = NAK # fall back to checksum mode
+                transport.write(start if sequence == 1 else NAK)
+                continue
+
+            if header == EOT:
+                transport.write(ACK)
+                return income_size
+            if header == CAN:
+                raise XModemServerException('sender cancelled')
+            if header not in (SOH, STX):
+                continue
+
+            crc_mode = start == CRC
+            size = 128 if header == SOH else 1024
+            body = await transport.read_exact(
+                2 + size + (2 if crc_mode else 1), timeout)
+            seq, seq_inv, payload = body[0], body[1], body[2:2 + size]
+            check = body[2 + size:]
+            if crc_mode:
+                valid = int.from_bytes(check, 'big') == binascii.crc_hqx(payload, 0)
+            else:
+                valid = check[0] == sum(payload) & 0xff
+
+            if valid and seq == 0xff - seq_inv:
+                if seq == sequence & 0xff:
+                    stream.write(payload)
+                    income_size += len(payload)
+                    sequence += 1
+                    error_count = 0
+                    if callable(callback):
+                        callback(sequence - 1, sequence - 1, error_count)
+                    transport.write(ACK)
+                    continue
+                if seq == (sequence - 1) & 0xff:
+                    # a repeat of the last block (our ACK got lost)
+                    # only needs another ACK
+                    transport.write(ACK)
+                    continue
+
+            error_count += 1
+            if error_count > retry:
+                raise XModemServerException('too many bad blocks')
+            await transport.drain_input(timeout)
+            transport.write(NAK)
+
+    except asyncio.CancelledError:
+        transport.write(CAN * 2)
+        await transport.drain()
+        raise
+
+
+class AsyncKermit:
+    """Runs Kermit on a pty, with the pty watched by the event loop
+    instead of a thread."""
+    def __init__(self, port, settings):
+        self.port = port
+        self.settings = settings
+        self.out = ''
+
+    async def run(self, command, on_output=None) -> int:
+        """Run `command` and return Kermit's exit code. Everything
+        Kermit prints is collected in self.out, and passed to
+        on_output as it arrives."""
+        loop = asyncio.get_running_loop()
+        if self.settings.get('low_latency') and not is_network_port(self.port):
+            tune_port(self.port)
+        master, slave = pty.openpty()
+        try:
+            self.proc = await asyncio.create_subprocess_exec(
+                *kermit_invocation(self.settings, command, self.port),
+                stdin=slave, stdout=slave, stderr=slave,
+                start_new_session=True)
+        except BaseException:
+            # no Kermit (or cancelled before it started), so nothing
+            # will read the master either
+            os.close(master)
+            raise
+        finally:
+            # Kermit has its own copy now, and we need ours closed to
+            # see EOF when it exits
+            os.close(slave)
+
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        output = asyncio.Queue()
+        def on_readable():
+            try:
+                data = os.read(master, 4096)
+            except OSError:
+                data = b''
+            if not data:
+                loop.remove_reader(master)
+            output.put_nowait(data)
+        loop.add_reader(master, on_readable)
+
+        try:
+            while True:
+                data = await output.get()
+                if not data:
+                    break
+                # no bells in the output
+                text = decoder.decode(data).replace(chr(7), '')
+                self.out += text
+                if callable(on_output):
+                    on_output(text)
+            return await self.proc.wait()
+
+        except asyncio.CancelledError:
+            await self._stop(master)
+            raise
+
+        finally:
+            loop.remove_reader(master)
+            os.close(master)
+
+    async def _stop(self, master):
+        # 'E' at Kermit's file transfer display sends an error packet
+        # so the calculator stops too. It doesn't always work, so
+        # Kermit gets killed if it's still around after the grace
+        # period.
+        try:
+            os.write(master, b'E')
+        except OSError:
+            pass
+        try:
+            await asyncio.wait_for(self.proc.wait(), KERMIT_CANCEL_GRACE)
+        except asyncio.TimeoutError:
+            print('kermit ignored the error packet request, killing it')
+            self.proc.send_signal(signal.SIGKILL)
+            await self.proc.wait()
+
+
+# These have the same run() and cancel() as XModemConnector and
+# KermitConnector, so they can be dropped in wherever those are
+# used. run() blocks the calling thread (normally a PortCoordinator
+# worker) until the operation finishes on the background loop.
+
+class _Publisher:
+    def __init__(self, ptopic, use_callafter):
+        self.ptopic = ptopic
+        self.use_callafter = use_callafter
+
+    def __call__(self, event, **kwargs):
+        topic = f'{event}.{self.ptopic}'
+        if self.use_callafter:
+            import wx
+            wx.CallAfter(pub.sendMessage, topic, **kwargs)
+        else:
+            pub.sendMessage(topic, **kwargs)
+
+
+class _AsyncAdapter:
+    future = None
+    cancelled = False
+
+    def _run_on_loop(self, coro):
+        if self.cancelled:
+            coro.close()
+            return
+        finished = threading.Event()
+        self.future = run_in_background(self._until_finished(coro, finished))
+        try:
+            self.future.result()
+        except BaseException:
+            # the coroutine reports its own failures
+            pass
+        # A cancelled future is done straight away, but the coroutine
+        # still has to send its CANs and report back.
+        finished.wait()
+
+    @staticmethod
+    async def _until_finished(coro, finished):
+        try:
+            await coro
+        finally:
+            finished.set()
+
+    def cancel(self):
+        self.cancelled = True
+        if self.future is not None:
+            self.future.cancel()
+
+
+class AsyncXModemConnector(_AsyncAdapter):
+    """XModemConnector on the event loop, for one command and one
+    file at a time (the CLI's batches stay with XModemConnector)."""
+    def run(self, port, parent, fname, command, current_path, ptopic,
+            use_callafter=True, alt_options=None):
+        self.command = command
+        self.publish = _Publisher(ptopic, use_callafter)
+        settings = alt_options or HPexSettingsTools.load_settings()
+        self._run_on_loop(
+            self._run(port, fname, command, current_path, settings))
+
+    async def _run(self, port, fname, command, current_path, settings):
+        try:
+            async with AsyncXModemServer.open(port, settings) as server:
+                if command == 'connect':
+                    # decided once, like XModemConnector does
+                    path_saved = settings['reset_directory_on_disconnect']
+                    mem, varlist = await server.connect(path_saved)
+                    self.publish('xmodem.connectdone', mem=mem,
+                                 varlist=varlist, path_saved=path_saved)
+                elif command == 'disconnect':
+                    # fname is PATH_VAR if connecting saved the path
+                    server.path_saved = fname == PATH_VAR
+                    await server.disconnect()
+                    self.publish('xmodem.disconnectdone')
+                elif command == 'refresh':
+                    mem, varlist = await server.memory_and_listing()
+                    self.publish('xmodem.refreshdone', mem=mem, varlist=varlist)
+                elif command == 'send_connect':
+                    await self._send(server, fname, settings)
+                elif 'get_connect' in command:
+                    await self._get(server, fname, command, current_path)
+                elif command in ('chdir', 'updir', 'home'):
+                    program = {'chdir': fname, 'updir': 'UPDIR', 'home': 'HOME'}
+                    await server.clear_extra_bytes()
+                    await server.run_program(program[command])
+                    self.publish('xmodem.done')
+
+        except asyncio.CancelledError:
+            self.publish('xmodem.cancelled')
+            raise
+        except Exception as e:
+            print(f'{command} on {port} failed:', repr(e))
+            self.publish('xmodem.failed', cmd=command)
+
+    async def _send(self, server, fname, settings):
+        # a path is read (and pretranslated) the way XModemConnector
+        # reads it
+        if not isinstance(fname, PreparedFile):
+            fname = PreparedFile.read(fname, settings['pretranslate_ascii'])
+        packet_count = hp_packet_count(len(fname.data))
+        def callback(total_packets, success_count, error_count):
+            if success_count == packet_count:
+                self.publish('xmodem.done', file_count=packet_count,
+                             total=total_packets, success=success_count,
+                             error=error_count)
+            else:
+                self.publish('xmodem.newdata', file_count=packet_count,
+                             total=total_packets, success=success_count,
+                             error=error_count, should_update=True)
+
+        if not await server.send_data(fname.name, fname.data, callback=callback):
+            self.publish('xmodem.failed', cmd=self.command)
+
+    async def _get(self, server, fname, command, current_path):
+        # the same not-overwriting names Kermit makes, as in
+        # XModemConnector
+        final_name = original_name = Path(current_path, fname).expanduser()
+        if command != 'get_connect_overwrite':
+            counter = 1
+            while final_name.exists():
+                final_name = Path(original_name.parent, f'{original_name.name}.~{counter}~')
+                counter += 1
+
+        with final_name.open('wb') as stream:
+            await server.get_file(fname, stream)
+        self.publish('xmodem.done', file_count=0, total=0, success=0, error=0)
+
+
+class AsyncKermitConnector(_AsyncAdapter):
+    """KermitConnector on the event loop."""
+    def run(self, port, parent, command, ptopic, do_newdata_event=True,
+            use_callafter=True, alt_options=None, use_wx=True):
+        self.command = command
+        self.publish = _Publisher(ptopic, use_callafter)
+        self.kermit = AsyncKermit(
+            port, alt_options or HPexSettingsTools.load_settings())
+        self._run_on_loop(self._run(command, do_newdata_event))
+
+    async def _run(self, command, do_newdata_event):
+        def on_output(text):
+            if do_newdata_event:
+                self.publish('kermit.newdata', data=text, cmd=command)
+
+        try:
+            returncode = await self.kermit.run(command, on_output)
+        except asyncio.CancelledError:
+            self.publish('kermit.cancelled', cmd=command, out=self.kermit.out)
+            raise
+        except OSError as e:
+            # Kermit isn't installed, or couldn't be started
+            self.publish('kermit.failed', cmd=command, out=str(e))
+            return
+
+        event = 'kermit.done' if returncode == 0 else 'kermit.failed'
+        self.publish(event, cmd=command, out=self.kermit.out)
+
+    # the names KermitConnector's callers use
+    def cancel_kermit(self):
+        self.cancel()
+
+    def kill_kermit(self):
+        self.cancel()
+
+    def isalive(self):
+        return self.future is not None and not self.future.done()
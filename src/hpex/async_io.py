@@ -0,0 +1,204 @@
+import asyncio
+import os
+import platform
+import threading
+
+from hpex.transport import open_serial, open_socket
+
+_system = platform.system()
+
+# The connectors in xmodem_pubsub.py and kermit_pubsub.py block on
+# every read, so each one needs a thread of its own and a port can
+# only ever do one thing per thread. This is the asyncio version of the
+# bottom layer: the serial port's file descriptor is watched by the
+# event loop, so one thread can run as many ports as we like, and
+# timeouts and cancellation are just asyncio's.
+#
+# async_connectors.py has the protocols on top of this.
+
+def can_drive(port) -> bool:
+    """Whether the asyncio layer can run `port` here. On Windows the
+    event loop can't watch a serial port (and there are no ptys for
+    Kermit), and rfc2217:// ports have no fd to watch, so those stay
+    with the threaded connectors."""
+    return _system != 'Windows' and not port.startswith('rfc2217://')
+
+
+class AsyncSerialTransport:
+    """A serial port driven by the event loop. Data is read as soon as
+    it arrives and kept in a buffer, so the read methods only wait if
+    there isn't enough there yet.
+
+    Anything that times out raises asyncio.TimeoutError.
+
+    `ser` can also be a connected socket, for socket:// ports."""
+    def __init__(self, ser, name=None):
+        # pyserial is only used to open the port and set up termios;
+        # all the reading and writing is done on the fd directly.
+        self.ser = ser
+        self.name = name or ser.port
+        self.fd = ser.fileno()
+        os.set_blocking(self.fd, False)
+        self.loop = asyncio.get_running_loop()
+        self.buffer = bytearray()
+        self.eof = False
+        self._waiter = None
+        self._pending_writes = bytearray()
+        self._write_waiter = None
+        self.loop.add_reader(self.fd, self._on_readable)
+
+    @classmethod
+    async def open(cls, port, settings):
+        # opening can block for a moment, so don't do it on the loop
+        loop = asyncio.get_running_loop()
+        if port.startswith('socket://'):
+            sock = await loop.run_in_executor(None, open_socket, port)
+            return cls(sock, port)
+        if port.startswith('rfc2217://'):
+            # pyserial runs the telnet side of these in a thread of its
+            # own, with no fd for us to watch
+            raise ValueError(
+                f"{port}: rfc2217:// ports need the threaded connectors")
+        ser = await loop.run_in_executor(None, open_serial, port, settings)
+        return cls(ser)
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            # the port went away (a USB adapter got unplugged, say)
+            data = b''
+
+        if data:
+            self.buffer.extend(data)
+        else:
+            self.eof = True
+            self.loop.remove_reader(self.fd)
+
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def _wait_for_data(self, timeout):
+        if self.eof:
+            raise ConnectionError(f'{self.name} closed')
+        self._waiter = self.loop.create_future()
+        try:
+            await asyncio.wait_for(self._waiter, timeout)
+        finally:
+            self._waiter = None
+
+    async def read(self, n=1, timeout=None) -> bytes:
+        """Return up to `n` bytes, waiting only if none have arrived."""
+        if not self.buffer:
+            await self._wait_for_data(timeout)
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+    async def read_exact(self, n, timeout=None) -> bytes:
+        """Return exactly `n` bytes. `timeout` is for the whole read,
+        not for each byte."""
+        deadline = None if timeout is None else self.loop.time() + timeout
+        while len(self.buffer) < n:
+            left = None if deadline is None else max(0, deadline - self.loop.time())
+            await self._wait_for_data(left)
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+    async def expect(self, expected: bytes, timeout=None) -> bytes:
+        """Discard input until one of the bytes in `expected` arrives,
+        and return it."""
+        deadline = None if timeout is None else self.loop.time() + timeout
+        while True:
+            for i, c in enumerate(self.buffer):
+                if c in expected:
+                    del self.buffer[:i + 1]
+                    return bytes([c])
+            self.buffer.clear()
+            left = None if deadline is None else max(0, deadline - self.loop.time())
+            await self._wait_for_data(left)
+
+    async def drain_input(self, idle_gap) -> bytes:
+        """Wait until the line has been quiet for `idle_gap` seconds,
+        and return everything that arrived (including anything that
+        was already buffered)."""
+        while True:
+            try:
+                await self._wait_for_data(idle_gap)
+            except asyncio.TimeoutError:
+                break
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+    def write(self, data: bytes):
+        """Queue `data` to be written. Call drain() to wait until it
+        has all gone to the port."""
+        if not self._pending_writes:
+            try:
+                written = os.write(self.fd, data)
+            except BlockingIOError:
+                written = 0
+            data = data[written:]
+            if not data:
+                return
+            self.loop.add_writer(self.fd, self._on_writable)
+        self._pending_writes.extend(data)
+
+    def _on_writable(self):
+        try:
+            written = os.write(self.fd, self._pending_writes)
+        except BlockingIOError:
+            return
+        del self._pending_writes[:written]
+        if not self._pending_writes:
+            self.loop.remove_writer(self.fd)
+            if self._write_waiter is not None and not self._write_waiter.done():
+                self._write_waiter.set_result(None)
+
+    async def drain(self):
+        if self._pending_writes:
+            self._write_waiter = self.loop.create_future()
+            try:
+                await self._write_waiter
+            finally:
+                self._write_waiter = None
+        # wait for the UART to actually send it, without holding up
+        # the loop (a socket has nothing like that)
+        if hasattr(self.ser, 'flush'):
+            await self.loop.run_in_executor(None, self.ser.flush)
+
+    def close(self):
+        self.loop.remove_reader(self.fd)
+        self.loop.remove_writer(self.fd)
+        self.ser.close()
+
+
+# The GUI runs wx's main loop, not asyncio's, so the adapters at the
+# bottom of async_connectors.py (AsyncXModemConnector and
+# AsyncKermitConnector) run their coroutines on a single event loop in
+# a background thread. Every port shares it.
+_background_loop = None
+_background_loop_lock = threading.Lock()
+
+def background_loop() -> asyncio.AbstractEventLoop:
+    """Return the shared background event loop, starting it if it
+    isn't running yet."""
+    global _background_loop
+    with _background_loop_lock:
+        if _background_loop is None:
+            _background_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_background_loop.run_forever,
+                name='hpex asyncio',
+                daemon=True).start()
+        return _background_loop
+
+def run_in_background(coro):
+    """Schedule `coro` on the background loop and return a
+    concurrent.futures.Future for its result. Cancelling the future
+    cancels the coroutine."""
+    return asyncio.run_coroutine_threadsafe(coro, background_loop())
@@ -0,0 +1,62 @@
+import selectors
+import socket
+import time
+
+# Cancelling used to mean setting a flag and waiting for whatever
+# blocking read was in progress to time out (up to a second for
+# XModem), or killing Kermit outright. Now every wait on the serial
+# port (in transport.py) or on Kermit's pty is done with a selector
+# that also watches a wake-up socket. Cancelling makes that socket
+# readable, so the loop doing the I/O wakes up right away and can send
+# the CANs or Kermit's error packet itself.
+#
+# This is a socketpair instead of os.pipe() because it works with
+# select() on Windows too, and because the sockets close themselves
+# when they're garbage collected, so a connector that bails out early
+# doesn't leak file descriptors.
+
+class CancelPipe:
+    def __init__(self):
+        self._r, self._w = socket.socketpair()
+        self._r.setblocking(False)
+        self._w.setblocking(False)
+        # when set() was first called, so we can tell how long it
+        # took the I/O loop to notice
+        self.set_at = None
+
+    def set(self):
+        """Wake up anything waiting on this pipe. Stays set."""
+        if self.set_at is not None:
+            return
+        self.set_at = time.monotonic()
+        try:
+            self._w.send(b'\x00')
+        except OSError:
+            # already closed, so nothing is waiting on it
+            pass
+
+    def is_set(self) -> bool:
+        return self.set_at is not None
+
+    def elapsed(self) -> float:
+        """Seconds since set() was called."""
+        return time.monotonic() - self.set_at
+
+    def fileno(self) -> int:
+        return self._r.fileno()
+
+    def wait(self, fileobj, timeout=None) -> bool:
+        """Wait until `fileobj` is readable, the pipe is set, or
+        `timeout` seconds pass. Returns True only if `fileobj` is
+        readable and we haven't been cancelled."""
+        if self.is_set():
+            return False
+        with selectors.DefaultSelector() as selector:
+            selector.register(fileobj, selectors.EVENT_READ)
+            selector.register(self, selectors.EVENT_READ)
+            events = selector.select(timeout)
+        return bool(events) and not self.is_set()
+
+    def close(self):
+        self._r.close()
+        self._w.close()
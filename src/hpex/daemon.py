@@ -0,0 +1,238 @@
+import asyncio
+import json
+import os
+import platform
+import socket
+import sys
+import time
+import traceback
+
+_system = platform.system()
+
+from hpex.async_connectors import XModemServerException
+from hpex.daemon_client import socket_path
+from hpex.helpers import FileTools
+from hpex.sessions import XModemSession, SessionError
+from hpex.settings import HPexSettingsTools
+
+# `hpex daemon` keeps the XModem server sessions open between
+# commands. Every plain `hpex` call starts Python, loads the settings,
+# finds a port, opens it and connects before it can do anything, and a
+# script that runs ten commands pays for all of that ten times. The
+# daemon pays once, and `hpex client` (daemon_client.py) just sends it
+# a line of JSON.
+#
+# The API is JSON-RPC 2.0 over a UNIX socket, one request per line:
+#
+#     list      [port] [refresh]         -> path, memory, objects
+#     cd        name [port]              -> path ('..' and 'HOME' work)
+#     get       name dest [overwrite] [port] -> path, bytes
+#     put       path [port]              -> name, bytes
+#     stats                              -> sessions and timings
+#     shutdown  [finish]
+#
+# `port` defaults to the one the daemon was started with. Each port
+# gets its own session, opened on first use, and requests for the same
+# port are run one at a time. If the calculator stops answering, the
+# session is closed, and the next request opens it again.
+#
+# Only the XModem server is supported: Kermit runs one process per
+# command, so there's no session to keep.
+
+# JSON-RPC error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+# anything that went wrong talking to the calculator
+CALCULATOR_ERROR = -32000
+
+
+class RPCError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class HPexDaemon:
+    # the methods that run against a port, with their required and
+    # optional parameters
+    PORT_METHODS = {
+        'list': ((), ('refresh',)),
+        'cd': (('name',), ()),
+        'get': (('name', 'dest'), ('overwrite',)),
+        'put': (('path',), ()),
+    }
+
+    def __init__(self, args):
+        if _system == 'Windows':
+            print('Error: the daemon is not available on Windows.')
+            sys.exit(1)
+
+        self.settings = HPexSettingsTools.load_settings()
+        if args.baud:
+            # the loaded settings are read-only
+            self.settings = dict(self.settings, baud_rate=args.baud)
+
+        if args.port:
+            self.default_port = args.port
+        else:
+            self.default_port = FileTools.get_serial_ports(None)
+            if self.default_port == '':
+                print("Error: could not autodiscover serial port. Specify one with '-p'.")
+                sys.exit(1)
+            print(f'Using autodiscovered port {self.default_port}.')
+
+        self.path = socket_path()
+        self.sessions = {}
+        self.stats = {}
+        self.started = time.time()
+        asyncio.run(self.serve())
+
+    def remove_stale_socket(self):
+        if not self.path.exists():
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(str(self.path))
+        except ConnectionRefusedError:
+            # left over from a daemon that didn't exit cleanly
+            self.path.unlink()
+        else:
+            print(f'Error: an HPex daemon is already listening on {self.path}.')
+            sys.exit(1)
+        finally:
+            probe.close()
+
+    async def serve(self):
+        self.remove_stale_socket()
+        self.stopping = asyncio.Event()
+        server = await asyncio.start_unix_server(self.handle_client, str(self.path))
+        os.chmod(self.path, 0o600)
+        print(f'HPex daemon listening on {self.path}, default port {self.default_port}.')
+        try:
+            async with server:
+                await self.stopping.wait()
+        finally:
+            self.path.unlink(missing_ok=True)
+
+    async def handle_client(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                reply = await self.handle_request(line)
+                writer.write(json.dumps(reply).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, line) -> dict:
+        request_id = None
+        try:
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise RPCError(PARSE_ERROR, str(e))
+            if not isinstance(request, dict) or 'method' not in request:
+                raise RPCError(INVALID_REQUEST, 'not a JSON-RPC request')
+            request_id = request.get('id')
+            params = request.get('params') or {}
+            if not isinstance(params, dict):
+                raise RPCError(INVALID_PARAMS, 'params must be an object')
+            result = await self.dispatch(request['method'], params)
+            return {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+        except RPCError as e:
+            return {'jsonrpc': '2.0', 'id': request_id,
+                    'error': {'code': e.code, 'message': str(e)}}
+        except Exception as e:
+            # A bug of ours, not the client's or the calculator's. It
+            # goes in the daemon's output, and the client gets an
+            # error instead of losing its connection.
+            traceback.print_exc()
+            return {'jsonrpc': '2.0', 'id': request_id,
+                    'error': {'code': INTERNAL_ERROR, 'message': repr(e)}}
+
+    async def dispatch(self, method, params):
+        if method == 'stats':
+            return self.get_stats()
+        if method == 'shutdown':
+            for session in self.sessions.values():
+                async with session.lock:
+                    await session.close(bool(params.get('finish')))
+            self.stopping.set()
+            return {}
+        if method not in self.PORT_METHODS:
+            raise RPCError(METHOD_NOT_FOUND, f"no method '{method}'")
+
+        port = params.pop('port', None) or self.default_port
+        required, optional = self.PORT_METHODS[method]
+        missing = set(required) - set(params)
+        if missing:
+            raise RPCError(INVALID_PARAMS, f"{method} needs {', '.join(sorted(missing))}")
+        unknown = set(params) - set(required) - set(optional)
+        if unknown:
+            raise RPCError(INVALID_PARAMS, f"unknown params for {method}: {', '.join(sorted(unknown))}")
+
+        session = self.sessions.get(port)
+        if session is None:
+            session = self.sessions[port] = XModemSession(port, self.settings)
+
+        stats = self.stats.setdefault(method, {'calls': 0, 'errors': 0, 'total_ms': 0.0})
+        stats['calls'] += 1
+        start = time.perf_counter()
+        async with session.lock:
+            session.requests += 1
+            try:
+                await session.ensure_open()
+                return await self.call(session, method, **params)
+            except SessionError as e:
+                stats['errors'] += 1
+                raise RPCError(INVALID_PARAMS, str(e))
+            except (XModemServerException, asyncio.TimeoutError,
+                    OSError, ValueError) as e:
+                stats['errors'] += 1
+                # start over with a fresh connection next time
+                session.drop()
+                raise RPCError(CALCULATOR_ERROR, f'{port}: {e!r}')
+            except Exception:
+                # handle_request() reports it
+                stats['errors'] += 1
+                raise
+            finally:
+                stats['total_ms'] += (time.perf_counter() - start) * 1000
+
+    @staticmethod
+    async def call(session, method, refresh=False, name=None, dest=None,
+                   overwrite=False, path=None) -> dict:
+        if method == 'list':
+            memory, objects = await session.listing(refresh)
+            return {'path': session.hp_path, 'memory': memory,
+                    'objects': [{'name': o.name, 'size': o.size,
+                                 'vtype': o.vtype, 'crc': o.crc}
+                                for o in objects]}
+        if method == 'cd':
+            await session.cd(name)
+            return {'path': session.hp_path}
+        if method == 'get':
+            dest = await session.get(name, dest, overwrite)
+            return {'path': str(dest), 'bytes': dest.stat().st_size}
+        if method == 'put':
+            return {'name': os.path.basename(path),
+                    'bytes': await session.put(path)}
+
+    def get_stats(self) -> dict:
+        return {
+            'uptime': round(time.time() - self.started, 1),
+            'default_port': self.default_port,
+            'sessions': {
+                port: {'open': s.is_open,
+                       'path': s.hp_path,
+                       'opened': s.opened,
+                       'requests': s.requests}
+                for port, s in self.sessions.items()},
+            'methods': {
+                method: dict(s, mean_ms=round(s['total_ms'] / s['calls'], 2))
+                for method, s in self.stats.items()},
+        }
@@ -0,0 +1,116 @@
+import json
+import os
+import socket
+import sys
+import tempfile
+from pathlib import Path
+
+# The client side of `hpex daemon`. This is imported on every `hpex
+# client` call, which is supposed to cost next to nothing, so it must
+# not import anything heavier than the standard library: no pyserial,
+# no pubsub, none of the connectors.
+
+def socket_path() -> Path:
+    """Where the daemon listens. $XDG_RUNTIME_DIR is private to the
+    user already; the temp dir isn't, so the name has the uid in it and
+    the daemon makes the socket owner-only."""
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return Path(runtime_dir, 'hpex.sock')
+    return Path(tempfile.gettempdir(), f'hpex-{os.getuid()}.sock')
+
+
+class DaemonError(Exception):
+    """An error reply from the daemon."""
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class DaemonClient:
+    """A connection to the daemon. Requests are JSON-RPC 2.0, one per
+    line."""
+    def __init__(self, path=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(str(path or socket_path()))
+        self.reader = self.sock.makefile('rb')
+        self.next_id = 1
+
+    def call(self, method, **params):
+        request = {'jsonrpc': '2.0', 'id': self.next_id,
+                   'method': method, 'params': params}
+        self.next_id += 1
+        self.sock.sendall(json.dumps(request).encode() + b'\n')
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError('the daemon closed the connection')
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise DaemonError(reply['error']['code'], reply['error']['message'])
+        return reply['result']
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+class HPexClient:
+    def __init__(self, args):
+        if not hasattr(socket, 'AF_UNIX'):
+            print('Error: the daemon is not available on Windows.')
+            sys.exit(1)
+        try:
+            client = DaemonClient()
+        except (FileNotFoundError, ConnectionRefusedError):
+            print("Error: no HPex daemon is running. Start one with 'hpex daemon'.")
+            sys.exit(1)
+
+        params = {}
+        if args.port:
+            params['port'] = args.port
+
+        try:
+            if args.method == 'list':
+                result = client.call('list', refresh=args.refresh, **params)
+            elif args.method == 'cd':
+                result = client.call('cd', name=args.name, **params)
+            elif args.method == 'get':
+                # the daemon has its own working directory, so paths
+                # always go over as absolute ones
+                result = [client.call('get', name=name, dest=os.getcwd(),
+                                      overwrite=args.overwrite, **params)
+                          for name in args.names]
+            elif args.method == 'put':
+                result = [client.call('put', path=os.path.abspath(f), **params)
+                          for f in args.files]
+            elif args.method == 'stats':
+                result = client.call('stats')
+            elif args.method == 'shutdown':
+                result = client.call('shutdown', finish=args.finish)
+        except DaemonError as e:
+            print(f'Error: {e}')
+            sys.exit(1)
+        finally:
+            client.close()
+
+        if args.json:
+            print(json.dumps(result, indent=2))
+        else:
+            self.show(args.method, result)
+
+    @staticmethod
+    def show(method, result):
+        if method == 'list':
+            print('{ ' + ' '.join(result['path']) + ' }', f"{result['memory']} bytes free")
+            for o in result['objects']:
+                print(f"{o['name']:<16} {o['size']:>10} {o['vtype']:<20} {o['crc']}")
+        elif method == 'cd':
+            print('{ ' + ' '.join(result['path']) + ' }')
+        elif method == 'get':
+            for r in result:
+                print(f"{r['path']} ({r['bytes']} bytes)")
+        elif method == 'put':
+            for r in result:
+                print(f"{r['name']} ({r['bytes']} bytes)")
+        elif method == 'stats':
+            print(json.dumps(result, indent=2))
@@ -0,0 +1,239 @@
+import asyncio
+import glob
+import os
+import platform
+import shutil
+import stat
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+_system = platform.system()
+
+from hpex.async_connectors import AsyncXModemServer, XModemServerException
+from hpex.hp_xmodem import hp_packet_count, read_payload
+from hpex.settings import HPexSettingsTools
+
+# `hpex deploy` sends the same files to a whole set of calculators at
+# once, like a classroom's worth of them all running the XModem server.
+#
+# Everything runs on one asyncio loop, with a session per port (see
+# async_connectors.py), so a slow or broken calculator only holds up
+# itself. The files are read once, before any port is opened; every session sends from the same bytes objects. A port that
+# fails is retried on its own, from the first file it hasn't finished,
+# up to --retries times.
+
+# how long a port waits before trying again
+RETRY_DELAY = 1
+
+# how often the status table is redrawn
+REDRAW_INTERVAL = .25
+
+
+@dataclass(frozen=True)
+class PayloadFile:
+    name: str
+    data: bytes
+
+    @classmethod
+    def read(cls, path, pretranslate=False):
+        data = read_payload(path, pretranslate)
+        return cls(Path(path).name, data)
+
+
+@dataclass
+class PortSession:
+    """The state of one port, which is what the status table shows."""
+    port: str
+    state: str = 'waiting'
+    file: str = ''
+    packets: int = 0
+    total_packets: int = 0
+    attempts: int = 0
+    bytes_sent: int = 0
+    sent: list = field(default_factory=list)
+    error: str = ''
+    started: float = 0
+    finished: float = 0
+
+    @property
+    def elapsed(self) -> float:
+        if not self.started:
+            return 0
+        return (self.finished or time.monotonic()) - self.started
+
+
+async def deploy_to_port(session, payload, settings, retries, finish):
+    """Send every file in `payload` to `session.port`, retrying the
+    whole connection up to `retries` times."""
+    reset_directory = settings['reset_directory_on_disconnect']
+    session.started = time.monotonic()
+
+    def progress(total, success, errors):
+        session.packets = success
+
+    while session.attempts < retries:
+        session.attempts += 1
+        try:
+            session.state = 'connecting'
+            async with AsyncXModemServer.open(session.port, settings) as server:
+                await server.connect(reset_directory)
+                for f in payload:
+                    if f.name in session.sent:
+                        continue
+                    session.state = 'sending'
+                    session.file = f.name
+                    session.packets = 0
+                    session.total_packets = hp_packet_count(len(f.data))
+                    if not await server.send_data(
+                            f.name, f.data, callback=progress):
+                        raise XModemServerException(
+                            f"calculator didn't take {f.name}")
+                    session.sent.append(f.name)
+                    session.bytes_sent += len(f.data)
+
+                session.state = 'finishing'
+                session.file = ''
+                await server.disconnect(finish)
+
+            session.state = 'done'
+            session.error = ''
+            break
+
+        except (XModemServerException, asyncio.TimeoutError,
+                OSError, ValueError) as e:
+            session.error = str(e) or type(e).__name__
+            if session.attempts < retries:
+                session.state = 'retrying'
+                await asyncio.sleep(RETRY_DELAY)
+            else:
+                session.state = 'failed'
+
+    session.finished = time.monotonic()
+
+
+def status_table(sessions) -> list:
+    """Return the lines of the status table."""
+    width = max(len('PORT'), *(len(s.port) for s in sessions))
+    lines = [f"{'PORT':<{width}}  {'STATE':<10}  {'FILE':<16}  {'PACKETS':>9}  TRY  ERROR"]
+    for s in sessions:
+        packets = f'{s.packets}/{s.total_packets}' if s.total_packets else ''
+        lines.append(
+            f'{s.port:<{width}}  {s.state:<10}  {s.file[:16]:<16}  '
+            f'{packets:>9}  {s.attempts:>3}  {s.error}')
+    return lines
+
+
+class HPexDeploy:
+    def __init__(self, args):
+        if _system == 'Windows':
+            # Windows serial ports have no fd for the event loop to
+            # watch
+            print('Error: deploy is not available on Windows.')
+            sys.exit(1)
+
+        ports = []
+        # --ports can be given more than once, and each can be a list
+        patterns = [p for ports_arg in args.ports
+                    for p in ports_arg.split(',') if p]
+        for pattern in patterns:
+            # in case the shell didn't expand it (it was quoted, or
+            # nothing matched)
+            if any(c in pattern for c in '*?['):
+                ports += sorted(glob.glob(pattern))
+            else:
+                ports.append(pattern)
+        # the same port twice would just fight with itself
+        ports = list(dict.fromkeys(ports))
+        if not ports:
+            print('Error: no ports to deploy to.')
+            sys.exit(1)
+
+        for f in args.files:
+            if not Path(f).is_file():
+                try:
+                    is_port = stat.S_ISCHR(os.stat(f).st_mode)
+                except OSError:
+                    is_port = False
+                if is_port:
+                    # the shell expanded --ports /dev/ttyUSB*, and
+                    # only the first one went to --ports
+                    print(f"Error: {f} is a port, not a file. Quote wildcards in --ports, or give --ports once per port.")
+                else:
+                    print(f'Error: no such file: {f}')
+                sys.exit(2) # ENOENT
+
+        self.settings = HPexSettingsTools.load_settings()
+        if args.baud:
+            # the loaded settings are read-only
+            self.settings = dict(self.settings, baud_rate=args.baud)
+
+        self.payload = tuple(
+            PayloadFile.read(f, self.settings['pretranslate_ascii'])
+            for f in args.files)
+        self.sessions = [PortSession(port) for port in ports]
+
+        total = sum(len(f.data) for f in self.payload)
+        print(f'Deploying {len(self.payload)} files ({total} bytes) to {len(ports)} calculators:')
+        for f in self.payload:
+            print(f'  {f.name:<16} {len(f.data):>8}')
+        print('Every calculator should be running the XModem server.')
+
+        self.live = sys.stdout.isatty()
+        self.drawn_lines = 0
+        self.last_states = {}
+        start = time.monotonic()
+        asyncio.run(self.run(args.retries, args.finish))
+        self.summary(time.monotonic() - start)
+
+        if any(s.state != 'done' for s in self.sessions):
+            sys.exit(1)
+
+    async def run(self, retries, finish):
+        drawer = asyncio.create_task(self.draw_forever())
+        await asyncio.gather(*(
+            deploy_to_port(s, self.payload, self.settings, retries, finish)
+            for s in self.sessions))
+        drawer.cancel()
+        self.draw()
+
+    async def draw_forever(self):
+        while True:
+            self.draw()
+            await asyncio.sleep(REDRAW_INTERVAL)
+
+    def draw(self):
+        if not self.live:
+            # not a terminal, so just log the changes
+            for s in self.sessions:
+                state = (s.state, s.file, s.attempts)
+                if self.last_states.get(s.port) != state:
+                    self.last_states[s.port] = state
+                    print(f'{s.port}: {s.state} {s.file} (try {s.attempts}) {s.error}'.rstrip())
+            return
+
+        cols = shutil.get_terminal_size()[0]
+        # move back up over the last table and draw over it
+        if self.drawn_lines:
+            sys.stdout.write(f'\x1b[{self.drawn_lines}F')
+        lines = status_table(self.sessions)
+        for line in lines:
+            sys.stdout.write(line[:cols - 1] + '\x1b[K\n')
+        sys.stdout.flush()
+        self.drawn_lines = len(lines)
+
+    def summary(self, elapsed):
+        done = [s for s in self.sessions if s.state == 'done']
+        failed = [s for s in self.sessions if s.state != 'done']
+        total_bytes = sum(s.bytes_sent for s in self.sessions)
+
+        print()
+        print(f'{len(done)} of {len(self.sessions)} calculators done in {elapsed:.1f} s, '
+              f'{total_bytes} bytes sent ({total_bytes / elapsed:.0f} bytes/s overall).')
+        for s in done:
+            retried = f', {s.attempts - 1} retries' if s.attempts > 1 else ''
+            print(f'  {s.port}: {s.bytes_sent} bytes in {s.elapsed:.1f} s{retried}')
+        for s in failed:
+            print(f'  {s.port}: FAILED after {s.attempts} tries '
+                  f"({len(s.sent)} of {len(self.payload)} files sent): {s.error}")
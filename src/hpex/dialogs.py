@@ -1,4 +1,3 @@
-import threading
 import os
 import platform
 
@@ -10,7 +9,8 @@ from pubsub import pub
 if _system != 'Windows':
     from hpex.kermit_pubsub import KermitConnector
 #from xmodem_pubsub import XModemConnector
-from hpex.helpers import FileTools, KermitProcessTools
+from hpex.helpers import KermitProcessTools
+from hpex.port_coordinator import PortCoordinator
 
 
 # TODO: this needs the grey background fix
@@ -186,10 +186,11 @@ class ObjectInfoDialog(wx.Frame):
             
     def update_file_info_box(self, event):
         #print(self.file_picker.GetPath())
+        # the main window's info cache often has it already
         self.file_info.SetLabelText(
-            FileTools.create_local_message(
-                self.file_picker.GetPath(),
-                os.path.split(self.file_picker.GetPath())[1]))
+            self.GetParent().object_info.lookup(
+                self.file_picker.GetPath()).message(
+                    os.path.split(self.file_picker.GetPath())[1]))
         # we have to have this here so that the window's size is
         # updated accordingly.
         self.Fit()
@@ -262,6 +263,11 @@ class RemoteCommandDialog(wx.Frame):
         self.Show(True)
 
     def cancel_kermit(self, event):
+        # still waiting behind something else on the port
+        if self.job.cancel():
+            self.kermit_cancelled('', '')
+            return
+        
         # we have to use kill here, for whatever reason
         
         # I think it's because Kermit is even less willing to stop
@@ -273,6 +279,8 @@ class RemoteCommandDialog(wx.Frame):
             
     def kermit_done(self, cmd, out):
         self.output_box.AppendText('\nKermit finished successfully')
+        # we have no idea what the command changed
+        self.parent.remote_contents_changed()
         # clear the command box if we succeeded, don't if we
         # failed or cancelled
         self.command_box.Clear()
@@ -280,6 +288,8 @@ class RemoteCommandDialog(wx.Frame):
         
     def kermit_failed(self, cmd, out):
         self.output_box.AppendText('\nKermit failed')
+        # it might have gotten partway
+        self.parent.remote_contents_changed()
         self.cancel_button.Disable()
         
     def kermit_cancelled(self, cmd, out):
@@ -299,12 +309,13 @@ class RemoteCommandDialog(wx.Frame):
         
         self.kermit_connector = KermitConnector()
 
-        self.kermit = threading.Thread(
-            target=self.kermit_connector.run,
-            args=(self.port,
-                  self,
-                  'remote host ' + cmd,
-                  self.topic))
-
-        self.kermit.start()
+        self.job = PortCoordinator.for_port(self.port).submit(
+            ('kermit', 'remote host ' + cmd),
+            self.kermit_connector.run,
+            (self.port,
+             self,
+             'remote host ' + cmd,
+             self.topic),
+            owner=self.kermit_connector)
+        self.kermit_connector = self.job.owner
         self.cancel_button.Enable()
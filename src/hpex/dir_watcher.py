@@ -0,0 +1,211 @@
+import ctypes
+import os
+import platform
+import select
+import struct
+import threading
+import time
+
+_system = platform.system()
+
+from hpex.local_listing import LocalListing, RACY_NS
+
+# After every transfer (and every refresh) the local pane used to be
+# scanned again from scratch. Now a DirWatcher follows the directory
+# the pane shows, on a thread of its own, and hands over what changed
+# in it: a file was created, deleted, renamed or written. Those are
+# applied to the LocalListing in place, so the list doesn't have to
+# be rebuilt, and the selection and scroll position stay put.
+#
+# On Linux this uses inotify, through ctypes so there's nothing to
+# install. Where that isn't there (other systems, or when the
+# per-user watch limit is used up), we poll the directory's mtime
+# instead, and scan it again when it changes. Polling can't see files
+# being written to, only entries coming and going; that's all the
+# pane shows anyway.
+
+# from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | \
+    IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+# struct inotify_event, without the name that follows it
+EVENT = struct.Struct('iIII')
+
+# seconds between checks when polling
+POLL_INTERVAL = 1
+# A get writes its file in many small pieces, and a rename is two
+# events, so after the first event we wait this long for the rest and
+# hand them over together.
+SETTLE = 0.05
+
+
+def _libc():
+    """libc, if it has inotify, or None."""
+    if _system != 'Linux':
+        return None
+    try:
+        # None is the program itself, which has libc linked in
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class DirWatcher:
+    """Watches one directory at a time. Whenever it changes,
+    `callback(path, events, listing)` is called from the watcher's
+    thread. `events` is a list of (action, name, is_dir), with action
+    'add', 'remove' or 'modify', to apply with LocalListing.apply().
+    When there's nothing to go on but a fresh scan (when polling, or
+    when inotify lost events), `events` is empty and `listing` is the
+    new LocalListing; otherwise `listing` is None."""
+    def __init__(self, callback):
+        self.callback = callback
+        self.path = None
+        self.thread = None
+        self.stop_event = None
+
+    @property
+    def live(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def watch(self, path):
+        path = os.path.expanduser(path)
+        if path == self.path and self.live:
+            return
+        self.stop()
+        self.path = path
+        self.stop_event = threading.Event()
+
+        fd = self.add_inotify_watch(path)
+        if fd is not None:
+            target, args = self.read_inotify, (path, fd, self.stop_event)
+        else:
+            # taken now, before the pane's own scan, so a change
+            # between the two isn't missed
+            try:
+                st = os.stat(path)
+                key = (st.st_ino, st.st_mtime_ns)
+            except OSError:
+                key = None
+            target, args = self.poll, (path, self.stop_event, key)
+        self.thread = threading.Thread(target=target, args=args, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        # the thread notices within half a second, and closes its
+        # inotify descriptor itself
+        if self.stop_event is not None:
+            self.stop_event.set()
+        self.thread = None
+
+    @staticmethod
+    def add_inotify_watch(path):
+        libc = _libc()
+        if libc is None:
+            return None
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            print('inotify_init1 failed, polling instead:',
+                  os.strerror(ctypes.get_errno()))
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(path), WATCH_MASK) < 0:
+            print('inotify_add_watch failed, polling instead:',
+                  os.strerror(ctypes.get_errno()))
+            os.close(fd)
+            return None
+        return fd
+
+    def read_inotify(self, path, fd, stop):
+        try:
+            while not stop.is_set():
+                if not select.select([fd], [], [], 0.5)[0]:
+                    continue
+                time.sleep(SETTLE)
+                data = b''
+                while True:
+                    try:
+                        data += os.read(fd, 65536)
+                    except BlockingIOError:
+                        break
+                events, rescan, gone = self.parse_events(path, data)
+                if stop.is_set():
+                    break
+                if rescan:
+                    self.callback(path, [], LocalListing.scan(path))
+                elif events:
+                    self.callback(path, events, None)
+                if gone:
+                    # the directory was deleted or moved away, so
+                    # there's nothing left to watch
+                    break
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def parse_events(path, data):
+        """Returns (events, rescan, gone) from what inotify read."""
+        events = []
+        rescan = gone = False
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, pos)
+            pos += EVENT.size
+            name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+            pos += length
+
+            if mask & IN_Q_OVERFLOW:
+                rescan = True
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                rescan = gone = True
+            # no hiddens, like LocalListing
+            if not name or name.startswith('.'):
+                continue
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                # IN_ISDIR isn't set for a symlink to a directory, but
+                # the pane shows those as directories
+                is_dir = bool(mask & IN_ISDIR) or \
+                    os.path.isdir(os.path.join(path, name))
+                events.append(('add', name, is_dir))
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                events.append(('remove', name, bool(mask & IN_ISDIR)))
+            elif mask & IN_CLOSE_WRITE:
+                events.append(('modify', name, False))
+        return events, rescan, gone
+
+    def poll(self, path, stop, key):
+        # the last listing we handed over
+        listing = None
+        while not stop.wait(POLL_INTERVAL):
+            try:
+                st = os.stat(path)
+            except OSError:
+                self.callback(path, [], LocalListing(path))
+                return
+            # like LocalListing.scan(), a change in the last couple of
+            # seconds might be followed by another in the same tick,
+            # so we look again until it's old enough
+            if (st.st_ino, st.st_mtime_ns) == key and \
+               time.time_ns() - st.st_mtime_ns > RACY_NS:
+                continue
+            new = LocalListing.scan(path)
+            if stop.is_set():
+                return
+            if listing is None or new.names != listing.names or \
+               new.dirs != listing.dirs:
+                self.callback(path, [], new)
+            listing, key = new, new.key
@@ -1,4 +1,3 @@
-import threading
 import os
 import pathlib
 import platform
@@ -16,6 +15,7 @@ from hpex.dialogs import KermitErrorDialog, XModemErrorDialog
 from hpex.helpers import KermitProcessTools, XModemProcessTools
 from hpex.settings import HPexSettingsTools
 from hpex.hp_variable import HPVariable
+from hpex.port_coordinator import PortCoordinator, PRIORITY_TRANSFER
 
 # Because the GUI is drag and drop-based, the transfer dialogs start a
 # transfer on initialization.
@@ -249,45 +249,57 @@ class FileSendDialog(wx.Frame):
                 
             # this code is basically the same as the connecting code
             self.kermit_connector = KermitConnector()
-            
-            self.kermit = threading.Thread(
-                target=self.kermit_connector.run,
-                args=(self.port, self, command, self.topic))
-            
-
-            
-            self.kermit.start()
+            self.job = PortCoordinator.for_port(self.port).submit(
+                ('kermit', command),
+                self.kermit_connector.run,
+                (self.port, self, command, self.topic),
+                owner=self.kermit_connector,
+                priority=PRIORITY_TRANSFER)
+            self.kermit_connector = self.job.owner
 
         else:
 
             if self.parent.connected:
                 self.xmodem_connector = XModemConnector()
                 # send using 'P' command to XModem server
-                self.xmodem = threading.Thread(
-                    target=self.xmodem_connector.run,
-                    args=(self.port,
-                          self,
-                          self.filename,
-                          'send_connect',
-                          '', # current local path doesn't matter for sending
-                          self.topic))
+                self.job = PortCoordinator.for_port(self.port).submit(
+                    ('xmodem', 'send_connect', str(self.filename)),
+                    self.xmodem_connector.run,
+                    (self.port,
+                     self,
+                     self.filename,
+                     'send_connect',
+                     '', # current local path doesn't matter for sending
+                     self.topic),
+                    owner=self.xmodem_connector,
+                    priority=PRIORITY_TRANSFER)
                 
                 self.reset_progress(' Negotiating...')
-                self.xmodem.start()
             else:
                 self.xmodem_connector = XModemXSendConnector()
-                self.xmodem = threading.Thread(
-                    target=self.xmodem_connector.run,
-                    args=(self.port,
-                          self,
-                          self.filename,
-                          self.topic))
+                self.job = PortCoordinator.for_port(self.port).submit(
+                    ('xsend', str(self.filename)),
+                    self.xmodem_connector.run,
+                    (self.port,
+                     self,
+                     self.filename,
+                     self.topic),
+                    owner=self.xmodem_connector,
+                    priority=PRIORITY_TRANSFER)
                 self.reset_progress(' Run XRECV now.')
-                self.xmodem.start()
+            self.xmodem_connector = self.job.owner
                 
         self.cancel_button.Enable()
         
     def cancel(self, event):
+        # If the transfer is still waiting for the port, nothing has
+        # been sent yet, so we can just drop it.
+        if self.job.cancel():
+            self.parent.SetStatusText(
+                f'File copy to {self.port} cancelled before it started.')
+            self.on_close()
+            return
+        
         if not self.xmodem:
             if self.kermit_connector.isalive():
                 self.kermit_connector.cancel_kermit()
@@ -465,15 +477,18 @@ class FileGetDialog(wx.Frame):
             cmd = 'get_connect'
         # receive from XModem server can't be done without being
         # connected, so we don't need a check here.
-        self.xmodem = threading.Thread(
-            target=self.xmodem_connector.run,
-            args=(self.port,
-                  self,
-                  self.filename,
-                  cmd,
-                  self.current_dir,
-                  self.topic))
-        self.xmodem.start()
+        self.job = PortCoordinator.for_port(self.port).submit(
+            ('xmodem', cmd, str(self.filename)),
+            self.xmodem_connector.run,
+            (self.port,
+             self,
+             self.filename,
+             cmd,
+             self.current_dir,
+             self.topic),
+            owner=self.xmodem_connector,
+            priority=PRIORITY_TRANSFER)
+        self.xmodem_connector = self.job.owner
 
         self.cancel_button.Enable()
 
@@ -554,20 +569,25 @@ class FileGetDialog(wx.Frame):
         print(command)
         # this code is basically the same as the connecting code
         self.kermit_connector = KermitConnector()
-        
-        self.kermit = threading.Thread(
-            target=self.kermit_connector.run,
-            args=(self.port, self, command, self.topic))
-        
-        
-        
-        self.kermit.start()
+        self.job = PortCoordinator.for_port(self.port).submit(
+            ('kermit', command),
+            self.kermit_connector.run,
+            (self.port, self, command, self.topic),
+            owner=self.kermit_connector,
+            priority=PRIORITY_TRANSFER)
+        self.kermit_connector = self.job.owner
         # lets us check if we've already written 'Progress: not
         # available when receiving' to self.progress_text
         self.already_wrote_label = False
         self.cancel_button.Enable()
         
     def cancel(self, event):
+        if self.job.cancel():
+            self.parent.SetStatusText(
+                f'File copy from {self.port} cancelled before it started.')
+            self.on_close()
+            return
+        
         if self.use_xmodem:
             self.xmodem_connector.cancel()
         else:
@@ -7,11 +7,11 @@ _system = platform.system()
 import re
 from pathlib import Path
 
-if _system == 'Windows':
-    import serial.tools.list_ports
-
 from hpex.crc_calculator import HPCRCCalculator, HPCRCException
-from hpex.settings import HPexSettingsTools
+
+# HPVariable and the settings are imported where they're used, since
+# `hpex -i` imports this module and needs neither (hp_variable pulls
+# in dataclasses, which is slow to import).
 
 class KermitProcessTools:
     """
@@ -65,7 +65,10 @@ class KermitProcessTools:
         #print('lines', lines)
 
         header, memfree = first_line.split('}')
-        header = header + '}'
+        # with the calculator in translate mode 3, names with HP
+        # characters in them come with escapes (\GS for Σ)
+        from hpex.hp48_codec import unescape
+        header = unescape(header + '}')
 
         return (header, memfree)
 
@@ -144,6 +147,27 @@ class KermitProcessTools:
 
         return s
 
+    @staticmethod
+    def parse_remote_directory(out: str):
+        """Turn the output of `remote directory` into (header,
+        memfree, list of HPVariables), the way the GUI reads it."""
+        from hpex.hp_variable import HPVariable
+        from hpex.hp48_codec import unescape
+        out = KermitProcessTools.type_remove_spaces(out)
+        lines = [l for l in out.splitlines()
+                 if l.strip() and 'Removing stale lock' not in l]
+        header, memfree = KermitProcessTools.process_kermit_header(lines[0])
+        varlist = []
+        for row in lines[1:]:
+            # each row is the name, size, type, and crc in that order
+            name, size, vtype, crc = row.split()[:4]
+            varlist.append(
+                HPVariable(name=unescape(name),
+                           size=size,
+                           vtype=KermitProcessTools.type_add_spaces(vtype),
+                           crc=KermitProcessTools.checksum_to_hexstr(crc)))
+        return header, memfree.strip(), varlist
+
     
 class XModemProcessTools:
     @staticmethod
@@ -155,58 +179,11 @@ class XModemProcessTools:
         """Convert s (a bytes object containing 8-bit ASCII HP names)
         to UTF-8.
 
-        Equivalent Unicode symbols found by searching
-        unicode-table.com for something that matched the HP 48G
-        character browser, as well as the RPL character set page on
-        Wikipedia.
-
         """
-
-        # Note that some of these characters can't actually be used in
-        # names. They're here just in case.
-
-        # And yeah, I realized well into this that the HP 48 character
-        # order is mostly the same (maybe even identical to the
-        # UTF-8), but I think this is a better way.
-        conversion_table = {
-            0x7f: '▒', # shaded block
-            0x80: '∡',
-            0x81: '', # x with overbar
-            0x82: '▽', 0x83: '√', 0x84: '∫', 0x85: 'Σ', 0x86: '▶', 0x87: 'π', 0x88: '∂', 0x89: '≤', 0x8a: '≥',
-            0x8b: '≠', 0x8c: '𝛼', 0x8d: '→', 0x8e: '←', 0x8f: '↓', 0x90: '↑', 0x91: 'γ', 0x92: 'δ', 0x93: 'ε',
-            0x94: 'η', 0x95: 'θ', 0x96: 'λ', 0x97: 'ρ', 0x98: 'σ', 0x99: 'τ', 0x9a: 'ω', 0x9b: 'Δ', 0x9c: 'Π',
-            0x9d: 'Ω',
-            0x9e: '■', # Black Square
-            0x9f: '∞',
-            0xa0: ' ', # non-breaking space (Latin-1 Supplement)
-            0xa1: '¡', 0xa2: '¢', 0xa3: '£', 0xa4: '¤', # currency sign
-            0xa5: '¥', 0xa6: '¦', # Broken Bar, best matches HP 48 symbol
-            0xa7: '§', 0xa8: '¨', # Combining Diaeresis
-            0xa9: '©', 0xaa: 'ª', # Feminine Ordinal Indicator
-            0xab: '«', 0xac: '¬', # Not Sign
-            0xad: '­', # Soft Hyphen
-            0xae: '®', 0xaf: '¯', # Macron
-            0xb0: '°', 0xb1: '±', 0xb2: '²', 0xb3: '³', 0xb4: '´', # Acute Accent
-            0xb5: 'µ', 0xb6: '¶', 0xb7: '·', # Middle Dot
-            0xb8: '¸', # Cedilla
-            0xb9: '¹', 0xba: 'º', # Masculine Ordinal Indicator
-            0xbb: '»', 0xbc: '¼', 0xbd: '½', 0xbe: '¾', 0xbf: '¿', 0xc0: 'À', 0xc1: 'Á', 0xc2: 'Â', 0xc3: 'Ã',
-            0xc4: 'Ä', 0xc5: 'Å', 0xc6: 'Æ', 0xc7: 'Ç', 0xc8: 'È', 0xc9: 'É', 0xca: 'Ê', 0xcb: 'Ë', 0xcc: 'Ì',
-            0xcd: 'Í', 0xce: 'Î', 0xcf: 'Ï', 0xd0: 'Ð', 0xd1: 'Ñ', 0xd2: 'Ò', 0xd3: 'Ó', 0xd4: 'Ô', 0xd5: 'Õ',
-            0xd6: 'Ö', 0xd7: '×', 0xd8: 'Ø', 0xd9: 'Ù', 0xda: 'Ú', 0xdb: 'Û', 0xdc: 'Ü', 0xdd: 'Ý', 0xde: 'Þ',
-            0xdf: 'ß', 0xe0: 'à', 0xe1: 'á', 0xe2: 'â', 0xe3: 'ã', 0xe4: 'ä', 0xe5: 'å', 0xe6: 'æ', 0xe7: 'ç',
-            0xe8: 'è', 0xe9: 'é', 0xea: 'ê', 0xeb: 'ë', 0xec: 'ì', 0xed: 'í', 0xee: 'î', 0xef: 'ï', 0xf0: 'ð',
-            0xf1: 'ñ', 0xf2: 'ò', 0xf3: 'ó', 0xf4: 'ô', 0xf5: 'õ', 0xf6: 'ö', 0xf7: '÷', 0xf8: 'ø', 0xf9: 'ù',
-            0xfa: 'ú', 0xfb: 'û', 0xfc: 'ü', 0xfd: 'ý', 0xfe: 'þ', 0xff: 'ÿ'
-        }
-        final_name = ''
-        for b in s:
-            if b >= 0x7f:
-                final_name += conversion_table[b]
-            else:
-                final_name += chr(b)
-
-        return final_name
+        # see hp48_codec.py, which registers the codec when it's
+        # imported
+        import hpex.hp48_codec
+        return s.decode('hp48')
 
     @staticmethod
     def prolog_to_type(prolog: int) -> str:
@@ -349,8 +326,16 @@ class FileTools:
 
     @staticmethod
     def create_local_message(filename, basename):
-        bin_file_stats = FileTools.get_crc(filename)
-        ascii_header = FileTools.read_hp_ascii(filename)
+        return FileTools.format_local_message(
+            basename,
+            FileTools.get_crc(filename),
+            FileTools.read_hp_ascii(filename),
+            Path(filename).expanduser().stat().st_size)
+
+    @staticmethod
+    def format_local_message(basename, bin_file_stats, ascii_header, size):
+        # split from create_local_message() so that an ObjectInfo
+        # (object_info.py) worked out earlier can make the same message
         message = ''
         if bin_file_stats:
             message = f"'{basename}' is an HP binary object.\nROM Revision: {bin_file_stats[0]} \nChecksum: {bin_file_stats[1]}\nObject size: {bin_file_stats[2]}"
@@ -359,7 +344,7 @@ class FileTools:
             message = f"'{basename}' is an HP ASCII object.\nTranslate mode: {ascii_header[0]}\nAngle mode: {ascii_header[1]}\nFraction mark: {ascii_header[2]}"
             
         else:
-            message = f"'{basename}' is not an HP object.\nFile size: " + str(Path(filename).expanduser().stat().st_size) + ' bytes'
+            message = f"'{basename}' is not an HP object.\nFile size: " + str(size) + ' bytes'
 
         return message
 
@@ -368,9 +353,10 @@ class FileTools:
 
     @staticmethod
     def get_serial_ports(parent):
-        """On Linux, this function tries to find ttyUSB serial ports (it
-        returns the first sorted if any are found), and if it finds
-        none, it then looks for any empty port slot in /dev/pts. This
+        """On Linux, this function tries to find USB serial ports
+        (ttyUSB or ttyACM, from PortRegistry, which puts a calculator
+        first), and if it finds none, it then looks for any empty
+        port slot in /dev/pts. This
         way, you can use x48 or your actual calculator, and change
         ports or scan for new ones at will.
 
@@ -379,6 +365,9 @@ class FileTools:
 
         #return '/dev/pts/1'
         if _system == 'Windows':
+            # imported here, since only this needs it, and it can be
+            # slow to import
+            import serial.tools.list_ports
             if parent != None:
                 parent.SetStatusText('Searching for COM ports...')
             # get COM ports
@@ -393,19 +382,23 @@ class FileTools:
         # we can pass None in for the parent and it won't try to
         # update the statustext
         if parent != None:
-            parent.SetStatusText('Searching for ttyUSB ports...')
-        usbttys = glob.glob('/dev/ttyUSB*')
+            parent.SetStatusText('Searching for USB serial ports...')
+        # imported here, like serial.tools above; the registry's list
+        # is already there if the GUI is watching it
+        from hpex.port_registry import PortRegistry
+        ports = PortRegistry.get().list()
     
         # we can check for a variable's contents as boolean
-        if usbttys != []:
+        if ports:
             if parent != None:
-                parent.SetStatusText('Using ' + usbttys[-1])
-            return usbttys[-1]
+                parent.SetStatusText('Using ' + ports[0].description())
+            return ports[0].device
         
         if parent != None:
             parent.SetStatusText(
-                'No ttyUSB ports found, serial port box empty.')
+                'No USB serial ports found, serial port box empty.')
 
+        from hpex.settings import HPexSettingsTools
         disable_pty_search = HPexSettingsTools.load_settings()['disable_pty_search']
 
         if disable_pty_search:
@@ -415,11 +408,11 @@ class FileTools:
         
         #print('disable_pty_search')
         
-        # no ttyUSBs found? notify the user, though they won't see
+        # no USB serial ports found? notify the user, though they won't see
         # this message unless there's no numbered ptys.
         if parent != None:
             parent.SetStatusText(
-                'No ttyUSB ports found...searching for x48 (ptys).')
+                'No USB serial ports found...searching for x48 (ptys).')
         # I think that x48 will try to find the lowest pty that is
         # not occupied by a terminal. For example, if ptys 0, 1,
         # 3, 4, 5, and 6 are in use, then x48 will choose
@@ -435,10 +428,12 @@ class FileTools:
                     parent.SetStatusText(
                         'Using ' + '/dev/pts/' + str(i) +
                         ', assuming x48 mode (start x48 now).')
-                    return '/dev/pts/' + str(i)
+                return '/dev/pts/' + str(i)
 
-        # otherwise, use one more than the highest pty
-        pty = Path('/dev/pts', str(int(Path(devptys[-1]).name) + 1))
+        # otherwise, use one more than the highest pty (or the first,
+        # if there are none at all)
+        highest = max(devpty_numbers, default=-1)
+        pty = Path('/dev/pts', str(highest + 1))
         # notify them again
         if parent != None:
             parent.SetStatusText(
@@ -0,0 +1,297 @@
+import codecs
+import re
+
+# The HP 48's character set is ASCII up to 126, its own symbols from
+# 127 to 159, and Latin-1 from 160 to 255. Names in the XModem
+# server's listings come in those raw bytes. Kermit, with the
+# calculator in translate mode 3, writes the same characters as
+# backslash escapes instead (\GS for Σ, \<< for «), and so do ASCII
+# objects whose header says T(2) or T(3).
+#
+# Both used to be handled separately, or not at all: XModem names
+# went through a table built on every call, a character at a time,
+# and Kermit names were shown with their escapes. Importing this
+# module registers two kinds of codec, so everything goes through the
+# same tables (and str.translate and codecs.charmap_*, which run in C):
+#
+#   hp48                 the raw 8-bit character set
+#   hp48-t0 ... hp48-t3  the same, with the escapes of that translate
+#                        mode: none for T(0) and T(1), characters 128
+#                        to 159 for T(2), and 128 to 255 for T(3).
+#                        T(2) and T(3) also write a backslash as \\,
+#                        so that a backslash followed by GS isn't
+#                        read back as Σ.
+#
+# They work with bytes.decode(), str.encode() and open(), and
+# incrementally, so a file can be read or written as a stream.
+#
+# Newlines are left alone. T(1) and up also have the calculator turn
+# CR LF into LF, but host files already use LF, and Kermit's text
+# mode takes care of the rest.
+
+# 129 is an x with a bar over it, which Unicode only has as x and a
+# combining macron
+X_BAR = 'x\u0304'
+
+# What 127 to 159 look like; 160 and up are Latin-1. These were found
+# by searching unicode-table.com for something that matched the HP
+# 48G character browser, as well as the RPL character set page on
+# Wikipedia.
+HP48_CHARS = {
+    0x7f: '▒', 0x80: '∡', 0x81: X_BAR, 0x82: '▽', 0x83: '√', 0x84: '∫',
+    0x85: 'Σ', 0x86: '▶', 0x87: 'π', 0x88: '∂', 0x89: '≤', 0x8a: '≥',
+    0x8b: '≠', 0x8c: 'α', 0x8d: '→', 0x8e: '←', 0x8f: '↓', 0x90: '↑',
+    0x91: 'γ', 0x92: 'δ', 0x93: 'ε', 0x94: 'η', 0x95: 'θ', 0x96: 'λ',
+    0x97: 'ρ', 0x98: 'σ', 0x99: 'τ', 0x9a: 'ω', 0x9b: 'Δ', 0x9c: 'Π',
+    0x9d: 'Ω', 0x9e: '■', 0x9f: '∞',
+}
+
+# The escapes with names, from the translation table in the HP 48
+# manuals. Every other character from 160 up is \ and its code in
+# decimal.
+ESCAPES = {
+    0x80: '<)', 0x81: 'x-', 0x82: '.V', 0x83: 'v/', 0x84: '.S', 0x85: 'GS',
+    0x86: '|>', 0x87: 'pi', 0x88: '.d', 0x89: '<=', 0x8a: '>=', 0x8b: '=/',
+    0x8c: 'Ga', 0x8d: '->', 0x8e: '<-', 0x8f: '|v', 0x90: '|^', 0x91: 'Gg',
+    0x92: 'Gd', 0x93: 'Ge', 0x94: 'Gn', 0x95: 'Gh', 0x96: 'Gl', 0x97: 'Gr',
+    0x98: 'Gs', 0x99: 'Gt', 0x9a: 'Gw', 0x9b: 'GD', 0x9c: 'PI', 0x9d: 'GW',
+    0x9e: '[]', 0x9f: 'oo', 0xab: '<<', 0xb0: '^o', 0xb5: 'Gm', 0xbb: '>>',
+    0xd7: '.x', 0xd8: '0/', 0xdf: 'Gb', 0xf7: ':-',
+}
+
+# the highest character each translate mode writes as an escape
+MODE_LIMITS = {0: 0x7f, 1: 0x7f, 2: 0x9f, 3: 0xff}
+# the longest escape, backslash and all
+LONGEST_ESCAPE = 4
+
+# 129 decodes to the two characters of X_BAR, which a charmap can't
+# do, so it decodes to U+0081 and that's replaced afterwards
+DECODING_TABLE = ''.join(
+    '\x81' if code == 0x81 else HP48_CHARS.get(code, chr(code))
+    for code in range(256))
+ENCODING_TABLE = codecs.charmap_build(DECODING_TABLE)
+
+
+def hp48_decode(data, errors='strict'):
+    text, length = codecs.charmap_decode(data, errors, DECODING_TABLE)
+    if '\x81' in text:
+        text = text.replace('\x81', X_BAR)
+    return text, length
+
+
+def hp48_encode(text, errors='strict'):
+    if X_BAR in text:
+        text = text.replace(X_BAR, '\x81')
+    return codecs.charmap_encode(text, errors, ENCODING_TABLE)
+
+
+def escape_for(code) -> str:
+    return '\\' + ESCAPES.get(code, str(code))
+
+
+# str.translate() tables from characters to escapes, and patterns
+# that find the escapes, for each translate mode
+_escape_tables = {}
+_unescape_patterns = {}
+for _mode, _limit in MODE_LIMITS.items():
+    _codes = range(0x80, _limit + 1)
+    _escape_tables[_mode] = {ord(DECODING_TABLE[code]): escape_for(code)
+                             for code in _codes}
+    # the longest first, so \<< isn't read as \<) with a < after it
+    _names = sorted((re.escape(ESCAPES[code]) for code in _codes
+                     if code in ESCAPES), key=len, reverse=True)
+    if _names:
+        _escape_tables[_mode][ord('\\')] = '\\\\'
+        _unescape_patterns[_mode] = re.compile(
+            r'\\(?:(\\)|(\d{3})|(' + '|'.join(_names) + '))')
+    else:
+        _unescape_patterns[_mode] = None
+_named = {name: code for code, name in ESCAPES.items()}
+
+
+def escape(text, mode=3) -> str:
+    """Write the characters that translate mode `mode` escapes as
+    escapes."""
+    if mode == 2 or mode == 3:
+        if X_BAR in text:
+            text = text.replace(X_BAR, '\x81')
+        text = text.translate(_escape_tables[mode])
+    return text
+
+
+def unescape(text, mode=3, strict=False) -> str:
+    """Turn the escapes of translate mode `mode` back into characters.
+    Anything else after a backslash is left as it is, or with
+    `strict`, makes this return None instead."""
+    pattern = _unescape_patterns.get(mode)
+    if pattern is None or '\\' not in text:
+        return text
+    limit = MODE_LIMITS[mode]
+    unknown = []
+
+    def character(match):
+        backslash, digits, name = match.groups()
+        if backslash:
+            return '\\'
+        code = int(digits) if digits else _named[name]
+        if not 0x80 <= code <= limit:
+            unknown.append(match.group())
+            return match.group()
+        return HP48_CHARS.get(code, chr(code))
+    result = pattern.sub(character, text)
+    # a backslash that isn't the start of any escape at all
+    if strict and (unknown or '\\' in pattern.sub('', text)):
+        return None
+    return result
+
+
+def partial_escape(data: bytes) -> int:
+    """Where an escape that might not be finished starts, at the end
+    of `data`, or len(data)."""
+    start = data.rfind(b'\\', max(0, len(data) - LONGEST_ESCAPE + 1))
+    if start == -1:
+        return len(data)
+    # Backslashes pair up from the first of a run, so one that
+    # closes a \\ doesn't start anything.
+    run = start
+    while run > 0 and data[run - 1] == ord('\\'):
+        run -= 1
+    return start if (start - run) % 2 == 0 else len(data)
+
+
+class IncrementalEncoder(codecs.IncrementalEncoder):
+    # An x at the end of one piece might get its macron (X_BAR) in the
+    # next, so it waits for it.
+    def __init__(self, errors='strict'):
+        codecs.IncrementalEncoder.__init__(self, errors)
+        self.pending = ''
+
+    def encode(self, text, final=False):
+        text = self.pending + text
+        self.pending = ''
+        if not final and text.endswith('x'):
+            text, self.pending = text[:-1], 'x'
+        return self.encode_text(text)
+
+    def encode_text(self, text) -> bytes:
+        return hp48_encode(text, self.errors)[0]
+
+    def reset(self):
+        self.pending = ''
+
+    def getstate(self):
+        return 1 if self.pending else 0
+
+    def setstate(self, state):
+        self.pending = 'x' if state else ''
+
+
+def translate_codec(mode) -> codecs.CodecInfo:
+    def encode(text, errors='strict'):
+        data, _ = hp48_encode(escape(text, mode), errors)
+        return data, len(text)
+
+    def decode(data, errors='strict', final=True):
+        data = bytes(data)
+        end = len(data) if final else partial_escape(data)
+        text, _ = hp48_decode(data[:end], errors)
+        return unescape(text, mode), end
+
+    class TranslateIncrementalEncoder(IncrementalEncoder):
+        def encode_text(self, text) -> bytes:
+            return encode(text, self.errors)[0]
+
+    class IncrementalDecoder(codecs.BufferedIncrementalDecoder):
+        def _buffer_decode(self, data, errors, final):
+            return decode(data, errors, final)
+
+    class StreamWriter(codecs.StreamWriter):
+        def encode(self, text, errors='strict'):
+            return encode(text, errors)
+
+    class StreamReader(codecs.StreamReader):
+        def decode(self, data, errors='strict'):
+            return decode(data, errors, final=False)
+
+        def read(self, size=-1, chars=-1, firstline=False):
+            text = super().read(size, chars, firstline)
+            if self.bytebuffer and (not text or (size < 0 and chars < 0)):
+                # the file ended with what could have been the start
+                # of an escape
+                text += decode(self.bytebuffer, self.errors)[0]
+                self.bytebuffer = b''
+            return text
+
+    return codecs.CodecInfo(
+        name=f'hp48-t{mode}',
+        encode=encode,
+        decode=decode,
+        incrementalencoder=TranslateIncrementalEncoder,
+        incrementaldecoder=IncrementalDecoder,
+        streamwriter=StreamWriter,
+        streamreader=StreamReader)
+
+
+def hp48_codec() -> codecs.CodecInfo:
+    class IncrementalDecoder(codecs.IncrementalDecoder):
+        def decode(self, data, final=False):
+            return hp48_decode(data, self.errors)[0]
+
+    class StreamWriter(codecs.StreamWriter):
+        def encode(self, text, errors='strict'):
+            return hp48_encode(text, errors)
+
+    class StreamReader(codecs.StreamReader):
+        def decode(self, data, errors='strict'):
+            return hp48_decode(data, errors)
+
+    return codecs.CodecInfo(
+        name='hp48',
+        encode=hp48_encode,
+        decode=hp48_decode,
+        incrementalencoder=IncrementalEncoder,
+        incrementaldecoder=IncrementalDecoder,
+        streamwriter=StreamWriter,
+        streamreader=StreamReader)
+
+
+_codecs = {'hp48': hp48_codec()}
+for _mode in MODE_LIMITS:
+    _codecs[f'hp48_t{_mode}'] = translate_codec(_mode)
+
+
+def search(name):
+    # codecs.lookup() hands us the name in lower case, with hyphens
+    # turned into underscores
+    return _codecs.get(name)
+
+
+codecs.register(search)
+
+
+# ASCII objects start with a header like %%HP: T(3)A(R)F(.);
+HEADER = re.compile(rb'%%HP: *T\(([0-3])\)')
+
+
+def pretranslate(data: bytes) -> bytes:
+    """Turn the escapes in an ASCII object into the characters
+    themselves, and change its header to T(1) to say so. The
+    calculator then only has to read the object, not translate it
+    first, which on a big program is most of the wait after the
+    transfer. Anything that isn't a T(2) or T(3) object is returned
+    as it is, and so is one with a backslash we don't know the
+    calculator's reading of, so the calculator translates that
+    itself."""
+    match = HEADER.match(data)
+    if match is None or match.group(1) not in (b'2', b'3'):
+        return data
+    mode = int(match.group(1))
+    body = data[match.end():]
+    if b'\\' not in body:
+        text = None
+    else:
+        text = unescape(hp48_decode(body)[0], mode, strict=True)
+        if text is None:
+            return data
+    header = data[:match.start(1)] + b'1' + data[match.end(1):match.end()]
+    return header + (body if text is None else hp48_encode(text)[0])
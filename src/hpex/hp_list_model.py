@@ -0,0 +1,157 @@
+from bisect import bisect_left
+
+# The HP pane used to be emptied and filled again, four SetItem()s a
+# row, every time a listing came in, and then the selection was
+# looked for by name. A refresh usually changes one or two variables
+# (the one just sent, say), so now the pane keeps an HPListModel: the
+# variables by name, and the order they're shown in. A new listing is
+# compared with it, and the ListCtrl is only told about the rows that
+# were added, removed or changed. Everything else, the selection
+# included, stays where it is.
+#
+# The model also does the sorting (by clicking a column) and the
+# filtering (the search box), which go through the same comparison.
+
+def _size_key(var):
+    try:
+        return float(var.size)
+    except ValueError:
+        return 0.0
+
+# by column; None is the order the calculator listed them in
+SORT_KEYS = {
+    0: lambda var: var.name,
+    1: _size_key,
+    2: lambda var: var.vtype,
+    3: lambda var: var.crc,
+}
+
+
+def longest_increasing(seq) -> set:
+    """The values of a longest strictly increasing subsequence of
+    `seq` (whose values are distinct)."""
+    # tails[k] is the index in seq of the smallest value that ends an
+    # increasing run of length k + 1; tail_values holds those values
+    tails = []
+    tail_values = []
+    prev = [None] * len(seq)
+    for i, x in enumerate(seq):
+        k = bisect_left(tail_values, x)
+        if k > 0:
+            prev[i] = tails[k - 1]
+        if k == len(tails):
+            tails.append(i)
+            tail_values.append(x)
+        else:
+            tails[k] = i
+            tail_values[k] = x
+    result = set()
+    i = tails[-1] if tails else None
+    while i is not None:
+        result.add(seq[i])
+        i = prev[i]
+    return result
+
+
+class RowChanges:
+    """What to do to the ListCtrl, in this order: delete the rows at
+    `removed` (highest first), insert the rows in `added` (lowest
+    first), then update the rows in `changed`. Both of those are
+    (index, HPVariable), with the index the row ends up at. With
+    `replace`, delete everything first instead."""
+    def __init__(self, removed=(), changed=(), added=(), replace=False):
+        self.removed = list(removed)
+        self.changed = list(changed)
+        self.added = list(added)
+        self.replace = replace
+
+    def __bool__(self):
+        return bool(self.removed or self.changed or self.added or self.replace)
+
+
+class HPListModel:
+    def __init__(self):
+        # the cache key (listing_cache.path_key) of the directory
+        self.path = None
+        # {name: HPVariable}
+        self.vars = {}
+        # {name: position in the calculator's listing}
+        self.positions = {}
+        # the names shown, in order
+        self.rows = []
+        self.sort_column = None
+        self.reverse = False
+        self.filter = ''
+
+    def var_at(self, index):
+        return self.vars[self.rows[index]]
+
+    def clear(self):
+        self.path = None
+        self.vars = {}
+        self.positions = {}
+        self.rows = []
+
+    def update(self, path, varlist) -> RowChanges:
+        """Take a new listing of `path`."""
+        old_vars = self.vars
+        self.vars = {var.name: var for var in varlist}
+        self.positions = {var.name: i for i, var in enumerate(varlist)}
+        if path != self.path:
+            # another directory: nothing carries over, not even the
+            # selection
+            self.path = path
+            self.rows = self.visible_rows()
+            return RowChanges(
+                added=[(i, self.vars[name]) for i, name in enumerate(self.rows)],
+                replace=True)
+
+        changed = {name for name, var in self.vars.items()
+                   if name in old_vars and
+                   (var.crc, var.size, var.vtype) !=
+                   (old_vars[name].crc, old_vars[name].size, old_vars[name].vtype)}
+        return self.reorder(self.visible_rows(), changed)
+
+    def sort_by(self, column) -> RowChanges:
+        """Sort by `column`: ascending the first time it's clicked,
+        descending the second, and back to the calculator's order the
+        third."""
+        if column != self.sort_column:
+            self.sort_column, self.reverse = column, False
+        elif not self.reverse:
+            self.reverse = True
+        else:
+            self.sort_column, self.reverse = None, False
+        return self.reorder(self.visible_rows())
+
+    def set_filter(self, text) -> RowChanges:
+        """Only show names containing `text` (ignoring case)."""
+        self.filter = text.strip().lower()
+        return self.reorder(self.visible_rows())
+
+    def visible_rows(self) -> list:
+        names = [name for name in self.vars if self.filter in name.lower()]
+        if self.sort_column is None:
+            names.sort(key=self.positions.__getitem__, reverse=self.reverse)
+        else:
+            key = SORT_KEYS[self.sort_column]
+            names.sort(key=lambda name: key(self.vars[name]), reverse=self.reverse)
+        return names
+
+    def reorder(self, new_rows, changed=()) -> RowChanges:
+        # The rows that can stay are the most that are still there and
+        # still in the same order relative to each other; the rest are
+        # deleted and inserted again where they belong now.
+        old_index = {name: i for i, name in enumerate(self.rows)}
+        survivors = [old_index[name] for name in new_rows if name in old_index]
+        keep = longest_increasing(survivors)
+
+        removed = [i for i in range(len(self.rows) - 1, -1, -1) if i not in keep]
+        changes = RowChanges(removed=removed)
+        for i, name in enumerate(new_rows):
+            if old_index.get(name) not in keep:
+                changes.added.append((i, self.vars[name]))
+            elif name in changed:
+                changes.changed.append((i, self.vars[name]))
+        self.rows = new_rows
+        return changes
@@ -1,28 +1,89 @@
+from dataclasses import dataclass, field
 from pathlib import Path
-import serial
-import time
 
 import typing
 
-class Ser(object):
-    def __init__(self, ser):
-        self.ser = ser
-    def write(self, data):
-        print('write', data)
-        self.ser.write(data)
-    def read(self):
-        r = self.ser.read()
-        print('read', r)
-        return r
-    
+from hpex.transport import Transport
+
+# the HP's CRC is done a nibble at a time, from this table
+_CRC_TABLE = [(crc ^ inp) * 0x1081 for crc in range(16) for inp in range(16)]
+
+def hp_crc(s: bytes) -> int:
+    result = 0
+    for i in s:
+        k = (result & 0xf) << 4
+        result = (result >> 4) ^ _CRC_TABLE[k + (i & 0xf)]
+        k = (result & 0xf) << 4
+        result = (result >> 4) ^ _CRC_TABLE[k + (i >> 4)]
+    return result
+
+def hp_packet(number: int, data: bytes) -> bytearray:
+    """Build HP XModem packet `number` (counting from 1) around
+    `data`, which must be 128 or 1024 bytes long."""
+    hpcrc = hp_crc(data)
+    packet = bytearray()
+    if len(data) == 128:
+        packet.append(0x01)
+    elif len(data) == 1024:
+        packet.append(0x02)
+    packet.append(number & 0xff)
+    packet.append(0xff - (number & 0xff))
+    packet.extend(data)
+    packet.append((hpcrc & 0xff00) >> 8)
+    packet.append(hpcrc & 0xff)
+    return packet
+
+def hp_packet_count(size: int) -> int:
+    """How many packets HPXModem.send() splits `size` bytes into:
+    1024-byte packets while there's that much left, then 128-byte
+    ones."""
+    return size // 1024 + -(-(size % 1024) // 128)
+
+def hp_packets(data: bytes) -> list:
+    """Split `data` into the packets HPXModem.send() would send for
+    it, numbered from 1."""
+    packets = []
+    index = 0
+    while index < len(data):
+        size = 1024 if len(data) - index >= 1024 else 128
+        chunk = data[index:index + size]
+        if len(chunk) < 128:
+            chunk += b'\x00' * (128 - len(chunk))
+        packets.append(hp_packet(len(packets) + 1, chunk))
+        index += size
+    return packets
+
+
+def read_payload(path, pretranslate=False) -> bytes:
+    """The bytes to send the XModem server for the file at `path`.
+    Every sender goes through here, so that pretranslate (the
+    'pretranslate_ascii' setting, see hp48_codec.pretranslate()) does
+    the same thing however the file gets to the calculator."""
+    data = Path(path).expanduser().read_bytes()
+    if pretranslate:
+        from hpex.hp48_codec import pretranslate
+        data = pretranslate(data)
+    return data
+
+
+@dataclass(frozen=True)
+class PreparedFile:
+    """A file that's been read and split into packets ahead of time,
+    so that sending it doesn't touch the disk or build packets between
+    ACKs. XModemConnector sends these like a path."""
+    name: str
+    data: bytes = field(repr=False)
+    packets: list = field(repr=False)
+
+    @classmethod
+    def read(cls, path, pretranslate=False):
+        data = read_payload(path, pretranslate)
+        return cls(Path(path).name, data, hp_packets(data))
+
 # TODO: implement 1K XModem
 class HPXModem(object):
-    def __init__(self, ser: serial.Serial):
-        self.ser = Ser(ser)#ser
-        self.crcarray = []
-        for crc in range(16):
-            for inp in range(16):
-                self.crcarray.append((crc ^ inp) * 0x1081)
+    def __init__(self, ser: Transport):
+        self.ser = ser
         self.packet_count = 1
         self.cancelled = False
         self.got_ack = False
@@ -30,10 +91,9 @@ class HPXModem(object):
     def _read_from_file(self) -> bytes:
         try:
             if self.bytes_remaining < 1024:
-                data = read_file.read(128)
+                data = self.read_file.read(128)
             else:
-                data = read_file.read(1024)
-            print(f'data is {data}')
+                data = self.read_file.read(1024)
         except Exception as e:
             print('read from file', e)
             return False
@@ -41,38 +101,20 @@ class HPXModem(object):
         self.bytes_remaining -= len(data)
         return data
     
-    def _stringcrc(self, s: bytes) -> int:
-        result = 0
-        for i in s:
-            k = (result & 0xf) << 4
-            result = (result >> 4) ^ self.crcarray[k + (i & 0xf)]
-            k = (result & 0xf) << 4
-            result = (result >> 4) ^ self.crcarray[k + (i >> 4)]
-        return result
-
-
     def _gen_packet(self, data: bytes) -> bytearray:
-        hpcrc = self._stringcrc(data)
-        packet = bytearray()
-        if len(data) == 128:
-            packet.append(0x01)
-        elif len(data) == 1024:
-            packet.append(0x02)
         # use self.success_count because if we hit an error,
         # self.total_packets will keep incrementing but success_count
         # won't (which is what we want).
+        if self.packets is not None:
+            return self.packets[self.success_count]
 
         # have to add 1 though because self.success_count is 0-indexed
-        packet.append((self.success_count+1) & 0xff)
-        packet.append(0xff - ((self.success_count+1) & 0xff))
-        packet.extend(data)
-        packet.append((hpcrc & 0xff00) >> 8)
-        packet.append(hpcrc & 0xff)
-        return packet
+        return hp_packet(self.success_count + 1, data)
     
     def _write_packet(self, packet: bytearray):
+        # the Transport sends it as soon as we start waiting for the
+        # ACK
         self.ser.write(packet)
-        print(packet)
 
     def _send_packet(self, data: bytes, retry: int) -> bool:
         self.got_ack = False
@@ -81,10 +123,14 @@ class HPXModem(object):
         self._write_packet(packet)
         
         blankcount = 0
-        p = self.ser.read()
+        p = self.ser.expect(b'\x06\x15\x18') # ACK, NAK, CAN
         while p != b'\x06': # ACK
             if self.cancelled:
+                # The packet is already out, so the CANs land where
+                # the calculator expects the next one. There's no
+                # need to wait for its ACK first.
                 print('self.cancelled in ACK loop')
+                self._send_cancel()
                 return False
             if blankcount == retry:
                 return False
@@ -103,17 +149,14 @@ class HPXModem(object):
 
             if self.cancelled:
                 print('self.cancelled in ACK loop')
+                self._send_cancel()
                 return False
-            p = self.ser.read()
+            p = self.ser.expect(b'\x06\x15\x18')
             print(p)
 
         if self.cancelled:
-            time.sleep(.2)
-            print('sending CAN 3 times')
-            # If cancelled, we are supposed to send CAN multiple times
-            # in place of SOH
-            self.ser.write(b'\x18\x18\x18')
             print('self.cancelled in _send_packet')
+            self._send_cancel()
             return False
         
         self.got_ack = True
@@ -121,7 +164,12 @@ class HPXModem(object):
         self.total_packets += 1
         return True
 
-    def send(self, read_file: typing.BinaryIO, retry=9, callback=None) -> bool:
+    def send(self, read_file: typing.BinaryIO, retry=9, callback=None,
+             packets=None) -> bool:
+        # packets, from hp_packets(), are the file's packets already
+        # built
+        self.read_file = read_file
+        self.packets = packets
         self.bytes_remaining = len(read_file.read())
         read_file.seek(0)
         
@@ -135,7 +183,7 @@ class HPXModem(object):
                 return False
             
             try:
-                p = self.ser.read()
+                p = self.ser.expect(b'D')
             except Exception as e:
                 print(e)
                 return False
@@ -149,7 +197,9 @@ class HPXModem(object):
                 # counting.
                 blankcount += 1
                 
-            if self.cancelled: return False
+            if self.cancelled:
+                self._send_cancel()
+                return False
 
         
         self.total_packets = 0
@@ -192,11 +242,22 @@ class HPXModem(object):
 
         try:
             self.ser.write(b'\x04')
+            self.ser.flush()
             read_file.close()
         except Exception as e:
             print('EOT + close', e)
 
+        return True
+
 
+    def _send_cancel(self):
+        print('sending CAN 3 times')
+        # If cancelled, we are supposed to send CAN multiple times in
+        # place of SOH. flush() makes sure the packet before them has
+        # completely left.
+        self.ser.flush()
+        self.ser.write(b'\x18\x18\x18')
+        self.ser.flush()
 
     # Connectivity Kit sends 3 CANs
 
@@ -213,6 +274,8 @@ class HPXModem(object):
         #        print(p)
         #    self.got_ack = True
             
+        # The thread running send() sends the CANs itself. It's
+        # woken up straight away by Transport.cancel().
         self.cancelled = True
         print('abort')
 
@@ -1,20 +1,22 @@
-import threading
 import sys
 import os
+import glob
 import shutil
 from pathlib import Path
 import platform
 
 _system = platform.system()
-from pubsub import pub
 
-from hpex.settings import HPexSettingsTools
-if _system != 'Windows':
-    from hpex.kermit_pubsub import KermitConnector
-from hpex.xmodem_pubsub import XModemConnector
-from hpex.xmodem_xsend_pubsub import XModemXSendConnector
 from hpex.helpers import FileTools, KermitProcessTools, XModemProcessTools
 
+# Only what every command needs is imported up here. pubsub, the
+# settings, and above all the connectors (which bring in pyserial, the
+# xmodem package and ptyprocess) are imported once we know we're going
+# to transfer something, and then only the connector we need. That
+# keeps `hpex -i` and errors in the arguments quick, which matters
+# when a script runs hpex hundreds of times; see
+# benchmarks/startup.py.
+
 class HPexCLI:
     def __init__(self, args):
         self.command = args.command[0]
@@ -22,18 +24,35 @@ class HPexCLI:
             print('Error: invalid command.')
             return
         
-        # if the file doesn't exist (or is a directory), don't even try.
-        self.filename = Path(args.input_file[0])
+        # Several files can be given, and quoted wildcards are
+        # expanded here for sends (so they work on Windows too, where
+        # the shell doesn't). Names to get are passed on as they are:
+        # the XModem connector matches wildcards against the listing.
+        if 'get' in self.command:
+            self.filenames = [Path(f) for f in args.input_file]
+        else:
+            self.filenames = []
+            for f in args.input_file:
+                matches = sorted(glob.glob(f)) if glob.has_magic(f) else []
+                self.filenames += [Path(m) for m in matches] or [Path(f)]
+        # messages about the whole transfer use the first file
+        self.filename = self.filenames[0]
         self.current_path = Path(os.getcwd())
-        if _system != 'Windows':
-            if 'get' not in self.command:
-                if self.filename.is_dir():
-                    print('Error: specified path is a directory.')
+        if 'get' not in self.command:
+            # if a file doesn't exist (or is a directory), don't even try.
+            for f in self.filenames:
+                if f.is_dir():
+                    print(f'Error: {f} is a directory.')
                     sys.exit(21) # EISDIR
-                elif not self.filename.is_file():
-                    print(f'Error: no such file: {self.filename}')
+                elif not f.is_file():
+                    print(f'Error: no such file: {f}')
                     sys.exit(2) # ENOENT
 
+        if self.command == 'xsend' and len(self.filenames) > 1:
+            # XRECV takes one file and then quits
+            print('Error: xsend can only send one file.')
+            sys.exit(1)
+
         self.topic = 'HPexCLI'
 
         if _system == 'Windows':
@@ -43,10 +62,13 @@ class HPexCLI:
         # for info mode, just stop processing arguments if we get a
         # -i.
         if args.info:
-            print(FileTools.create_local_message(
-                self.filename, self.filename.name))
+            for f in self.filenames:
+                print(FileTools.create_local_message(f, f.name))
             return
         
+        from pubsub import pub
+        from hpex.settings import HPexSettingsTools
+
         # get terminal size
         self.termcols = shutil.get_terminal_size()[0]
         pub.subscribe(
@@ -64,6 +86,8 @@ class HPexCLI:
         pub.subscribe(
             self.xmodem_failed, f'xmodem.failed.{self.topic}')
         pub.subscribe(self.xmodem_done, f'xmodem.done.{self.topic}')
+        pub.subscribe(
+            self.xmodem_filestart, f'xmodem.filestart.{self.topic}')
 
         self.settings = HPexSettingsTools.load_settings()
 
@@ -112,77 +136,127 @@ class HPexCLI:
         # the progress bar stays just one line.
         self.already_wrote_100 = False
 
-        options = HPexSettingsTools.load_settings()
+        # For several files, the progress bar shows which file we're
+        # on, and the total so far by size (sends only: we don't know
+        # the sizes of objects we get).
+        self.file_index = 0
+        self.current_name = self.filename.name
+        self.file_count = len(self.filenames)
+        self.last_progress = 0
+        if 'get' not in self.command:
+            self.sizes = [f.stat().st_size for f in self.filenames]
+        else:
+            self.sizes = None
+        # the connectors' callbacks set this, and we exit with it
+        self.failed = False
 
-        options['baud_rate'] = self.baud
+        # the loaded settings are read-only, so the baud rate goes in
+        # a copy
+        options = dict(self.settings, baud_rate=self.baud)
 
         print('If you cancel with ^C, you may have to press [CANCEL] or [ATTN] on the calculator.')
         if 'k' in self.command:
+            # several files go in one msend or mget, so Kermit only
+            # has to start once
+            names = ' '.join(f'{{{f}}}' for f in self.filenames)
             if self.command == 'ksend':
-                cmd = f'send {self.filename}'
+                if self.file_count > 1:
+                    cmd = f'msend {names}'
+                else:
+                    cmd = f'send {self.filename}'
                 # print the warning we show in File[Get|Send]Dialog
             elif self.command == 'kget':
                 cmd = ''
                 if args.overwrite:
                     cmd += 'set file collision overwrite,'
-                cmd += f'get {self.filename}'
+                if self.file_count > 1:
+                    cmd += f'mget {names}'
+                else:
+                    cmd += f'get {self.filename}'
                     
             if self.finish:
                 cmd += ',finish'
 
+            from hpex.kermit_pubsub import KermitConnector
             self.connector = KermitConnector()
-            self.kermit = threading.Thread(
-                target=self.connector.run,
-                args=(self.port, self, cmd,
-                      self.topic, True, False, options))
-            
-            self.kermit.start()
+            self.job = self.submit(
+                ('kermit', cmd),
+                (self.port, self, cmd,
+                 self.topic, True, False, options))
             
         elif self.command == 'xsrv_send':
+            from hpex.xmodem_pubsub import XModemConnector
             self.connector = XModemConnector()
-            self.xmodem = threading.Thread(
-                target=self.connector.run,
-                args=(self.port,
-                      self,
-                      str(Path(self.filename).name),
-                      'send_connect',
-                      str(self.current_path),
-                      self.topic,
-                      False,
-                      options))
-            self.xmodem.start()
+            self.job = self.submit(
+                ('xmodem', 'send_connect', *self.filenames),
+                (self.port,
+                 self,
+                 self.connector_files(),
+                 'send_connect',
+                 str(self.current_path),
+                 self.topic,
+                 False,
+                 options))
             
         elif self.command == 'xsrv_get':
             if self.overwrite:
                 cmd = 'get_connect_overwrite'
             else:
                 cmd = 'get_connect'
+            from hpex.xmodem_pubsub import XModemConnector
             self.connector = XModemConnector()
-            self.xmodem = threading.Thread(
-                target=self.connector.run,
-                args=(self.port,
-                      self,
-                      str(Path(self.filename).name),
-                      cmd,
-                      str(self.current_path),
-                      self.topic,
-                      False,
-                      options))
-            self.xmodem.start()
+            self.job = self.submit(
+                ('xmodem', cmd, *self.filenames),
+                (self.port,
+                 self,
+                 self.connector_files(),
+                 cmd,
+                 str(self.current_path),
+                 self.topic,
+                 False,
+                 options))
             
         elif self.command == 'xsend':
+            from hpex.xmodem_xsend_pubsub import XModemXSendConnector
             self.connector = XModemXSendConnector()
-            self.xmodem = threading.Thread(
-                target=self.connector.run,
-                args=(self.port,
-                      self,
-                      self.filename,
-                      self.topic,
-                      False,
-                      options))
-            self.xmodem.start()
+            self.job = self.submit(
+                ('xsend', self.filename),
+                (self.port,
+                 self,
+                 self.filename,
+                 self.topic,
+                 False,
+                 options))
             print('Run XRECV now.')
 
+        # The port's worker thread is a daemon, so we have to wait
+        # here or we'd exit before the transfer even starts.
+        self.job.wait()
+        if self.failed:
+            sys.exit(1)
+
+    def connector_files(self):
+        # XModemConnector takes a list to do several files over one
+        # connection. Sends get the whole path, since the connector
+        # opens the file itself.
+        if 'get' in self.command:
+            names = [f.name for f in self.filenames]
+        else:
+            names = [str(f) for f in self.filenames]
+        # a wildcard needs the list too, to be matched against the
+        # listing
+        if len(names) > 1 or glob.has_magic(names[0]):
+            return names
+        return names[0]
+
+    def submit(self, key, args):
+        # the transfer is run by the port's coordinator, like the GUI
+        # does, so it's timed the same way.
+        from hpex.port_coordinator import PortCoordinator, PRIORITY_TRANSFER
+        return PortCoordinator.for_port(self.port).submit(
+            key, self.connector.run, args,
+            owner=self.connector, priority=PRIORITY_TRANSFER)
+
     def kermit_newdata(self, data, cmd):
         # The 48 (I have no idea about the MK series) doesn't send any
         # information on progress when it sends a file over Kermit, we
@@ -190,10 +264,19 @@ class HPexCLI:
         
         if self.command == 'ksend':
             progress = KermitProcessTools.kermit_line_to_progress(data)
-            if progress is not None and not self.already_wrote_100:
+            if progress is None:
+                return
+            # msend doesn't tell us when it moves on to the next file,
+            # but the percentage starts over
+            if progress < self.last_progress and self.file_index < self.file_count - 1:
+                self.file_index += 1
+                self.already_wrote_100 = False
+            self.last_progress = progress
+
+            if not self.already_wrote_100:
                 # we have to subtract from the terminal width to make
                 # everything fit
-                self.print_progress_bar(progress)
+                self.print_file_progress(progress)
                 
             if progress == 100:
                 self.already_wrote_100 = True
@@ -204,16 +287,23 @@ class HPexCLI:
             # indication that the transfer was successful.
             print('Complete!')
 
-        sys.exit(1)
-
     def kermit_failed(self, cmd, out):
         # newlines separate the progress bar from the following
         # messages
         print()
         print('Kermit said:')
         print(out)
-        print(f'\nKermit failed to transfer {self.filename} to {self.port}.')
-        sys.exit(1)
+        if self.file_count > 1:
+            print(f'\nKermit failed to transfer {self.file_count} files to {self.port}.')
+        else:
+            print(f'\nKermit failed to transfer {self.filename} to {self.port}.')
+        self.failed = True
+
+    def xmodem_filestart(self, index, count, name):
+        # only sent when there are several files
+        self.file_index = index
+        self.current_name = Path(name).name
+        print(f'[{index + 1}/{count}] {Path(name).name}')
         
     def xmodem_newdata(self, file_count, total,
                        success, error, should_update):
@@ -223,14 +313,15 @@ class HPexCLI:
             progress = XModemProcessTools.packet_count_to_progress(
                 success, file_count)
            
-            self.print_progress_bar(progress)
+            self.print_file_progress(progress)
 
         
     # no data here either
     def xmodem_failed(self, cmd):
-        print(f'\nXModem failed to transfer {self.filename} to {self.port}.')
-        # have to exit because sometimes the done event is still sent
-        sys.exit(1)
+        print(f'\nXModem failed to transfer {self.current_name} to {self.port}.')
+        # the done event is sometimes still sent after this, so we
+        # just remember it for the exit status
+        self.failed = True
                 
     def xmodem_done(self, file_count, total, success, error):
         # there is no progress in XModem receive, so we can't set the
@@ -239,18 +330,28 @@ class HPexCLI:
             print('Complete!')
         else:
             # fill the bar the whole way (otherwise it stops at 99%)
-            self.print_progress_bar(100)
-            
-        sys.exit(1)
+            self.print_file_progress(100)
+
+    def print_file_progress(self, progress):
+        if self.file_count == 1:
+            self.print_progress_bar(progress)
+            return
+        # with several files, the bar is for this file, and the
+        # total is weighted by size
+        done = sum(self.sizes[:self.file_index]) + \
+            self.sizes[self.file_index] * progress / 100
+        total = 100 * done / max(1, sum(self.sizes))
+        self.print_progress_bar(
+            progress,
+            prefix=f'[{self.file_index + 1}/{self.file_count}]',
+            suffix=f'complete, {int(total)}% total')
 
     # from https://stackoverflow.com/a/34325723, but modified
     
-    def print_progress_bar(self, iteration):
+    def print_progress_bar(self, iteration, prefix='Progress:', suffix='complete'):
         # refetch the terminal size in case it's resized
         self.termcols = shutil.get_terminal_size()[0]
         total = 100
-        prefix = 'Progress:'
-        suffix = 'complete'
         # subtract 12, this seems to make it work
         length = self.termcols - 12 - len(prefix) - len(suffix)
         fill = '#'
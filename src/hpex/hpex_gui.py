@@ -1,4 +1,3 @@
-import threading
 import platform
 import inspect
 _system = platform.system()
@@ -11,21 +10,31 @@ _system = platform.system()
 # TODO: disable radiobuttons just like connect button when connect initiated
 from pathlib import Path
 import os
+import threading
 
 import wx
 from pubsub import pub
 
 from hpex.helpers import FileTools, KermitProcessTools, StringTools
-from hpex.file_dialogs import FileGetDialog, FileSendDialog
-from hpex.dialogs import ConnectingDialog, RemoteCommandDialog, KermitErrorDialog, ObjectInfoDialog
 
-if _system != 'Windows':
-    from hpex.kermit_pubsub import KermitConnector
-
-from hpex.xmodem_pubsub import XModemConnector
+# The dialogs, the settings frame and the connectors (and with them
+# pyserial, the xmodem package and ptyprocess) aren't needed to draw
+# the main window, so each is imported where it's first used. A
+# module is only ever imported once, so the later imports cost nothing
+# after the first. benchmarks/gui_startup.py checks that none of them
+# sneak back in before the window is shown.
 from hpex.settings import HPexSettingsTools
-from hpex.settings_frame import SettingsFrame
 from hpex.hp_variable import HPVariable
+from hpex.hp_list_model import HPListModel
+from hpex.hp48_codec import escape, unescape
+from hpex.xmodem_listing import PATH_VAR
+from hpex.listing_cache import RemoteListingCache, path_key, path_to_str
+from hpex.local_listing import LocalListing
+from hpex.dir_watcher import DirWatcher
+from hpex.object_info import ObjectInfoService
+from hpex.port_registry import PortRegistry
+from hpex.port_coordinator import PortCoordinator, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from hpex.transfer_queue import TransferQueuePanel
 
 class HPTextDropTarget(wx.TextDropTarget):
     def __init__(self, window):
@@ -56,6 +65,180 @@ class LocalTextDropTarget(wx.TextDropTarget):
         return True
 
 
+class LocalFileList(wx.ListCtrl):
+    # A virtual ListCtrl: it holds no rows of its own, it just asks
+    # for the text and icon of the ones it's drawing, which come from
+    # a LocalListing (see local_listing.py). Showing a directory is
+    # then the same speed however big it is.
+    #
+    # The columns after the name are filled in as an ObjectInfoService
+    # (object_info.py) works them out.
+    def __init__(self, parent, object_info, style):
+        wx.ListCtrl.__init__(
+            self, parent, wx.ID_ANY, style=style | wx.LC_VIRTUAL)
+        self.listing = LocalListing()
+        self.object_info = object_info
+        # {name: ObjectInfo} for the files in this directory that
+        # we've had back from the service
+        self.info = {}
+
+    def set_listing(self, listing):
+        # DeleteAllItems() drops the selection, which belonged to the
+        # old directory
+        self.DeleteAllItems()
+        self.listing = listing
+        # asking the service again is cheap (it checks the cache
+        # first), and picks up files that changed behind our back
+        self.info = {}
+        self.SetItemCount(len(listing))
+        self.size_column()
+        self.Refresh()
+
+    def size_column(self):
+        # LIST_AUTOSIZE only measures rows that exist, and a virtual
+        # list has none, so we measure the longest name ourselves
+        # (or the header, if that's longer), plus room for the icon.
+        longest = max(self.listing.longest_name(), 'Name', key=len)
+        self.SetColumnWidth(0, self.GetTextExtent(longest)[0] + 40)
+
+    def item_name(self, index) -> str:
+        return self.listing.names[index]
+
+    def apply_changes(self, events, listing=None):
+        """Apply a DirWatcher's changes (or swap in its new listing),
+        keeping the selected row selected and the top row on top,
+        wherever they've moved to."""
+        count = len(self.listing)
+        top = self.GetTopItem()
+        sel = self.GetFirstSelected()
+        top_name = self.item_name(top) if 0 <= top < count else None
+        sel_name = self.item_name(sel) if 0 <= sel < count else None
+
+        # a written file's info is out of date, and so is a removed
+        # or added one's (it might be a different file by that name)
+        for action, name, is_dir in events:
+            self.info.pop(name, None)
+        if listing is not None:
+            # a rescan doesn't say what changed
+            self.info = {}
+            self.listing = listing
+        elif not self.listing.apply(events):
+            self.Refresh()
+            return
+        # a virtual list's selection is by index, so it has to be
+        # moved by hand
+        if sel >= 0:
+            self.Select(sel, False)
+        self.SetItemCount(len(self.listing))
+
+        if top_name is not None:
+            new_top = self.listing.find(top_name)
+            # EnsureVisible() scrolls as little as it can, so going up
+            # it puts the row at the top, and going down we have to
+            # ask for the row a page below it
+            if 0 <= new_top < top:
+                self.EnsureVisible(new_top)
+            elif new_top > top:
+                self.EnsureVisible(min(new_top + self.GetCountPerPage() - 1,
+                                       len(self.listing) - 1))
+        if sel_name is not None:
+            new_sel = self.listing.find(sel_name)
+            if new_sel != -1:
+                self.Select(new_sel)
+                self.Focus(new_sel)
+
+        self.size_column()
+        self.Refresh()
+
+    def info_ready(self, path, info):
+        directory, name = os.path.split(path)
+        if directory != self.listing.path:
+            return
+        self.info[name] = info
+        index = self.listing.find(name)
+        if index != -1:
+            self.RefreshItem(index)
+
+    def OnGetItemText(self, item, column):
+        name = self.listing.names[item]
+        if column == 0:
+            return name
+        if self.listing.dirs[item]:
+            return 'Folder' if column == 1 else ''
+        info = self.info.get(name)
+        if info is None:
+            # wx only asks for rows it's drawing, so this is how the
+            # visible rows get done first
+            if column == 1:
+                self.object_info.request(os.path.join(self.listing.path, name))
+            return ''
+        return info.columns()[column - 1]
+
+    def OnGetItemImage(self, item):
+        # icon 0 is a folder, icon 1 is a file
+        return 0 if self.listing.dirs[item] else 1
+
+
+class HPFileList(wx.ListCtrl):
+    # The HP pane. Its rows come from an HPListModel (see
+    # hp_list_model.py), and a new listing, sort or filter only
+    # touches the rows that changed, so the selection and scroll
+    # position stay where they are without being looked for again.
+    def __init__(self, parent, style):
+        wx.ListCtrl.__init__(self, parent, wx.ID_ANY, style=style)
+        self.model = HPListModel()
+        self.InsertColumn(0, 'Name')
+        self.InsertColumn(1, 'Size (bytes)')
+        self.InsertColumn(2, 'Type')
+        self.InsertColumn(3, 'Checksum')
+        self.Bind(wx.EVT_LIST_COL_CLICK, self.column_clicked)
+
+    def var_at(self, index) -> HPVariable:
+        return self.model.var_at(index)
+
+    def show(self, path, varlist):
+        """Show `varlist`, the listing of `path` (anything
+        listing_cache.path_key() takes)."""
+        self.apply(self.model.update(path_key(path), varlist))
+
+    def set_filter(self, text):
+        self.apply(self.model.set_filter(text))
+
+    def clear(self):
+        self.model.clear()
+        self.DeleteAllItems()
+
+    def column_clicked(self, event):
+        self.apply(self.model.sort_by(event.GetColumn()))
+
+    def apply(self, changes):
+        if not changes:
+            return
+        # Freeze() holds off drawing until Thaw(), so the rows all
+        # change at once instead of one at a time
+        self.Freeze()
+        try:
+            if changes.replace:
+                self.DeleteAllItems()
+            for index in changes.removed:
+                self.DeleteItem(index)
+            for index, var in changes.added:
+                self.InsertItem(index, var.name)
+                self.set_row(index, var)
+            for index, var in changes.changed:
+                self.set_row(index, var)
+            if changes.added or changes.replace:
+                # in case lengths have changed
+                self.SetColumnWidth(0, wx.LIST_AUTOSIZE)
+        finally:
+            self.Thaw()
+
+    def set_row(self, index, var):
+        self.SetItem(index, 1, var.size)
+        self.SetItem(index, 2, var.vtype)
+        self.SetItem(index, 3, var.crc)
+
+
 class HPexGUI(wx.Frame):
     # The calculator has to be in translate mode 3, the most
     # translation, for this tool to work. Otherwise, Python (or is it
@@ -66,6 +249,9 @@ class HPexGUI(wx.Frame):
         wx.Frame.__init__(self, parent, title='HPex')
 
         self.connected = False
+        # set from clicking Disconnect until the server has finished
+        # (or failed to), so nothing new goes to it in between
+        self.disconnecting = False
         self.xmodem_mode = False
         self.topic = 'HPex'
         
@@ -125,7 +311,7 @@ class HPexGUI(wx.Frame):
         
         self.Bind(
             # lambda forces the creation of a new object
-            wx.EVT_MENU, lambda e: ObjectInfoDialog(self, self.current_local_path).go(),
+            wx.EVT_MENU, self.start_object_info_dialog,
             self.run_ckfinder_item)
         self.file_menu.AppendSeparator()
 
@@ -134,7 +320,7 @@ class HPexGUI(wx.Frame):
             wx.ID_PREFERENCES, 'Settings...\tCtrl+,', '')
         
         self.Bind(
-            wx.EVT_MENU, lambda e: SettingsFrame(self).go(), self.settings_item)
+            wx.EVT_MENU, self.start_settings_frame, self.settings_item)
 
 
         
@@ -234,16 +420,27 @@ class HPexGUI(wx.Frame):
         self.local_updir.Bind(wx.EVT_BUTTON, self.local_move_up)
 
 
+        # works out the local pane's info columns in the background
+        # (see object_info.py), and calls us from its own threads
+        self.object_info = ObjectInfoService(
+            lambda *args: wx.CallAfter(self.local_info_ready, *args))
+
+        # (virtual lists have to be in report mode, so no LC_ICON
+        # here)
         if _system == 'Windows':
-            self.local_files = wx.ListCtrl(
-                self.filebox_panel, wx.ID_ANY,
-                style=wx.LC_REPORT)# | wx.LC_ICON | wx.LC_ALIGN_LEFT | wx.LC_SINGLE_SEL)
+            self.local_files = LocalFileList(
+                self.filebox_panel, self.object_info,
+                style=wx.LC_REPORT)# | wx.LC_ALIGN_LEFT | wx.LC_SINGLE_SEL)
         else:
-            self.local_files = wx.ListCtrl(
-                self.filebox_panel, wx.ID_ANY,
-                style=wx.LC_REPORT | wx.LC_ICON | wx.LC_ALIGN_LEFT | wx.LC_SINGLE_SEL)
+            self.local_files = LocalFileList(
+                self.filebox_panel, self.object_info,
+                style=wx.LC_REPORT | wx.LC_ALIGN_LEFT | wx.LC_SINGLE_SEL)
 
         self.local_files.InsertColumn(0, 'Name')
+        self.local_files.InsertColumn(1, 'Type')
+        self.local_files.InsertColumn(2, 'Checksum')
+        self.local_files.InsertColumn(3, 'ROM')
+        self.local_files.InsertColumn(4, 'Size (bytes)')
         
         
         # build the image list, which has just folders and files.
@@ -262,6 +459,11 @@ class HPexGUI(wx.Frame):
 
         self.local_files.Bind(
             wx.EVT_LIST_ITEM_ACTIVATED, self.local_item_activated)
+
+        # keeps the local pane up to date as files come and go (see
+        # dir_watcher.py). It calls us from its own thread.
+        self.local_watcher = DirWatcher(
+            lambda *args: wx.CallAfter(self.local_dir_changed, *args))
         
         self.local_sizer.Add(
             self.local_dir_button_sizer, 0, wx.EXPAND | wx.ALL)
@@ -275,14 +477,18 @@ class HPexGUI(wx.Frame):
             'Not connected')
 
 
-        self.hp_files = wx.ListCtrl(
-            self.filebox_panel, wx.ID_ANY,
-            style=wx.LC_REPORT | wx.LC_SINGLE_SEL)
+        # only shows the variables whose names contain what's typed
+        # here; the columns sort when their headers are clicked
+        self.hp_filter = wx.SearchCtrl(self.filebox_panel, wx.ID_ANY)
+        self.hp_filter.SetDescriptiveText('Filter')
+        self.hp_filter.ShowCancelButton(True)
+        self.hp_filter.Bind(wx.EVT_TEXT, self.hp_filter_changed)
+        self.hp_filter.Bind(wx.EVT_SEARCHCTRL_CANCEL_BTN,
+                            lambda event: self.hp_filter.SetValue(''))
 
-        self.hp_files.InsertColumn(0, 'Name')
-        self.hp_files.InsertColumn(1, 'Size (bytes)')
-        self.hp_files.InsertColumn(2, 'Type')
-        self.hp_files.InsertColumn(3, 'Checksum')
+        self.hp_files = HPFileList(
+            self.filebox_panel,
+            style=wx.LC_REPORT | wx.LC_SINGLE_SEL)
 
         self.hp_files.Bind(wx.EVT_LIST_ITEM_ACTIVATED, self.hp_item_activated)
         
@@ -323,6 +529,7 @@ class HPexGUI(wx.Frame):
         self.hp_sizer.Add(
             self.hp_dir_button_sizer, 0, wx.EXPAND | wx.ALL)
         self.hp_sizer.Add(self.hp_dir_label, 0, wx.EXPAND | wx.ALL)
+        self.hp_sizer.Add(self.hp_filter, 0, wx.EXPAND | wx.ALL)
         self.hp_sizer.Add(self.hp_files, 1, wx.EXPAND | wx.ALL)
 
         self.filebox_sizer.Add(self.local_sizer, 1, wx.EXPAND | wx.ALL)
@@ -334,6 +541,10 @@ class HPexGUI(wx.Frame):
         # we want to set the stretch on the fileboxes so they can
         # expand with the window
         self.main_sizer.Add(self.filebox_panel, 1, wx.EXPAND)
+
+        # sends and gets wait their turn here (see transfer_queue.py)
+        self.transfer_queue = TransferQueuePanel(self)
+        self.main_sizer.Add(self.transfer_queue, 0, wx.EXPAND)
         
         self.SetSizerAndFit(self.main_sizer)
 
@@ -349,20 +560,33 @@ class HPexGUI(wx.Frame):
         # the directory of the calculator. I suppose eventually this
         # feature should be configurable in Settings.
         self.firstpath = True
+        # the same for the XModem server, where the path stays on the
+        # calculator: whether connecting saved it
+        self.xmodem_path_saved = False
 
-        # these four variables keep track of the selections and view
-        # status of the local and remote lists
+        # these two variables keep track of the selection and view
+        # status of the local list (the HP list keeps its own, see
+        # HPFileList)
         
-        # the selection variables keep track of the name of the entry
+        # the selection variable keeps track of the name of the entry
         # in the list. this means that I should probably add a handler
         # for when the name isn't there anymore.
         self.local_top_index = 0
         self.local_selection = None
-        self.hp_top_index = 0
-        self.hp_selection = None
-        
-        self.refresh_all_files()
-        self.refresh_port()
+
+        # remote listings we've already fetched this session (see
+        # listing_cache.py), and where a Kermit 'remote host' command
+        # is about to take us, so that we can look it up there.
+        self.listing_cache = None
+        self.pending_remote_path = None
+
+        # refresh_port() looks for ports on a thread of its own; this
+        # counts the searches, so that only the latest one fills in
+        # the box.
+        self.port_search = 0
+        # the port a search last put in the box, which a later one
+        # (after a hotplug) is allowed to replace
+        self.auto_port = None
 
 
         # this variable indicates when a Kermit 'remote directory' has
@@ -400,6 +624,19 @@ class HPexGUI(wx.Frame):
         self.Bind(wx.EVT_CLOSE, self.close)
         self.Show(True)
 
+        # The window goes up first, and then we fill it: the local
+        # listing once the event loop is running, and the port
+        # whenever the search finishes (on Windows, enumerating COM
+        # ports can take a second or more).
+        wx.CallAfter(self.refresh_all_files)
+        # The registry tells us when a USB serial port comes or goes,
+        # from a thread of its own, and keeps the list that
+        # get_serial_ports() reads current, so searching is quick.
+        self.port_registry = PortRegistry.get()
+        self.port_watch = lambda ports: wx.CallAfter(self.ports_changed, ports)
+        self.port_registry.watch(self.port_watch)
+        self.refresh_port()
+
     def dirpicker_changed(self, event):
         # When the local directory picker changes, update the path
         # (self.current_local_path is a Path object, because I like
@@ -423,6 +660,54 @@ class HPexGUI(wx.Frame):
 
         self.populate_local_files()
 
+    # All operations on the serial port go through the port's
+    # PortCoordinator (see port_coordinator.py) rather than a thread of
+    # their own, so they can't overlap. These return False if the same
+    # operation was already queued; the connector attributes then
+    # point at that one, and its result is what we'll get. Changing
+    # directory passes collapse=False, so every click is a step.
+    #
+    # Where the port allows it (see can_drive() in async_io.py), the
+    # connectors are the asyncio ones behind their pubsub adapters,
+    # which publish the same events.
+    def run_xmodem(self, command, fname='', priority=PRIORITY_INTERACTIVE,
+                   collapse=True):
+        port = StringTools.trim_serial_port(self.serial_port_box.GetValue())
+        from hpex.async_io import can_drive
+        if can_drive(port):
+            from hpex.async_connectors import AsyncXModemConnector as XModemConnector
+        else:
+            from hpex.xmodem_pubsub import XModemConnector
+        connector = XModemConnector()
+        self.xmodem = PortCoordinator.for_port(port).submit(
+            ('xmodem', command, str(fname)),
+            connector.run,
+            (port, self, fname, command, self.current_local_path, self.topic),
+            owner=connector,
+            priority=priority,
+            collapse=collapse)
+        self.xmodem_connector = self.xmodem.owner
+        return self.xmodem.owner is connector
+
+    def run_kermit(self, cmd, do_newdata_event=True,
+                   priority=PRIORITY_INTERACTIVE, collapse=True):
+        port = StringTools.trim_serial_port(self.serial_port_box.GetValue())
+        from hpex.async_io import can_drive
+        if can_drive(port):
+            from hpex.async_connectors import AsyncKermitConnector as KermitConnector
+        else:
+            from hpex.kermit_pubsub import KermitConnector
+        connector = KermitConnector()
+        self.kermit = PortCoordinator.for_port(port).submit(
+            ('kermit', cmd),
+            connector.run,
+            (port, self, cmd, self.topic, do_newdata_event),
+            owner=connector,
+            priority=priority,
+            collapse=collapse)
+        self.kermit_connector = self.kermit.owner
+        return self.kermit.owner is connector
+
     def hp_home(self, event):
         # Why don't we check for connection here? Because the internal
         # state will disable this button if we aren't connected.
@@ -430,29 +715,10 @@ class HPexGUI(wx.Frame):
         
         if self.xmodem_mode:
             self.hp_path = ['HOME']
-            self.xmodem_connector = XModemConnector()
-            self.xmodem = threading.Thread(
-                target=self.xmodem_connector.run,
-                # trim...() has already been called on the serial port box's contents
-                args=(StringTools.trim_serial_port(self.serial_port_box.GetValue()),
-                      self,
-                      '', 
-                      'home',
-                      self.current_local_path,
-                      self.topic))
-            self.xmodem.start()
+            self.run_xmodem('home')
         else:
-            # spawn a kermit thread
-            self.kermit_connector = KermitConnector()
-            
-            self.kermit = threading.Thread(
-                target=self.kermit_connector.run,
-                args=(StringTools.trim_serial_port(self.serial_port_box.GetValue()),
-                      self,
-                      'remote host HOME',
-                      self.topic))
-            
-            self.kermit.start()
+            self.pending_remote_path = ('HOME',)
+            self.run_kermit('remote host HOME')
 
     def hp_updir(self, event):
         self.new_remote_path = True
@@ -460,27 +726,10 @@ class HPexGUI(wx.Frame):
         if self.xmodem_mode:
             # trim last element
             self.hp_path = self.hp_path[:-1]
-            self.xmodem_connector = XModemConnector()
-            self.xmodem = threading.Thread(
-                target=self.xmodem_connector.run,
-                args=(StringTools.trim_serial_port(self.serial_port_box.GetValue()),
-                      self,
-                      '', 
-                      'updir',
-                      self.current_local_path,
-                      self.topic))
-            self.xmodem.start()
+            self.run_xmodem('updir', collapse=False)
         else:
-            self.kermit_connector = KermitConnector()
-            
-            self.kermit = threading.Thread(
-                target=self.kermit_connector.run,
-                args=(StringTools.trim_serial_port(self.serial_port_box.GetValue()),
-                      self,
-                      'remote host UPDIR',
-                      self.topic))
-            
-            self.kermit.start()
+            self.pending_remote_path = path_key(self.hp_dir)[:-1]
+            self.run_kermit('remote host UPDIR', collapse=False)
 
     # restore the drop targets to both listboxes
     # this function is needed when a transfer fails
@@ -497,11 +746,11 @@ class HPexGUI(wx.Frame):
 
         file_path = Path(
             self.current_local_path,
-            self.local_files.GetItemText(
+            self.local_files.item_name(
                 self.local_files.GetFirstSelected()))
 
         # can't drag a directory!
-        if os.path.isdir(file_path):
+        if self.local_files.listing.dirs[self.local_files.GetFirstSelected()]:
             print('is directory')
             return
 
@@ -544,8 +793,11 @@ class HPexGUI(wx.Frame):
     def disable_on_disconnect(self):
         # These two functions are pretty obvious. Clear and disable or
         # enable widgets and get the states of everything correct.
-        self.hp_files.DeleteAllItems()
+        self.hp_files.clear()
         self.hp_dir_label.SetLabelText('Not connected')
+        self.disconnecting = False
+        # cached listings only last for one session
+        self.listing_cache = None
         # keep self.hp_files enabled
         self.hp_home_button.Disable()
         self.hp_updir_button.Disable()
@@ -597,7 +849,7 @@ class HPexGUI(wx.Frame):
     def set_kermit_ui_layout(self, event):
         self.xmodem_mode = False
         self.hp_dir_label.SetLabelText('')
-        self.hp_files.DeleteAllItems()
+        self.hp_files.clear()
         self.hp_dir_label.Enable()
         self.connect_button.Enable()
 
@@ -610,32 +862,85 @@ class HPexGUI(wx.Frame):
         # put HPex into a blocking state.
         if not self.connected:
             self.refresh_port()
-        self.refresh_all_files()
+        self.refresh_all_files(event)
         
     def refresh_all_files(self, event=None):
         c = inspect.currentframe()
         print(inspect.getouterframes(c, 2)[1][3])
-        self.refresh_local_files()
-        if self.connected:
+        # While the watcher is running, the local pane is already up
+        # to date (after a get, say), so it's only scanned again when
+        # the user asks with the Refresh button (which passes an
+        # event).
+        if event is not None or not self.local_watcher.live:
+            self.refresh_local_files()
+        if self.can_transfer():
             self.SetStatusText('Refreshing remote variables...')
             if self.xmodem_mode:
-                self.save_hp_selection()
                 print('xmodem refresh')
-                # xmodem refresh
-                self.xmodem = threading.Thread(
-                    target=self.xmodem_connector.run,
-                    args=(StringTools.trim_serial_port(self.serial_port_box.GetValue()),
-                          self,
-                          '', # no filename here
-                          'refresh',
-                          self.current_local_path,
-                          self.topic))
-                self.xmodem.start()
+                self.run_xmodem('refresh', priority=PRIORITY_BACKGROUND)
             else:
                 self.call_remote_directory()
 
+    def can_transfer(self) -> bool:
+        """Whether there's a server to send things to, and it hasn't
+        been told to finish."""
+        return self.connected and not self.disconnecting
+
     def refresh_port(self, event=None):
-        self.serial_port_box.SetValue(FileTools.get_serial_ports(self))
+        # get_serial_ports() reads the PortRegistry's list (or
+        # enumerates COM ports, or globs /dev/pts), and that can be
+        # slow, so it runs on a thread and the result is
+        # put in the box with wx.CallAfter. It can't update the
+        # statusbar itself from there, so we do that too.
+        self.port_search += 1
+        search = self.port_search
+        typed = self.serial_port_box.GetValue()
+        self.SetStatusText('Searching for serial ports...')
+
+        def find_port():
+            port = FileTools.get_serial_ports(None)
+            wx.CallAfter(self.port_found, search, typed, port)
+
+        threading.Thread(target=find_port, daemon=True).start()
+
+    def port_found(self, search, typed, port):
+        # the window may have been closed while we were looking (a
+        # destroyed wx window is false), or a newer search is running
+        # and this result is stale
+        if not self or search != self.port_search:
+            return
+        # if the user typed a port while we were looking, or we've
+        # connected since, keep it
+        if self.connected or self.serial_port_box.GetValue() != typed:
+            return
+        self.serial_port_box.SetValue(port)
+        self.auto_port = port
+        if port == '':
+            self.SetStatusText('No serial ports found, serial port box empty.')
+        else:
+            self.SetStatusText('Using ' + port)
+
+    def ports_changed(self, ports):
+        # from the PortRegistry, through wx.CallAfter, when a cable
+        # was plugged in or pulled out. We search again, unless we're
+        # connected or the box has a port the user typed in.
+        if not self or self.connected:
+            return
+        if self.serial_port_box.GetValue() not in ('', self.auto_port):
+            return
+        self.refresh_port()
+
+    def local_dir_changed(self, path, events, listing):
+        # from the DirWatcher, through wx.CallAfter. The window may
+        # have closed since, or the pane moved to another directory.
+        if not self or path != self.local_files.listing.path:
+            return
+        self.local_files.apply_changes(events, listing)
+
+    def local_info_ready(self, path, info):
+        if not self:
+            return
+        self.local_files.info_ready(path, info)
 
     def populate_local_files(self):
         # The way the file update functions change the statusbar is a
@@ -646,32 +951,12 @@ class HPexGUI(wx.Frame):
         # (double-click in listctrl and dirpicker change) update the
         # widgets correctly.
         #self.SetStatusText('Updating local files...')
-        self.local_files.DeleteAllItems()
-        # no hiddens (should be an option in settings)
-        cdir_path = Path(self.current_local_path).expanduser().glob('*')
-
-        cdir = []
-        # convert Paths to strings
-        for i in cdir_path:
-            if not i.name.startswith('.'):
-                cdir.append(str(i))
-            
-        cdir.sort()
-
-        for i in cdir:
-            if Path(i).expanduser().is_dir():
-                # icon 0 is a folder
-                icon = 0
-            else:
-                # icon 1 is a file
-                icon = 1
-                
-                
-            self.local_files.InsertItem(
-                self.local_files.GetItemCount(),
-                Path(i).name, icon)
-                
-        self.local_files.SetColumnWidth(0, wx.LIST_AUTOSIZE)
+        # The watcher starts first, so that nothing that changes
+        # during the scan is missed. The scan reuses the last snapshot
+        # if the directory hasn't changed since.
+        self.local_watcher.watch(str(self.current_local_path))
+        self.local_files.set_listing(LocalListing.scan(
+            str(self.current_local_path), self.local_files.listing))
         # put this here so that it will be called no matter how the
         # user chooses a new directory
         self.local_dir.SetLabelText(
@@ -712,8 +997,8 @@ class HPexGUI(wx.Frame):
         if local_sel_index >= 0: # something is selected
             # populate self.local_selection with the name of the
             # selected entry
-            self.local_selection = self.local_files.GetItem(
-                local_sel_index).GetText()
+            self.local_selection = self.local_files.item_name(
+                local_sel_index)
         else:
             self.local_selection = None
         # clear the local box, then reload it
@@ -739,8 +1024,8 @@ class HPexGUI(wx.Frame):
         # check if there's a selection, like before. if there isn't
         # one, we just won't select anything.
         if self.local_selection:
-            found_item_index = self.local_files.FindItem(
-                0, self.local_selection)
+            found_item_index = self.local_files.listing.find(
+                self.local_selection)
 
             if found_item_index != -1: # -1 is returned when the item is not found
                 #print(self.local_files.GetItem(found_item_index))
@@ -753,61 +1038,24 @@ class HPexGUI(wx.Frame):
         # always get called.
 
 
-    def save_hp_selection(self):
-        self.hp_top_index = self.hp_files.GetTopItem()
-        hp_sel_index = self.hp_files.GetFirstSelected()
-        
-        if hp_sel_index >= 0:
-            self.hp_selection = self.hp_files.GetItem(
-                hp_sel_index).GetText()
-        else:
-            self.hp_selection = None
-        print('self.hp_selection', self.hp_selection)
-        
     def call_remote_directory(self):
-        # same thing here as in the local update...
-        self.save_hp_selection()
-        
         #self.SetStatusText('Updating remote variables...')
         # refresh the path by calling remote directory
-        self.kermit_connector = KermitConnector()
-            
-        self.kermit = threading.Thread(
-            target=self.kermit_connector.run,
-            args=(StringTools.trim_serial_port(self.serial_port_box.GetValue()),
-                  self,
-                  'remote directory',
-                  self.topic,
-                  False))
-            
-        self.kermit.start()
-    # This is very similar to refresh_local_files(). It saves the
-    # selection, repopulates, and reselects.
-    def reselect_hp_var(self):
-        print('self.hp_selection in refresh', self.hp_selection)
-        loc = self.hp_top_index + self.hp_files.GetCountPerPage() - 1
-        # prevent an assertionerror when there is less
-        # than one pagefull of files on the remote side
-        if loc >= self.hp_files.GetCountPerPage():
-            self.hp_files.EnsureVisible(loc)
-
-        # select the previously selected item
-        if self.hp_selection:
-            found_item_index = self.hp_files.FindItem(0, self.hp_selection)
-            if found_item_index != -1:
-                self.hp_files.Select(found_item_index)
+        self.run_kermit(
+            'remote directory', False, priority=PRIORITY_BACKGROUND)
+    def hp_filter_changed(self, event):
+        self.hp_files.set_filter(self.hp_filter.GetValue())
 
-                
     def local_item_activated(self, event):
         sel_index = self.local_files.GetFirstSelected()
         # build a complete path to chdir to
         filename = Path(
             self.current_local_path,
-            self.local_files.GetItem(sel_index).GetText())
+            self.local_files.item_name(sel_index))
         
         # make sure it's a directory
         # if it isn't a directory, we just don't do anything
-        if filename.expanduser().is_dir():
+        if self.local_files.listing.dirs[sel_index]:
             # if it is, update the path, picker, and file list
             self.current_local_path = filename
             self.local_dir_picker.SetPath(str(self.current_local_path))
@@ -817,43 +1065,27 @@ class HPexGUI(wx.Frame):
 
     def hp_item_activated(self, event):
 
-        sel_index = self.hp_files.GetFirstSelected()
-        varname = self.hpvars[sel_index].name
+        var = self.hp_files.var_at(self.hp_files.GetFirstSelected())
+        varname = var.name
 
-        if self.hpvars[sel_index].vtype == 'Directory':
+        if var.vtype == 'Directory':
             self.SetStatusText(
                 f'Changing calculator directory to {varname}...')
 
             if self.xmodem_mode:
                 self.new_remote_path = True
-                self.hp_path.append(varname)
                 print('chdir ' + varname)
-                self.xmodem_connector = XModemConnector()
-                self.xmodem = threading.Thread(
-                    target=self.xmodem_connector.run,
-                    # trim...() has already been called on the serial port box's contents
-                    args=(self.serial_port_box.GetValue(),
-                          self,
-                          varname, 
-                          'chdir',
-                          self.current_local_path,
-                          self.topic))
-                self.xmodem.start()
+                self.hp_path.append(varname)
+                self.run_xmodem('chdir', varname, collapse=False)
 
             else:
-                # this tells kermit_done() not to try to reselect a selected item
+                # this tells kermit_done() the listing is for a new directory
                 self.new_remote_path = True
                 print('varname', varname)
-            
-                self.kermit_connector = KermitConnector()
-                self.kermit = threading.Thread(
-                    target=self.kermit_connector.run,
-                    args=(StringTools.trim_serial_port(self.serial_port_box.GetValue()),
-                          self,
-                          'remote host ' + f'{varname}' + ' EVAL',
-                          self.topic,
-                          False))
-                self.kermit.start()
+                self.pending_remote_path = path_key(self.hp_dir) + (varname,)
+                # the calculator reads the name in translate mode 3
+                self.run_kermit(f'remote host {escape(varname)} EVAL', False,
+                                collapse=False)
 
     def send_menu_callback(self, event):
         index = self.local_files.GetFirstSelected()
@@ -863,7 +1095,7 @@ class HPexGUI(wx.Frame):
         
         file_path = Path(
             self.current_local_path,
-            self.local_files.GetItemText(index))
+            self.local_files.item_name(index))
         self.transfer_to_hp(file_path)
 
     def get_menu_callback(self, event):
@@ -912,33 +1144,60 @@ class HPexGUI(wx.Frame):
             self.hpvars = []
 
         basename = Path(filename).name
-        self.SetStatusText(f'Transferring {basename} to calculator...')
 
-        msg = FileTools.create_local_message(
-            filename.expanduser(), basename)
+        if self.xmodem_mode and not self.connected:
+            # XRECV takes one file and then quits, so there's nothing
+            # to queue: this still gets a dialog of its own.
+            from hpex.file_dialogs import FileSendDialog
+            self.SetStatusText(f'Transferring {basename} to calculator...')
+            # usually in the cache already, since the file was on
+            # screen to be sent
+            msg = self.object_info.lookup(filename).message(basename)
+            FileSendDialog(
+                parent=self,
+                file_message=msg,
+                port=StringTools.trim_serial_port(self.serial_port_box.GetValue()),
+                # we have to give the dialog the full path so that
+                # Kermit can get it
+                filename=filename.expanduser(),
+                ptopic=self.topic,
+                file_already_exists=False,
+                use_xmodem=self.xmodem_mode,
+                success_callback=self.transfer_done)
+            return
+
         exists = False
         for var in self.hpvars:
             if var.name == basename:
                 exists = True
-                
-        FileSendDialog(
-            parent=self,
-            file_message=msg,
-            port=StringTools.trim_serial_port(self.serial_port_box.GetValue()),
-            # we have to give the dialog the full path so that
-            # Kermit can get it
-            filename=filename.expanduser(),
-            ptopic=self.topic,
-            file_already_exists=exists,
-            use_xmodem=self.xmodem_mode,
-            success_callback=self.refresh_all_files)
+
+        # ask for overwriting, but note that it only matters in Kermit
+        # mode and if the user wants it.
+        ask = HPexSettingsTools.load_settings()['ask_for_overwrite']
+        if exists and not self.xmodem_mode and ask:
+            result = wx.MessageDialog(
+                self,
+                f"'{basename}' already exists on the calculator.\nDo you want to continue?\nIf overwriting is disabled on the calculator, files will become '{basename}.1', '{basename}.2', etc.",
+                'File already exists',
+                wx.YES_NO | wx.ICON_QUESTION | wx.NO_DEFAULT).ShowModal()
+            # ID_CANCEL results from the user closing the dialog with
+            # the window manager's close button. We make it mean "no".
+            if result == wx.ID_NO or result == wx.ID_CANCEL:
+                return
+
+        self.SetStatusText(f'Queued {basename} to send to calculator.')
+        self.transfer_queue.add_send(filename)
 
     def transfer_to_local(self, sel_index):
         index = int(sel_index)
         print('start_local_transfer, index is', index)
-        var = self.hpvars[index]
+        # the index of the row, which isn't the index in self.hpvars
+        # when the list is sorted or filtered
+        var = self.hp_files.var_at(index)
 
-        if '\\' in var.name:
+        # Kermit names are shown with their escapes turned back into
+        # characters (see hp48_codec.py), so it's those we look for
+        if not self.xmodem_mode and escape(var.name) != var.name:
             # as far as I can tell, there is no way to transfer
             # variables with extended ASCII characters in the name
             wx.MessageDialog(self, 'Kermit cannot transfer variables with special characters! Please rename to transfer.',
@@ -946,23 +1205,87 @@ class HPexGUI(wx.Frame):
                              style=wx.OK | wx.CENTRE | wx.ICON_ERROR).ShowModal()
             return
         
-        self.SetStatusText(f"Transferring '{var.name}' from calculator...")
-        msg = f"You have chosen to transfer '{var.name}' from the HP48 at " + StringTools.trim_serial_port(self.serial_port_box.GetValue()) + '.'
-        filestats = f'Size: {var.size}\nType: {var.vtype}\nChecksum: {var.crc}'
+        # check for the file in the current local directory, if it
+        # exists, ask about overwriting
+        overwrite = False
+        ask = HPexSettingsTools.load_settings()['ask_for_overwrite']
+        if ask and Path(self.current_local_path, var.name).expanduser().is_file():
+            result = wx.MessageDialog(
+                self,
+                f"'{var.name}' already exists in " +
+                str(self.current_local_path) +
+                f".\nDo you want to overwrite the existing file?\nIf you choose not to overwrite, files will become '{var.name}.~1~', '{var.name}.~2~', etc.",
+                'File already exists',
+                wx.YES_NO | wx.ICON_QUESTION | wx.CANCEL | wx.NO_DEFAULT).ShowModal()
+            if result == wx.ID_CANCEL:
+                return
+            overwrite = result == wx.ID_YES
+
+        self.SetStatusText(f"Queued '{var.name}' to get from calculator.")
+        self.transfer_queue.add_get(var, self.current_local_path, overwrite)
 
+    def current_remote_path(self) -> tuple:
+        if self.xmodem_mode:
+            return path_key(self.hp_path)
+        return path_key(self.hp_dir)
+
+    def transfer_done(self):
+        # A send or get just finished in the current remote directory,
+        # so its cached listing is out of date. (Files can be sent
+        # without being connected, in which case there's no cache.)
+        if self.listing_cache is not None:
+            self.remote_contents_changed(self.current_remote_path())
+        self.refresh_all_files()
+
+    def remote_contents_changed(self, path=None):
+        # Called whenever HPex changes something on the calculator. No
+        # path means we can't tell what changed (like a remote
+        # command), so every cached listing goes.
+        if self.listing_cache is not None:
+            self.listing_cache.invalidate(path)
+
+    def show_cached_listing(self, path) -> bool:
+        # Show the listing for path straight from the cache, without
+        # touching the serial port. Returns False if it isn't cached,
+        # in which case the caller has to fetch it.
+        if self.listing_cache is None or path is None:
+            return False
+        cached = self.listing_cache.get(path)
+        if cached is None:
+            return False
+
+        mem, varlist = cached
+        print('using cached listing for', path_to_str(path_key(path)))
+        # there's no listing on the way for this to apply to
+        self.new_remote_path = False
+        if self.xmodem_mode:
+            self.show_xmodem_listing(mem, varlist)
+            return True
 
-        FileGetDialog(
-            parent=self,
-            message=msg,
-            file_message=filestats,
-            port=StringTools.trim_serial_port(StringTools.trim_serial_port(self.serial_port_box.GetValue())),
-            filename=var.name,
-            current_dir=self.current_local_path,
-            use_xmodem=self.xmodem_mode,
-            ptopic=self.topic,
-            success_callback=self.refresh_all_files)
+        self.hp_dir = path_to_str(path_key(path))
+        self.memfree = mem
+        self.hpvars = varlist
+        self.populate_hp_listbox()
+        self.hp_dir_label.SetLabelText(
+            f'{self.hp_dir}  {self.memfree} bytes free')
+        if self.hp_dir == '{ HOME }':
+            self.hp_updir_button.Disable()
+        else:
+            self.hp_updir_button.Enable()
+        self.SetStatusText('Updated remote variables.')
+        return True
         
+    def start_object_info_dialog(self, event=None):
+        from hpex.dialogs import ObjectInfoDialog
+        # a new dialog every time
+        ObjectInfoDialog(self, self.current_local_path).go()
+
+    def start_settings_frame(self, event=None):
+        from hpex.settings_frame import SettingsFrame
+        SettingsFrame(self).go()
+
     def start_remote_command_dialog(self, event=None):
+        from hpex.dialogs import RemoteCommandDialog
         RemoteCommandDialog(
             self,
             StringTools.trim_serial_port(self.serial_port_box.GetValue())).go()
@@ -998,7 +1321,7 @@ class HPexGUI(wx.Frame):
             # crc in that order
             
             self.hpvars.append(
-                HPVariable(name=i[0],
+                HPVariable(name=unescape(i[0]),
                            size=i[1],
                            vtype=KermitProcessTools.type_add_spaces(i[2]),
                            crc=KermitProcessTools.checksum_to_hexstr(i[3])))
@@ -1007,17 +1330,10 @@ class HPexGUI(wx.Frame):
         self.populate_hp_listbox()
         
     def populate_hp_listbox(self):
-        # clear the listctrl to refresh
-        self.hp_files.DeleteAllItems()
-
-        for index, var in enumerate(self.hpvars):
-            item_index = self.hp_files.InsertItem(index, var.name)
-            self.hp_files.SetItem(item_index, 1, var.size)
-            self.hp_files.SetItem(item_index, 2, var.vtype)
-            self.hp_files.SetItem(item_index, 3, var.crc)
-
-        # auto resize the list in case lengths have changed
-        self.hp_files.SetColumnWidth(0, wx.LIST_AUTOSIZE)
+        # only the rows that changed since the last listing of this
+        # directory are touched (see HPFileList)
+        path = self.hp_path if self.xmodem_mode else self.hp_dir
+        self.hp_files.show(path, self.hpvars)
 
     def empty_port_box_warning(self) -> bool:
         # returns True if box is empty, False otherwise
@@ -1030,22 +1346,19 @@ class HPexGUI(wx.Frame):
         return False
 
 
-    def xmodem_connectdone(self, mem, pathfile, varlist):
+    def xmodem_connectdone(self, mem, varlist, path_saved):
         # re-enable the connect button because now it disconnects
         self.connect_button.Enable()
-        # None is returned if pathfile is not generated (or if it
-        # fails, I suppose, but that should already be handled by the
-        # error handler). It wouldn't be generated in the event that
-        # the user settings don't ask to reset the calculator
-        # directory on disconnect.
-        if pathfile != None:
-            pathfile.seek(0)
-            print(pathfile.read())
-            self.pathfile = pathfile
+        # whether the connector saved the calculator's path, which
+        # decides whether disconnecting goes back to it (not the
+        # setting, which can change in between)
+        self.xmodem_path_saved = path_saved
 
         # hp_path is a list which is converted to HP list notation. we
         # only need this for XModem server mode.
         self.hp_path = ['HOME']
+        self.listing_cache = RemoteListingCache(
+            int(HPexSettingsTools.load_settings()['listing_cache_ttl']))
 
         self.SetStatusText('Connected to XModem server on ' +
                            StringTools.trim_serial_port(
@@ -1081,6 +1394,8 @@ class HPexGUI(wx.Frame):
         elif cmd == 'connect':
             self.connecting_dialog.Close()
             
+        # nothing queued can go now
+        self.transfer_queue.stop('Not sent')
         self.disable_on_disconnect()
 
         if _system == 'Windows':
@@ -1110,9 +1425,13 @@ class HPexGUI(wx.Frame):
         
     def xmodem_refreshdone(self, mem, varlist):
         print('refreshdone')
+        if self.listing_cache is not None:
+            self.listing_cache.put(self.hp_path, mem, varlist)
+        self.show_xmodem_listing(mem, varlist)
+
+    def show_xmodem_listing(self, mem, varlist):
         self.hpvars = varlist
         self.populate_hp_listbox()
-        self.reselect_hp_var()
         self.memfree = mem
         print('self.memfree', self.memfree)
         # HPex will always place the calculator in HOME, like Conn4x.
@@ -1133,7 +1452,8 @@ class HPexGUI(wx.Frame):
     def xmodem_done(self):
         # this is triggered when a directory change occurs and is
         # successful
-        self.refresh_all_files()
+        if not self.show_cached_listing(self.hp_path):
+            self.refresh_all_files()
         print('xmodem done')
         
     def kermit_cancelled(self, cmd, out):
@@ -1143,6 +1463,7 @@ class HPexGUI(wx.Frame):
         print('kermit cancelled in HPex')
         out = KermitProcessTools.strip_blank_lines(out)
 
+        self.transfer_queue.stop('Not sent')
         self.disable_on_disconnect()
         
         self.connect_button.SetLabel('Connect')
@@ -1157,6 +1478,7 @@ class HPexGUI(wx.Frame):
             self.connecting_dialog.Close()
         # If Kermit failed, notify the user, correct various states,
         # and tell them what Kermit said (why it failed).
+        from hpex.dialogs import KermitErrorDialog
         print('kermit failed in HPex')
         print(out)
         if cmd == 'finish':
@@ -1166,6 +1488,8 @@ class HPexGUI(wx.Frame):
             
             print('kermit failed on finish')
             KermitErrorDialog(self, out).Show(True)
+            # still connected, so the user can try again
+            self.disconnecting = False
             return
 
 
@@ -1178,7 +1502,8 @@ class HPexGUI(wx.Frame):
         KermitErrorDialog(self, out).Show(True)
 
         # empty the remote listctrl and return to disconnected mode
-        self.hp_files.DeleteAllItems()
+        self.transfer_queue.stop('Not sent')
+        self.hp_files.clear()
         self.connect_button.SetLabel('Connect') # just in case
         self.disable_on_disconnect()
         self.connected = False # also just in case
@@ -1226,6 +1551,8 @@ class HPexGUI(wx.Frame):
                 self.connect_button.SetLabel('Disconnect')
                 self.enable_on_connect()
                 self.connected = True                
+                self.listing_cache = RemoteListingCache(
+                    int(HPexSettingsTools.load_settings()['listing_cache_ttl']))
 
             # These are all two words, so it breaks a .split(' '). We
             # replace here and fix again later. I found them with a
@@ -1238,22 +1565,12 @@ class HPexGUI(wx.Frame):
             out = KermitProcessTools.remove_kermit_warnings(
                 out.splitlines())
 
-            # save the current selected item
-            if self.connected:
-                self.hp_top_index = self.hp_files.GetTopItem()
-                hp_sel_index = self.hp_files.GetFirstSelected()
-            
-                if hp_sel_index >= 0:
-                    self.hp_selection = self.hp_files.GetItem(
-                        hp_sel_index).GetText()
-                else:
-                    self.hp_selection = None
-
             # read these again to be processed
             self.hp_dir, self.memfree = KermitProcessTools.process_kermit_header(out)
             print(self.hp_dir)
             # update self.hpvars and the header above self.hp_files
             self.process_kermit_data(out)
+            self.listing_cache.put(self.hp_dir, self.memfree, self.hpvars)
             self.hp_dir_label.SetLabelText(
                 f'{self.hp_dir}  {self.memfree} bytes free')
 
@@ -1276,8 +1593,6 @@ class HPexGUI(wx.Frame):
                 if self.new_remote_path:
                     self.new_remote_path = False
                     return
-                else:
-                    self.reselect_hp_var()
                 self.SetStatusText('Updated remote variables.')
             else:
                 self.SetStatusText(
@@ -1300,11 +1615,14 @@ class HPexGUI(wx.Frame):
                 
         elif 'remote host' in cmd:
             # We changed directories.
-            self.call_remote_directory()
+            if not self.show_cached_listing(self.pending_remote_path):
+                self.call_remote_directory()
+            self.pending_remote_path = None
             
 
     # TODO: this hangs on serial port error
     def connect_callback(self, event):
+        from hpex.dialogs import ConnectingDialog
         # disable to prevent double-clicking
         self.connect_button.Disable()
         # This function is responsible for both connecting and
@@ -1317,11 +1635,6 @@ class HPexGUI(wx.Frame):
         if self.empty_port_box_warning():
             return
 
-        if self.xmodem_mode:
-            self.xmodem_connector = XModemConnector()
-        else:
-            self.kermit_connector = KermitConnector()
-        
         if not self.connected:
             self.SetStatusText('Connecting to calculator...')
             if self.xmodem_mode:
@@ -1330,16 +1643,7 @@ class HPexGUI(wx.Frame):
                     'Make sure the XModem server is running on the calculator.',
                     'Connecting...')
                 
-                self.xmodem = threading.Thread(
-                    target=self.xmodem_connector.run,
-                    # trim...() has already been called on the serial port box's contents
-                    args=(self.serial_port_box.GetValue(),
-                          self,
-                          '', # no filename here
-                          'connect',
-                          self.current_local_path,
-                          self.topic))
-                self.xmodem.start()
+                self.run_xmodem('connect')
                 return
             
 
@@ -1349,16 +1653,20 @@ class HPexGUI(wx.Frame):
                     'Make sure the calculator is in Kermit server mode and set to translate mode 3.',
                     'Connecting...')
                 
-                self.kermit = threading.Thread(
-                    target=self.kermit_connector.run,
-                    args=(StringTools.trim_serial_port(self.serial_port_box.GetValue()),
-                          self,
-                          'remote directory',
-                          self.topic,
-                          False))
-                self.kermit.start()
+                self.run_kermit('remote directory', False)
             
         else:# self.connected
+            # Whatever was still waiting for the port (refreshes,
+            # mostly) is pointless once the server is gone. The
+            # transfer queue has to stop first, or the transfer it
+            # was waiting on would start the next one as soon as it
+            # was cancelled or finished. A transfer that's already
+            # running finishes before the disconnect, which waits
+            # for the port.
+            self.disconnecting = True
+            self.transfer_queue.stop('Not sent')
+            PortCoordinator.for_port(StringTools.trim_serial_port(
+                self.serial_port_box.GetValue())).cancel_queued()
             if self.xmodem_mode:
                 print('disconnect in xmodem mode')
 
@@ -1367,27 +1675,17 @@ class HPexGUI(wx.Frame):
                     "Finishing XModem server on calculator...",
                     'Finishing...',)
 
-                if not HPexSettingsTools.load_settings()['reset_directory_on_disconnect']:
-                    # if this has been disabled, we still pass it to
-                    # the connector, but it isn't ever used.
-                    self.pathfile = None
-
-                self.xmodem = threading.Thread(
-                    target=self.xmodem_connector.run,
-                    args=(StringTools.trim_serial_port(self.serial_port_box.GetValue()),
-                          self,
-                          self.pathfile,
-                          'disconnect',
-                          self.current_local_path,
-                          self.topic))
-                self.xmodem.start()
+                # The original path is kept on the calculator, if
+                # connecting saved it.
+                self.run_xmodem(
+                    'disconnect', PATH_VAR if self.xmodem_path_saved else '')
 
             else:
                 # the user can choose to reset the directory to the
                 # starting directory (when we connected) on disconnect.
                 cmd = ''
                 if HPexSettingsTools.load_settings()['reset_directory_on_disconnect']:
-                    cmd += f'remote host {self.firstpath} EVAL,'
+                    cmd += f'remote host {escape(self.firstpath)} EVAL,'
                     
                 self.connecting_dialog = ConnectingDialog(
                     self, self.connecting_dialog_cancel,
@@ -1397,26 +1695,25 @@ class HPexGUI(wx.Frame):
                     # the event handler will take care of any troubles from
                     # this
                     
-                self.kermit = threading.Thread(
-                    target=self.kermit_connector.run,
-                    args=(StringTools.trim_serial_port(self.serial_port_box.GetValue()),
-                          self,
-                          cmd + 'finish',
-                          self.topic,
-                          False))
-            
-                self.kermit.start()
+                self.run_kermit(cmd + 'finish', False)
         
     # tell the thread to kill kermit, then kill the thread, then
     # close the "connecting" frame
 
     # needs an event, because this gets called by a bound event
     def connecting_dialog_cancel(self, event):
-        if self.xmodem:
-            self.xmodem_connector.cancel()
-        else:
-            self.kermit_connector.kill_kermit()
+        # If the connect (or finish) is still queued behind something
+        # else, just take it out of the queue; there's nothing on the
+        # port to stop yet.
+        job = self.xmodem if self.xmodem_mode else self.kermit
+        if not job.cancel():
+            if self.xmodem_mode:
+                self.xmodem_connector.cancel()
+            else:
+                self.kermit_connector.kill_kermit()
 
+        # if that was a disconnect, we're still connected
+        self.disconnecting = False
         self.connect_button.Enable()
         self.connecting_dialog.Close()
         
@@ -1424,6 +1721,10 @@ class HPexGUI(wx.Frame):
     def close(self, event):
         # If Kermit fails here, HPex will stop for a short moment
         # until Kermit gives up. I don't think this is an issue.
+        self.local_watcher.stop()
+        self.port_registry.unwatch(self.port_watch)
+        # this also saves the info cache
+        self.object_info.close()
         self.Destroy()
 
 
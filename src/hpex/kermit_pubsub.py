@@ -1,9 +1,98 @@
 import signal
+import select
+import time
 
 from pubsub import pub
 import ptyprocess
 
 from hpex.settings import HPexSettingsTools
+from hpex.cancel_io import CancelPipe
+from hpex.transport import is_network_port, split_port_url
+from hpex.tty_tuning import tune_port
+
+# How long Kermit gets to send its error packet and exit after we ask
+# it to, before we kill it.
+KERMIT_CANCEL_GRACE = .5
+
+def kermit_invocation(settings, command, port, interactive=False) -> list:
+    """Build the command line that runs `command` in Kermit on `port`.
+    With `interactive`, Kermit stays at its prompt afterwards instead
+    of exiting."""
+    # options:
+    #     -Y  | don't read ~/.kermrc
+    #     -H  | suppress herald and greeting
+    #     -B  | Kermit is in background mode
+    #     -C  | run these commands
+    #     -l  | use this port
+    #     -b  | use this speed
+    
+    # the idea to use 'set file display crt' comes from HPTalx. It
+    # simplifies the file transfer status thing to be less
+    # terminal-demanding and easier to read from an automated
+    # program.
+
+    # 'set file names literal' tells Kermit to note the
+    # capitalization of the 48 filenames.
+    
+    # 'set send timeout 1', 'set receive timeout 1', and 'set
+    # retry-limit 1' all tell Kermit not to wait very long for
+    # packets.
+    invocation = [settings['kermit_executable'], '-Y', '-H', '-C', 'set parity none,set flow none,set carrier-watch off,set modem type direct,set block 3,set control prefix all,set protocol kermit,set send timeout 1,set receive timeout 1,set retry-limit 1,set file display crt,set file names literal,set hints off,set quiet on,']
+    
+    file_mode = settings['file_mode']
+    if file_mode == 'Binary':
+        invocation[-1] += 'set file type binary,'
+    elif file_mode == 'ASCII':
+        invocation[-1] += 'set file type text,'
+    # no else, we just won't do anything if it's set to Auto
+    
+    parity = settings['parity']
+    # '0 (None)', '1 (Odd)', '2 (Even)', '3 (Mark)', '4 (Space)'
+    
+    # we check if the number is in the parity value, because the
+    # CLI uses just numbers
+    if parity == '0 (None)':
+        invocation[-1] += 'set parity none,'
+    elif parity == '1 (Odd)':
+        invocation[-1] += 'set parity odd,'
+    elif parity == '2 (Even)':
+        invocation[-1] += 'set parity even,'
+    elif parity == '3 (Mark)':
+        invocation[-1] += 'set parity mark,'
+    elif parity == '4 (Space)':
+        invocation[-1] += 'set parity space,'
+
+    cksum = settings['kermit_cksum']
+    # kermit_cksum is just a number in a string, so we can append
+    # it directly
+
+    invocation[-1] += f'set block {cksum},'
+
+    if is_network_port(port):
+        # -l only takes devices, so network ports are opened with
+        # 'set host' before the command instead. socket:// is the raw
+        # bytes over TCP; rfc2217:// is telnet with the COM port
+        # option, which is how Kermit gets to set the speed on the
+        # other end.
+        scheme, host, number = split_port_url(port)
+        if scheme == 'socket':
+            invocation[-1] += f'set host {host} {number} /raw-socket,'
+        else:
+            invocation[-1] += ('set telopt com-port-control requested,'
+                               f'set host {host} {number} /telnet,'
+                               f"set speed {settings['baud_rate']},")
+
+    invocation[-1] += command
+    # without 'exit' in here, Kermit never finishes
+    if not interactive:
+        invocation[-1] += ',exit'
+    if not is_network_port(port):
+        invocation.append('-l')
+        invocation.append(port)
+        invocation.append('-b')
+        invocation.append(settings['baud_rate'])
+
+    return invocation
 
 # Kermit, even with set quiet on, will still let stale lock warnings
 # through. Therefore, we still have to filter it.
@@ -27,31 +116,16 @@ class KermitConnector:
 
         
         self.cancelled = False
+        # cancel_kermit() sets this to wake up the read loop below
+        self.cancel_pipe = CancelPipe()
+        # seconds from cancel_kermit() to the read loop waking up, and
+        # to Kermit having exited, for benchmarks/cancel_latency.py
+        self.woken_after = None
+        self.stopped_after = None
         self.parent = parent
         self.command = command
         self.ptopic = ptopic
         self.use_callafter = use_callafter
-        # options:
-        #     -Y  | don't read ~/.kermrc
-        #     -H  | suppress herald and greeting
-        #     -B  | Kermit is in background mode
-        #     -C  | run these commands
-        #     -l  | use this port
-        #     -b  | use this speed
-        
-        # the idea to use 'set file display crt' comes from HPTalx. It
-        # simplifies the file transfer status thing to be less
-        # terminal-demanding and easier to read from an automated
-        # program.
-
-        # 'set file names literal' tells Kermit to note the
-        # capitalization of the 48 filenames.
-        
-        # 'set send timeout 1', 'set receive timeout 1', and 'set
-        # retry-limit 1' all tell Kermit not to wait very long for
-        # packets.
-        
-
         # load alt_options if we choose to use them, otherwise, use
         # the settings file
         if not alt_options:
@@ -59,45 +133,12 @@ class KermitConnector:
         else:
             self.settings = alt_options
 
-        invocation = [self.settings['kermit_executable'], '-Y', '-H', '-C', 'set parity none,set flow none,set carrier-watch off,set modem type direct,set block 3,set control prefix all,set protocol kermit,set send timeout 1,set receive timeout 1,set retry-limit 1,set file display crt,set file names literal,set hints off,set quiet on,']
-        
-        file_mode = self.settings['file_mode']
-        if file_mode == 'Binary':
-            invocation[-1] += 'set file type binary,'
-        elif file_mode == 'ASCII':
-            invocation[-1] += 'set file type text,'
-        # no else, we just won't do anything if it's set to Auto
-        
-        parity = self.settings['parity']
-        # '0 (None)', '1 (Odd)', '2 (Even)', '3 (Mark)', '4 (Space)'
-        
-        # we check if the number is in the parity value, because the
-        # CLI uses just numbers
-        if parity == '0 (None)':
-            invocation[-1] += 'set parity none,'
-        elif parity == '1 (Odd)':
-            invocation[-1] += 'set parity odd,'
-        elif parity == '2 (Even)':
-            invocation[-1] += 'set parity even,'
-        elif parity == '3 (Mark)':
-            invocation[-1] += 'set parity mark,'
-        elif parity == '4 (Space)':
-            invocation[-1] += 'set parity space,'
-
-        cksum = self.settings['kermit_cksum']
-        # kermit_cksum is just a number in a string, so we can append
-        # it directly
-
-        invocation[-1] += f'set block {cksum},'
-
-        invocation[-1] += self.command
-        # without 'exit' in here, Kermit never finishes
-        
-        invocation[-1] += ',exit'
-        invocation.append('-l')
-        invocation.append(port)
-        invocation.append('-b')
-        invocation.append(self.settings['baud_rate'])
+        # Kermit opens the port itself, so only the parts of the
+        # tuning that outlive our file descriptor apply here
+        if self.settings.get('low_latency') and not is_network_port(port):
+            tune_port(port)
+
+        invocation = kermit_invocation(self.settings, self.command, port)
 
         try:
             self.proc = ptyprocess.PtyProcessUnicode.spawn(invocation)
@@ -113,6 +154,12 @@ class KermitConnector:
 
         while True:
             try:
+                # Wait for Kermit to say something, or for
+                # cancel_kermit() to wake us up.
+                if not self.cancel_pipe.wait(self.proc.fd):
+                    self.stop_kermit()
+                    break
+                
                 # remote directory needs readline(), to work
                 if self.command == 'remote directory':
                     self.line = self.proc.readline()
@@ -216,28 +263,44 @@ class KermitConnector:
 
     def cancel_kermit(self):
         print('cancelling')
-
-        # Telling Kermit to stop with an "x" or an "e" is unreliable
-        # at best. If we kill the process directly, then it will
-        # stop. However, that means that both file transfer dialogs
-        # have to have the "press [ATTN] or [CANCEL]" message.
-        
-        self.kill_kermit()
+        # run() wakes up right away, stops Kermit with stop_kermit(),
+        # and sends the cancelled event once Kermit has exited.
         self.cancelled = True
+        self.cancel_pipe.set()
 
+    def stop_kermit(self):
+        """Called by run() after cancel_kermit(). Asks Kermit to send
+        an error packet, so the calculator stops too, and kills it if
+        it hasn't exited within KERMIT_CANCEL_GRACE seconds."""
+        self.woken_after = self.cancel_pipe.elapsed()
 
-        if self.use_callafter:
-            import wx
-            wx.CallAfter(
-                pub.sendMessage,
-                f'kermit.cancelled.{self.ptopic}',
-                cmd=self.command,
-                out=self.out)
-        else:
-            pub.sendMessage(
-                f'kermit.cancelled.{self.ptopic}',
-                cmd=self.command,
-                out=self.out)
+        # 'E' at Kermit's file transfer display sends the error
+        # packet. Telling Kermit to stop with an "x" or an "e" has
+        # been unreliable, though, so we can't count on it. If we
+        # have to kill it, the calculator is left waiting, which is
+        # why both file transfer dialogs have the "press [ATTN] or
+        # [CANCEL]" message.
+        try:
+            self.proc.write('E')
+        except (OSError, IOError):
+            pass
+
+        deadline = time.monotonic() + KERMIT_CANCEL_GRACE
+        while self.proc.isalive():
+            left = deadline - time.monotonic()
+            if left <= 0:
+                print('kermit ignored the error packet request, killing it')
+                self.proc.kill(signal.SIGKILL)
+                break
+            # keep reading, or Kermit could block writing to the pty
+            ready, _, _ = select.select([self.proc.fd], [], [], left)
+            if ready:
+                try:
+                    self.out += self.proc.read(1024)
+                except (OSError, IOError, EOFError):
+                    break
+
+        self.stopped_after = self.cancel_pipe.elapsed()
 
     def kill_kermit(self):
         # just let the run() function take care of
@@ -0,0 +1,67 @@
+import time
+
+# Fetching a listing means a whole round trip over the serial line
+# (M and L on the XModem server, 'remote directory' in Kermit), which
+# is slow enough that going back and forth between two directories is
+# painful. This keeps the listings we've already seen for the rest of
+# the session.
+#
+# Nothing on the calculator tells us when a directory changes, so the
+# cache only knows about changes HPex makes itself: sends, gets and
+# remote commands invalidate the affected entries. Changes made on the
+# calculator's keyboard are covered by the optional TTL, or by the
+# Refresh button.
+
+def path_key(path) -> tuple:
+    """Turn an HP path into a cache key. `path` can be a list of
+    names (like XModem mode's hp_path) or a '{ HOME DIR }' string
+    (like Kermit's header)."""
+    if isinstance(path, str):
+        return tuple(path.strip().strip('{}').split())
+    return tuple(path)
+
+def path_to_str(key) -> str:
+    """Convert a cache key back to '{ HOME ... }' notation."""
+    return '{ ' + ' '.join(key) + ' }'
+
+
+class RemoteListingCache:
+    def __init__(self, ttl=None):
+        # ttl is in seconds. None (or 0) means entries never expire
+        # on their own.
+        self.ttl = ttl or None
+        self.entries = {}
+        # Free memory is a property of the whole calculator, not of
+        # a directory, so we just keep the most recent value. Anything
+        # that invalidates a listing has changed it too, so it's
+        # forgotten then, and the cache misses until a fresh listing
+        # (from any directory) brings it back.
+        self.memfree = None
+
+    def get(self, path):
+        """Return (memfree, varlist) for `path`, or None if it isn't
+        cached, has expired, or memfree is out of date."""
+        key = path_key(path)
+        entry = self.entries.get(key)
+        if entry is None or self.memfree is None:
+            return None
+
+        stamp, varlist = entry
+        if self.ttl is not None and time.monotonic() - stamp > self.ttl:
+            del self.entries[key]
+            return None
+
+        return self.memfree, varlist
+
+    def put(self, path, memfree, varlist):
+        self.entries[path_key(path)] = (time.monotonic(), varlist)
+        self.memfree = memfree
+
+    def invalidate(self, path=None):
+        """Forget the listing for `path`, or everything if `path` is
+        None. Either way, the free memory is forgotten."""
+        self.memfree = None
+        if path is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(path_key(path), None)
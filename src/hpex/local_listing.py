@@ -0,0 +1,101 @@
+import os
+import time
+from bisect import bisect_left
+from operator import itemgetter
+
+# The local pane used to glob the directory, make a Path of every
+# entry and stat each one again to see if it was a directory, then
+# insert the rows one at a time. With a few thousand files (all of
+# hpcalc.org in one folder, say) that took seconds, and every refresh
+# did it all again.
+#
+# Now the pane is a virtual ListCtrl, which only asks for the rows
+# it's drawing, and this is what it reads them from: one pass of
+# os.scandir (whose DirEntry.is_dir() comes from the directory itself
+# on most systems, without a stat), sorted once. A refresh reuses the
+# snapshot as long as the directory's mtime hasn't changed, since
+# adding, removing or renaming an entry always changes it.
+
+# Filesystems with coarse timestamps (FAT has 2 s) can change a
+# directory twice in one tick, so a snapshot of a directory changed
+# this recently isn't reused.
+RACY_NS = 2_000_000_000
+
+
+class LocalListing:
+    """A sorted snapshot of a local directory, without hidden files."""
+    def __init__(self, path=None, key=None, names=(), dirs=()):
+        self.path = path
+        # (st_ino, st_mtime_ns) of the directory when it was scanned
+        self.key = key
+        self.names = list(names)
+        self.dirs = list(dirs)
+
+    def __len__(self):
+        return len(self.names)
+
+    def find(self, name) -> int:
+        """Index of `name`, or -1 (like ListCtrl.FindItem)."""
+        i = bisect_left(self.names, name)
+        if i < len(self.names) and self.names[i] == name:
+            return i
+        return -1
+
+    def apply(self, events) -> bool:
+        """Apply (action, name, is_dir) events from a DirWatcher.
+        Returns True if any rows changed."""
+        changed = False
+        for action, name, is_dir in events:
+            i = bisect_left(self.names, name)
+            present = i < len(self.names) and self.names[i] == name
+            # The watcher starts before the scan, so some events are
+            # for changes the scan already saw.
+            if action == 'add':
+                if not present:
+                    self.names.insert(i, name)
+                    self.dirs.insert(i, is_dir)
+                    changed = True
+                elif self.dirs[i] != is_dir:
+                    self.dirs[i] = is_dir
+                    changed = True
+            elif action == 'remove' and present:
+                del self.names[i]
+                del self.dirs[i]
+                changed = True
+        # this is no longer what the directory looked like at that
+        # mtime, so scan() mustn't reuse it
+        self.key = None
+        return changed
+
+    def longest_name(self) -> str:
+        return max(self.names, key=len, default='')
+
+    @classmethod
+    def scan(cls, path, previous=None):
+        """List `path`, or return `previous` if it's a snapshot of
+        `path` that's still current."""
+        path = os.path.expanduser(path)
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            print('cannot list', path, e)
+            return cls(path)
+
+        key = (st.st_ino, st.st_mtime_ns)
+        if previous is not None and previous.path == path and \
+           previous.key == key and time.time_ns() - st.st_mtime_ns > RACY_NS:
+            return previous
+
+        try:
+            with os.scandir(path) as it:
+                # no hiddens (should be an option in settings)
+                entries = [(e.name, e.is_dir()) for e in it
+                           if not e.name.startswith('.')]
+        except OSError as e:
+            print('cannot list', path, e)
+            return cls(path)
+
+        entries.sort(key=itemgetter(0))
+        return cls(path, key,
+                   [name for name, _ in entries],
+                   [is_dir for _, is_dir in entries])
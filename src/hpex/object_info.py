@@ -0,0 +1,267 @@
+import os
+import pickle
+import threading
+from pathlib import Path
+
+from hpex.helpers import FileTools
+
+# The local pane has columns for what the object info dialog shows:
+# the type of object, its checksum, ROM revision and size. Working
+# those out means reading the file and running the checksum engine
+# (crc_calculator.py, which is pure Python and not fast), so it's done
+# off the UI thread, by an ObjectInfoService:
+#
+# - The pane asks for a row's info when wx asks it for the row's text,
+#   which it only does for rows on screen, and the newest requests are
+#   done first. Scrolling through a big directory only ever computes
+#   what was looked at, most recent first.
+# - Files not in the cache go to a pool of processes, so the checksums
+#   run in parallel and the GIL stays with the UI.
+# - Results are kept in ~/.hpex_object_info between sessions, and used
+#   for as long as the file's size and mtime are the same.
+#
+# By the time a file is sent it's almost always been on screen, so
+# the send dialog and the transfer queue's read-ahead get its info
+# from the cache instead of computing it again.
+
+# most entries the cache file keeps; the oldest go first
+CACHE_ENTRIES = 20000
+# most requests waiting at once; scrolling quickly through a long
+# list makes many more than will ever be looked at again
+MAX_PENDING = 1000
+
+
+class ObjectInfo:
+    """What FileTools finds out about a local file."""
+    def __init__(self, size, crc=None, ascii_header=None):
+        self.size = size
+        # [ROM revision, checksum, object size], for binary objects
+        self.crc = crc
+        # (translate mode, angle mode, fraction mark), for ASCII
+        # objects
+        self.ascii_header = ascii_header
+
+    @property
+    def object_size(self):
+        """The size on the calculator, as far as we can tell."""
+        return self.crc[2] if self.crc else self.size
+
+    @property
+    def checksum(self) -> str:
+        return self.crc[1] if self.crc else ''
+
+    def message(self, basename) -> str:
+        return FileTools.format_local_message(
+            basename, self.crc, self.ascii_header, self.size)
+
+    def columns(self) -> tuple:
+        """Type, checksum, ROM and size, for the local pane."""
+        if self.crc:
+            return ('HP binary object', self.crc[1], self.crc[0], str(self.crc[2]))
+        if self.ascii_header:
+            return (f'HP ASCII object, T({self.ascii_header[0]})', '', '', str(self.size))
+        return ('File', '', '', str(self.size))
+
+
+def read_object_info(path) -> ObjectInfo:
+    # this runs in the worker processes
+    path = os.path.expanduser(path)
+    return ObjectInfo(os.stat(path).st_size,
+                      FileTools.get_crc(path),
+                      FileTools.read_hp_ascii(path))
+
+
+class ObjectInfoCache:
+    """ObjectInfo by path, kept in a file between sessions. An entry
+    is only used while the file's size and mtime are unchanged."""
+    def __init__(self, path=None):
+        self.path = Path(path or '~/.hpex_object_info').expanduser()
+        self.lock = threading.Lock()
+        # {path: (st_size, st_mtime_ns, ObjectInfo)}, oldest first.
+        # Read the first time it's needed.
+        self.entries = None
+        self.dirty = False
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                entries = pickle.load(f)
+            if not isinstance(entries, dict):
+                raise ValueError('not a dict')
+        except FileNotFoundError:
+            entries = {}
+        except Exception as e:
+            # an old or damaged file; it's only a cache
+            print('ignoring object info cache:', e)
+            entries = {}
+        self.entries = entries
+
+    def get(self, path, st):
+        with self.lock:
+            if self.entries is None:
+                self.load()
+            entry = self.entries.get(path)
+        if entry is not None and entry[:2] == (st.st_size, st.st_mtime_ns):
+            return entry[2]
+        return None
+
+    def put(self, path, st, info):
+        with self.lock:
+            if self.entries is None:
+                self.load()
+            # moved to the end, as the newest
+            self.entries.pop(path, None)
+            self.entries[path] = (st.st_size, st.st_mtime_ns, info)
+            while len(self.entries) > CACHE_ENTRIES:
+                del self.entries[next(iter(self.entries))]
+            self.dirty = True
+
+    def save(self):
+        # like the settings: written to a temporary file and renamed
+        # over the old one, so it's never left half written
+        import tempfile
+        with self.lock:
+            if not self.dirty:
+                return
+            fd, tmp = tempfile.mkstemp(dir=self.path.parent,
+                                       prefix=self.path.name + '.')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(self.entries, f)
+                os.replace(tmp, self.path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+            self.dirty = False
+
+
+class ObjectInfoService:
+    """Works out ObjectInfo for local files in the background, and
+    calls `callback(path, info)` from its own threads with each one."""
+    def __init__(self, callback, cache=None, workers=None):
+        self.callback = callback
+        self.cache = cache or ObjectInfoCache()
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.cond = threading.Condition()
+        # paths waiting, newest last (a dict is an ordered set)
+        self.pending = {}
+        self.in_flight = 0
+        self.thread = None
+        self.pool = None
+        self.closed = False
+
+    def request(self, path):
+        """Queue `path`. The newest requests are done first."""
+        with self.cond:
+            self.pending.pop(path, None)
+            self.pending[path] = None
+            if len(self.pending) > MAX_PENDING:
+                del self.pending[next(iter(self.pending))]
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name='hpex object info', daemon=True)
+                self.thread.start()
+            self.cond.notify()
+
+    def lookup(self, path) -> ObjectInfo:
+        """The info for `path` right now: from the cache if it's
+        there, and otherwise worked out on this thread."""
+        path = os.path.expanduser(str(path))
+        st = os.stat(path)
+        info = self.cache.get(path, st)
+        if info is None:
+            info = read_object_info(path)
+            self.cache.put(path, st, info)
+        return info
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+        try:
+            self.cache.save()
+        except OSError as e:
+            print('could not save object info cache:', e)
+
+    def start_pool(self):
+        # Processes are spawned rather than forked: forking a process
+        # that has wx and a handful of threads going is asking for
+        # trouble. They only start when the first file isn't in the
+        # cache. If they can't start at all, we work on this thread.
+        import concurrent.futures
+        import multiprocessing
+        try:
+            return concurrent.futures.ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context('spawn'))
+        except (OSError, NotImplementedError, ImportError) as e:
+            print('no process pool for object info:', e)
+            return False
+
+    def run(self):
+        while True:
+            with self.cond:
+                # two jobs per process keeps them busy, and leaves the
+                # rest waiting here, where newer requests can still
+                # overtake them
+                while not self.closed and \
+                      (not self.pending or self.in_flight >= self.workers * 2):
+                    self.cond.wait()
+                if self.closed:
+                    return
+                path = self.pending.popitem()[0]
+
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            info = self.cache.get(path, st)
+            if info is not None:
+                self.callback(path, info)
+                continue
+
+            if self.pool is None:
+                self.pool = self.start_pool()
+            if self.pool:
+                try:
+                    future = self.pool.submit(read_object_info, path)
+                except RuntimeError as e:
+                    # shut down, or a worker died (BrokenProcessPool)
+                    print('object info pool failed:', e)
+                    self.pool = False
+                else:
+                    with self.cond:
+                        self.in_flight += 1
+                    future.add_done_callback(
+                        lambda f, path=path, st=st: self.done(path, st, f))
+                    continue
+            try:
+                self.finish(path, st, read_object_info(path))
+            except OSError as e:
+                print('cannot read', path, e)
+
+    def done(self, path, st, future):
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify()
+        if future.cancelled():
+            return
+        try:
+            info = future.result()
+        except OSError as e:
+            print('cannot read', path, e)
+            return
+        except Exception as e:
+            # A worker died (BrokenProcessPool), and the pool with
+            # it. What was in it is done on our thread from now on.
+            print('object info pool failed:', e)
+            self.pool = False
+            if not self.closed:
+                self.request(path)
+            return
+        self.finish(path, st, info)
+
+    def finish(self, path, st, info):
+        self.cache.put(path, st, info)
+        self.callback(path, info)
@@ -0,0 +1,219 @@
+import threading
+import queue
+import itertools
+import time
+
+# Every operation on the calculator used to get its own
+# threading.Thread. Clicking Refresh twice, or clicking a directory
+# while a listing was still coming in, started two operations on the
+# same serial port at once, which wastes time at best and garbles both
+# exchanges at worst.
+#
+# A PortCoordinator owns one worker thread per serial port, so there's
+# never more than one thread per port no matter how much gets queued.
+# Jobs run one at a time, highest priority first and in the order they
+# were asked for within a priority, so they never overlap on the
+# port. If an identical job (same key) is still waiting in the queue,
+# asking for it again doesn't queue a second copy: the caller gets the
+# existing job, and its result is handed to everybody who asked for it.
+# A job that has already started isn't shared, since whatever made the
+# caller ask again (a send, say) may have happened after it read the
+# calculator. Jobs that move around the calculator's directories are
+# submitted with collapse=False, because two Up clicks mean going up
+# twice.
+#
+# Since every job goes through here, this is also where we measure
+# how long jobs wait in the queue versus how long they take to run.
+# The totals are kept in PortCoordinator.stats rather than printed for
+# every job.
+
+# Lower numbers run first. Transfers and interactive jobs have to
+# share a priority: connecting, disconnecting and changing directory
+# change where a transfer goes, so a file dropped after a directory
+# click has to wait for the chdir, and nothing may jump ahead of a
+# disconnect. Within a priority, jobs run in the order they were
+# submitted. Only refreshes get outranked.
+PRIORITY_TRANSFER = 0 # the user is waiting on a file
+PRIORITY_INTERACTIVE = 0 # connect, change directory, remote commands
+PRIORITY_BACKGROUND = 1 # refreshes and anything speculative
+
+class PortJob:
+    def __init__(self, coordinator, key, target, args, owner, priority):
+        self.coordinator = coordinator
+        self.key = key
+        self.target = target
+        self.args = args
+        # whatever object the caller wants to keep track of for this
+        # job, normally the connector whose run() is the target. Callers
+        # whose request was collapsed into this job use it to cancel.
+        self.owner = owner
+        self.priority = priority
+        self.result = None
+        self.exception = None
+        # how many extra requests were folded into this one
+        self.collapsed = 0
+        self.started = False
+        self.cancelled = False
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self._callbacks = []
+        # so that a callback added while the job is finishing is
+        # either run by _finish() or sees it's done, and never missed
+        self._callbacks_lock = threading.Lock()
+        self._done = threading.Event()
+
+    def add_done_callback(self, callback):
+        """Call callback(job) when the job finishes or is cancelled,
+        from whichever thread that happens on. If it already has,
+        call it now."""
+        with self._callbacks_lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def cancel(self) -> bool:
+        """Cancel the job if it's still waiting in the queue. Returns
+        False if it has already started, in which case only its
+        connector can stop it."""
+        return self.coordinator._cancel(self)
+
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout=None) -> bool:
+        return self._done.wait(timeout)
+
+    def _finish(self):
+        with self._callbacks_lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                print(f'{self.coordinator.port}: callback for {self.key} raised', repr(e))
+
+
+class PortCoordinator:
+    _coordinators = {}
+    _coordinators_lock = threading.Lock()
+
+    @classmethod
+    def for_port(cls, port):
+        """Return the coordinator for `port`, creating it if needed."""
+        with cls._coordinators_lock:
+            if port not in cls._coordinators:
+                cls._coordinators[port] = cls(port)
+            return cls._coordinators[port]
+
+    def __init__(self, port):
+        self.port = port
+        # protects self.jobs (the queued jobs that can be shared, by
+        # key), self.waiting (every queued job) and the job state that
+        # cancel() looks at
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.waiting = set()
+        self.queue = queue.PriorityQueue()
+        # breaks ties between jobs of the same priority, so they run
+        # in the order they were submitted
+        self.counter = itertools.count()
+        # totals across every job run on this port; wait and service
+        # are in seconds
+        self.stats = {'jobs': 0, 'cancelled': 0, 'collapsed': 0,
+                      'wait': 0.0, 'service': 0.0}
+        self.worker = threading.Thread(
+            target=self._work, name=f'hpex port {port}', daemon=True)
+        self.worker.start()
+
+    def submit(self, key, target, args=(), owner=None,
+               priority=PRIORITY_INTERACTIVE, collapse=True) -> PortJob:
+        """Queue target(*args) to run on this port. If collapse is
+        true and a job with the same key is still queued, that job is
+        returned instead and nothing new is queued."""
+        with self.lock:
+            job = self.jobs.get(key) if collapse else None
+            if job is not None:
+                job.collapsed += 1
+                self.stats['collapsed'] += 1
+                return job
+
+            job = PortJob(self, key, target, args, owner, priority)
+            self.waiting.add(job)
+            if collapse:
+                self.jobs[key] = job
+
+        self.queue.put((priority, next(self.counter), job))
+        return job
+
+    def cancel_queued(self) -> int:
+        """Cancel everything that hasn't started yet, and return how
+        many jobs that was."""
+        with self.lock:
+            waiting = list(self.waiting)
+        return sum(job.cancel() for job in waiting)
+
+    def _cancel(self, job) -> bool:
+        with self.lock:
+            if job.started or job.cancelled:
+                return False
+            job.cancelled = True
+            self._dequeue(job)
+            self.stats['cancelled'] += 1
+
+        # The worker skips cancelled jobs when it gets to them, so we
+        # can tell the caller right away instead of waiting for that.
+        job.finished_at = time.monotonic()
+        job._finish()
+        return True
+
+    def summary(self) -> dict:
+        """A copy of self.stats, with the mean wait and service times
+        in milliseconds."""
+        with self.lock:
+            stats = dict(self.stats)
+        jobs = stats['jobs'] or 1
+        stats['mean_wait_ms'] = round(stats['wait'] / jobs * 1000, 2)
+        stats['mean_service_ms'] = round(stats['service'] / jobs * 1000, 2)
+        return stats
+
+    def _work(self):
+        while True:
+            _, _, job = self.queue.get()
+            with self.lock:
+                if job.cancelled:
+                    continue
+                job.started = True
+                # from here on, asking again queues a new job
+                self._dequeue(job)
+            job.started_at = time.monotonic()
+
+            try:
+                job.result = job.target(*job.args)
+            except SystemExit as e:
+                # the CLI's callbacks end a transfer with sys.exit()
+                job.exception = e
+            except BaseException as e:
+                # The connectors report their own failures, but one
+                # job blowing up mustn't take the port down with it.
+                print(f'{self.port}: {job.key} raised', repr(e))
+                job.exception = e
+            finally:
+                job.finished_at = time.monotonic()
+                with self.lock:
+                    self._record(job)
+
+            job._finish()
+
+    def _dequeue(self, job):
+        # with self.lock held
+        self.waiting.discard(job)
+        if self.jobs.get(job.key) is job:
+            del self.jobs[job.key]
+
+    def _record(self, job):
+        self.stats['jobs'] += 1
+        self.stats['wait'] += job.started_at - job.submitted_at
+        self.stats['service'] += job.finished_at - job.started_at
@@ -0,0 +1,246 @@
+import glob
+import os
+import platform
+import re
+import select
+import socket
+import threading
+import time
+
+_system = platform.system()
+
+# get_serial_ports() used to glob /dev/ttyUSB* every time it was
+# asked, which missed the 49g+ and 50g altogether: their USB port is
+# CDC-ACM, so they show up as /dev/ttyACM*. The GUI also only found
+# out about a cable being plugged in when the user pressed Refresh.
+#
+# A PortRegistry lists the USB serial ports from /sys/class/tty, with
+# what the USB device says about itself (vendor, product), so that a
+# calculator can be picked out from the other adapters. While anybody
+# is watching it (the GUI is), it keeps the list up to date on a
+# thread of its own, from the kernel's hotplug events on a netlink
+# socket, or, where there's no netlink, by looking at /sys/class/tty
+# again every couple of seconds. Without /sys (macOS), the /dev
+# entries are all we go on.
+
+SYS_TTY = '/sys/class/tty'
+DEV = '/dev'
+# USB serial adapters, and CDC-ACM devices like the 49g+ and 50g
+PREFIXES = ('ttyUSB', 'ttyACM')
+# Hewlett-Packard's USB vendor ID, which the 49g+ and 50g use
+HP_VENDOR_ID = '03f0'
+
+# from <linux/netlink.h>; group 1 is the kernel's own events
+NETLINK_KOBJECT_UEVENT = 15
+# seconds between looks at /sys/class/tty without netlink
+POLL_INTERVAL = 2
+# A new device's sysfs attributes can lag its add event a little, so
+# we wait this long before looking.
+SETTLE = 0.2
+
+
+class SerialPort:
+    """A USB serial port, with what sysfs says about its device."""
+    def __init__(self, device, vendor_id=None, product_id=None,
+                 manufacturer=None, product=None):
+        self.device = device
+        self.vendor_id = vendor_id
+        self.product_id = product_id
+        self.manufacturer = manufacturer
+        self.product = product
+
+    @property
+    def is_calculator(self) -> bool:
+        return self.vendor_id == HP_VENDOR_ID
+
+    @property
+    def number(self) -> int:
+        match = re.search(r'(\d+)$', self.device)
+        return int(match.group(1)) if match else -1
+
+    def description(self) -> str:
+        about = ' '.join(s for s in (self.manufacturer, self.product) if s)
+        if self.vendor_id:
+            about += f' [{self.vendor_id}:{self.product_id}]'
+        return f'{self.device} ({about.strip()})' if about else self.device
+
+    def __eq__(self, other):
+        if not isinstance(other, SerialPort):
+            return NotImplemented
+        return vars(self) == vars(other)
+
+    def __repr__(self):
+        return f'SerialPort({self.description()!r})'
+
+
+def read_attribute(directory, name):
+    try:
+        with open(os.path.join(directory, name)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def usb_device_dir(tty_dir):
+    """The sysfs directory of the USB device a tty belongs to, or
+    None. A ttyACM's device link is the USB interface, and a ttyUSB's
+    is a port under the interface; the device is above either."""
+    path = os.path.realpath(os.path.join(tty_dir, 'device'))
+    for _ in range(3):
+        if os.path.exists(os.path.join(path, 'idVendor')):
+            return path
+        path = os.path.dirname(path)
+    return None
+
+
+def scan(sys_tty=SYS_TTY, dev=DEV) -> list:
+    """The USB serial ports there are now, best first: calculators,
+    then the highest numbered (usually the last plugged in)."""
+    try:
+        with os.scandir(sys_tty) as it:
+            names = [e.name for e in it if e.name.startswith(PREFIXES)]
+    except OSError:
+        # no sysfs
+        ports = [SerialPort(path) for prefix in PREFIXES
+                 for path in glob.glob(os.path.join(dev, prefix + '*'))]
+    else:
+        ports = []
+        for name in names:
+            usb = usb_device_dir(os.path.join(sys_tty, name))
+            if usb is None:
+                ports.append(SerialPort(os.path.join(dev, name)))
+                continue
+            ports.append(SerialPort(
+                os.path.join(dev, name),
+                read_attribute(usb, 'idVendor'),
+                read_attribute(usb, 'idProduct'),
+                read_attribute(usb, 'manufacturer'),
+                read_attribute(usb, 'product')))
+    ports.sort(key=lambda p: (not p.is_calculator, -p.number, p.device))
+    return ports
+
+
+def is_port_event(data: bytes) -> bool:
+    """Whether a kernel uevent (ACTION@DEVPATH, then KEY=VALUE
+    fields, all NUL-separated) is about one of our ttys."""
+    fields = data.split(b'\0')
+    env = dict(f.split(b'=', 1) for f in fields[1:] if b'=' in f)
+    return env.get(b'SUBSYSTEM') == b'tty' and \
+        env.get(b'DEVNAME', b'').split(b'/')[-1].startswith(
+            tuple(p.encode() for p in PREFIXES))
+
+
+class PortRegistry:
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get(cls) -> 'PortRegistry':
+        """The registry everybody shares, created the first time."""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self, sys_tty=SYS_TTY, dev=DEV):
+        self.sys_tty = sys_tty
+        self.dev = dev
+        self.lock = threading.Lock()
+        # the list as of the last scan; only trusted while the thread
+        # is there to keep it current
+        self.ports = None
+        self.listeners = []
+        self.thread = None
+        self.stop_event = None
+
+    @property
+    def live(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def list(self) -> list:
+        """The USB serial ports, best first (see scan())."""
+        with self.lock:
+            if self.ports is not None and self.live:
+                return list(self.ports)
+        ports = scan(self.sys_tty, self.dev)
+        with self.lock:
+            self.ports = ports
+        return list(ports)
+
+    def watch(self, callback):
+        """Call `callback(ports)` from the registry's thread whenever
+        the ports change."""
+        with self.lock:
+            self.listeners.append(callback)
+            if self.live or _system == 'Windows':
+                return
+            self.stop_event = threading.Event()
+            # The socket is opened before the scan, so a cable plugged
+            # in between the two isn't missed.
+            sock = self.open_netlink()
+            self.ports = scan(self.sys_tty, self.dev)
+            if sock is not None:
+                target, args = self.read_netlink, (sock, self.stop_event)
+            else:
+                target, args = self.poll, (self.stop_event,)
+            self.thread = threading.Thread(
+                target=target, args=args, name='hpex ports', daemon=True)
+            self.thread.start()
+
+    def unwatch(self, callback):
+        with self.lock:
+            if callback in self.listeners:
+                self.listeners.remove(callback)
+            if not self.listeners and self.stop_event is not None:
+                # the thread notices within half a second
+                self.stop_event.set()
+                self.thread = None
+
+    @staticmethod
+    def open_netlink():
+        if _system != 'Linux':
+            return None
+        try:
+            sock = socket.socket(
+                socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            sock.bind((0, 1))
+        except (OSError, AttributeError) as e:
+            print('no hotplug events, polling for ports instead:', e)
+            return None
+        return sock
+
+    def rescan(self):
+        ports = scan(self.sys_tty, self.dev)
+        with self.lock:
+            changed = ports != self.ports
+            self.ports = ports
+            listeners = list(self.listeners)
+        if changed:
+            print('serial ports now', [p.description() for p in ports])
+            for callback in listeners:
+                callback(list(ports))
+
+    def read_netlink(self, sock, stop):
+        with sock:
+            while not stop.is_set():
+                if not select.select([sock], [], [], 0.5)[0]:
+                    continue
+                relevant = False
+                # a cable coming and going is a burst of events, for
+                # the USB device and its interfaces as well as the tty
+                while select.select([sock], [], [], 0)[0]:
+                    try:
+                        relevant |= is_port_event(sock.recv(65536))
+                    except OSError as e:
+                        # ENOBUFS: we missed some, so look anyway
+                        print('hotplug socket:', e)
+                        relevant = True
+                        break
+                if relevant:
+                    time.sleep(SETTLE)
+                    if not stop.is_set():
+                        self.rescan()
+
+    def poll(self, stop):
+        while not stop.wait(POLL_INTERVAL):
+            self.rescan()
@@ -0,0 +1,309 @@
+import asyncio
+import os
+import platform
+import re
+import time
+from pathlib import Path
+
+_system = platform.system()
+
+from hpex.async_connectors import AsyncXModemServer, XModemServerException
+from hpex.async_io import AsyncSerialTransport
+from hpex.helpers import KermitProcessTools
+from hpex.hp48_codec import escape
+from hpex.hp_xmodem import read_payload
+from hpex.listing_cache import RemoteListingCache, path_key, path_to_str
+
+if _system != 'Windows':
+    import ptyprocess
+    from hpex.kermit_pubsub import kermit_invocation, KERMIT_CANCEL_GRACE
+
+# Long-lived connections to a calculator, for things that run many
+# commands in a row (`hpex daemon` and `hpex shell`). The connectors
+# connect, do one thing, and let go; a session connects once and
+# keeps the port, the calculator's path and a listing cache until
+# it's closed.
+#
+# XModemSession runs the XModem server protocol from
+# async_connectors.py, so its methods are coroutines. KermitSession
+# keeps one interactive Kermit at its prompt and feeds it commands, so
+# its methods are plain functions. Otherwise they work the same:
+#
+#     ensure_open()            connect, if we aren't already
+#     listing(refresh)         (memfree, HPVariables) for hp_path
+#     cd(name)                 '..' and 'HOME' work too
+#     get(name, dest, overwrite)
+#     put(path)
+#     remove(name)
+#     run_command(command)     run RPL on the calculator
+#     close(finish)            disconnect, and end the server if finish
+#
+# Both raise SessionError for requests that can't work, and drop
+# themselves if the calculator stops answering, so the next call
+# connects again.
+
+class SessionError(Exception):
+    """Raised for a request the session can't carry out, like changing
+    into something that isn't a directory."""
+    pass
+
+
+def free_name(dest: Path) -> Path:
+    """Return `dest`, or the first of 'dest.~1~', 'dest.~2~' and so
+    on that doesn't exist, like XModemConnector does for gets."""
+    original = dest
+    counter = 1
+    while dest.exists():
+        dest = Path(original.parent, f'{original.name}.~{counter}~')
+        counter += 1
+    return dest
+
+
+class XModemSession:
+    """One open XModem server connection."""
+    def __init__(self, port, settings):
+        self.port = port
+        self.settings = settings
+        self.transport = None
+        self.server = None
+        self.hp_path = ['HOME']
+        self.listing_cache = RemoteListingCache(
+            int(settings['listing_cache_ttl']))
+        self.lock = asyncio.Lock()
+        self.opened = 0
+        self.requests = 0
+
+    @property
+    def reset_directory(self) -> bool:
+        return self.settings['reset_directory_on_disconnect']
+
+    @property
+    def is_open(self) -> bool:
+        return self.server is not None
+
+    async def ensure_open(self):
+        if self.server is not None:
+            return
+        self.transport = await AsyncSerialTransport.open(self.port, self.settings)
+        self.server = AsyncXModemServer(self.transport)
+        try:
+            memory, objects = await self.server.connect(self.reset_directory)
+        except BaseException:
+            self.drop()
+            raise
+        self.hp_path = ['HOME']
+        self.listing_cache.invalidate()
+        self.listing_cache.put(self.hp_path, memory, objects)
+        self.opened = time.time()
+
+    def drop(self):
+        """Close the port without talking to the calculator, after it
+        stopped answering."""
+        if self.transport is not None:
+            self.transport.close()
+        self.transport = None
+        self.server = None
+
+    async def close(self, finish=False):
+        if self.server is None:
+            return
+        try:
+            await self.server.disconnect(finish)
+        except (XModemServerException, asyncio.TimeoutError, OSError) as e:
+            print(f'{self.port}: disconnect failed:', repr(e))
+        self.drop()
+
+    async def listing(self, refresh=False):
+        cached = None if refresh else self.listing_cache.get(self.hp_path)
+        if cached is not None:
+            return cached
+        memory, objects = await self.server.memory_and_listing()
+        self.listing_cache.put(self.hp_path, memory, objects)
+        return memory, objects
+
+    async def cd(self, name):
+        if name == 'HOME':
+            await self.server.run_program('HOME')
+            self.hp_path = ['HOME']
+        elif name == '..':
+            if len(self.hp_path) > 1:
+                await self.server.run_program('UPDIR')
+                self.hp_path = self.hp_path[:-1]
+        else:
+            # evaluating a directory's name is what enters it, so make
+            # sure it is one first
+            _, objects = await self.listing()
+            if not any(o.name == name and o.vtype == 'Directory' for o in objects):
+                raise SessionError(f"no directory '{name}' in {path_to_str(self.hp_path)}")
+            await self.server.run_program(name)
+            self.hp_path = self.hp_path + [name]
+
+    async def get(self, name, dest, overwrite=False) -> Path:
+        dest = Path(dest).expanduser()
+        if dest.is_dir():
+            dest = dest / name
+        if not overwrite:
+            dest = free_name(dest)
+        with dest.open('wb') as stream:
+            await self.server.get_file(name, stream)
+        return dest
+
+    async def put(self, path) -> int:
+        path = Path(path).expanduser()
+        if not path.is_file():
+            raise SessionError(f'no such file: {path}')
+        data = read_payload(path, self.settings['pretranslate_ascii'])
+        ok = await self.server.send_data(path.name, data)
+        self.listing_cache.invalidate(self.hp_path)
+        if not ok:
+            raise XModemServerException(f"calculator didn't take {path.name}")
+        return len(data)
+
+    async def remove(self, name):
+        await self.server.run_program(f"'{name}'", 'PURGE')
+        self.listing_cache.invalidate(self.hp_path)
+
+    async def run_command(self, command) -> str:
+        # the XModem server doesn't send anything back from 'E'
+        await self.server.run_program(command)
+        # it could have done anything, so don't trust the cache
+        self.listing_cache.invalidate()
+        return ''
+
+
+class KermitSession:
+    """An interactive Kermit, left at its prompt, talking to the
+    calculator's Kermit server."""
+    # something that can't turn up in Kermit's output by accident
+    PROMPT = 'HPEX-KERMIT>'
+
+    def __init__(self, port, settings):
+        self.port = port
+        self.settings = settings
+        self.proc = None
+        self.hp_path = ['HOME']
+        self.listing_cache = RemoteListingCache(
+            int(settings['listing_cache_ttl']))
+
+    @property
+    def is_open(self) -> bool:
+        return self.proc is not None and self.proc.isalive()
+
+    def ensure_open(self):
+        if self.is_open:
+            return
+        invocation = kermit_invocation(
+            self.settings, f'set prompt {self.PROMPT}', self.port,
+            interactive=True)
+        self.proc = ptyprocess.PtyProcessUnicode.spawn(
+            invocation, cwd=os.getcwd())
+        self.read_to_prompt()
+        self.listing_cache.invalidate()
+        self.listing(refresh=True)
+
+    def read_to_prompt(self) -> str:
+        out = ''
+        while not out.endswith(self.PROMPT):
+            try:
+                out += self.proc.read(1024)
+            except EOFError:
+                self.proc = None
+                raise SessionError(f'Kermit exited: {out.strip()}')
+        return out[:-len(self.PROMPT)]
+
+    def command(self, command) -> str:
+        """Run `command` at Kermit's prompt and return what it
+        printed. Raises SessionError if it failed."""
+        self.proc.write(command + '\r')
+        try:
+            out = self.read_to_prompt()
+        except KeyboardInterrupt:
+            # ^C at the transfer display stops the transfer, and
+            # sends the calculator an error packet
+            self.proc.write('\x03')
+            self.read_to_prompt()
+            raise
+        # the pty echoes the command back first
+        out = out.replace('\r', '').split('\n', 1)[-1]
+
+        self.proc.write('echo HPEX-STATUS:\\v(status)\r')
+        status = re.search(r'HPEX-STATUS:(\d+)', self.read_to_prompt())
+        if status is None or status.group(1) != '0':
+            raise SessionError(f"'{command}' failed: {out.strip()}")
+        return out.replace(chr(7), '')
+
+    def drop(self):
+        if self.proc is not None and self.proc.isalive():
+            self.proc.kill(9)
+        self.proc = None
+
+    def close(self, finish=False):
+        if not self.is_open:
+            return
+        if finish:
+            try:
+                self.command('finish')
+            except SessionError as e:
+                print(e)
+        self.proc.write('exit\r')
+        deadline = time.monotonic() + KERMIT_CANCEL_GRACE
+        while self.proc.isalive() and time.monotonic() < deadline:
+            time.sleep(.01)
+        self.drop()
+
+    def listing(self, refresh=False):
+        cached = None if refresh else self.listing_cache.get(self.hp_path)
+        if cached is not None:
+            return cached
+        header, memfree, objects = KermitProcessTools.parse_remote_directory(
+            self.command('remote directory'))
+        # Kermit tells us where we are, so trust that over hp_path
+        self.hp_path = list(path_key(header))
+        self.listing_cache.put(self.hp_path, memfree, objects)
+        return memfree, objects
+
+    def cd(self, name):
+        if name == 'HOME':
+            self.command('remote host HOME')
+        elif name == '..':
+            self.command('remote host UPDIR')
+        else:
+            _, objects = self.listing()
+            if not any(o.name == name and o.vtype == 'Directory' for o in objects):
+                raise SessionError(f"no directory '{name}' in {path_to_str(self.hp_path)}")
+            self.command(f'remote host {escape(name)} EVAL')
+        # read the real path back from the header
+        self.listing(refresh=True)
+
+    def get(self, name, dest, overwrite=False) -> Path:
+        dest = Path(dest).expanduser()
+        if dest.is_dir():
+            dest = dest / name
+        if not overwrite:
+            dest = free_name(dest)
+        self.command(f'set file collision {"overwrite" if overwrite else "backup"}')
+        # braces keep Kermit from splitting paths with spaces
+        self.command(f'get /as-name:{{{dest}}} {escape(name)}')
+        return dest
+
+    def put(self, path) -> int:
+        path = Path(path).expanduser()
+        if not path.is_file():
+            raise SessionError(f'no such file: {path}')
+        try:
+            self.command(f'send {{{path}}}')
+        finally:
+            self.listing_cache.invalidate(self.hp_path)
+        return path.stat().st_size
+
+    def remove(self, name):
+        try:
+            self.command(f"remote host '{escape(name)}' PURGE")
+        finally:
+            self.listing_cache.invalidate(self.hp_path)
+
+    def run_command(self, command) -> str:
+        try:
+            return self.command(f'remote host {command}')
+        finally:
+            self.listing_cache.invalidate()
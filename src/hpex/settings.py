@@ -1,8 +1,12 @@
 import pickle
 from pathlib import Path
 import os
+import tempfile
+import threading
+import time
+from types import MappingProxyType
 
-current_hpex_version = 1
+current_hpex_version = 4
 
 # Although it is less OO, we use a dict to store settings instead of a
 # dataclass. This has two advantages:
@@ -12,57 +16,118 @@ current_hpex_version = 1
 #   dataclass module would also let this happen, it doesn't
 #   have any versioning)
 
+# Settings are read all over the place, including from the connectors
+# in the middle of a transfer, so they're kept in memory once loaded.
+# load_settings() only looks at the file again (a stat(), not a read)
+# if it hasn't checked in the last SETTINGS_RECHECK_INTERVAL seconds,
+# and only reads it if its inode, mtime or size changed, which is how
+# we notice another HPex saving new settings.
+#
+# What load_settings() returns is a read-only view of a dict that is
+# never changed afterwards, so a connector holding on to it sees the
+# same settings for the whole transfer. To change something, copy it
+# with dict() and hand the copy to save_settings(), which writes a
+# temporary file and renames it over ~/.hpexrc. That way nobody ever
+# reads a half-written file, and every save gets a new inode.
+SETTINGS_RECHECK_INTERVAL = 1
+
 class HPexSettingsTools:
+    _lock = threading.Lock()
+    # the snapshot, the (inode, mtime, size) it was read at, and when
+    # we last checked that
+    _snapshot = None
+    _file_key = None
+    _checked_at = 0
+
     @staticmethod
-    def load_settings():
+    def settings_path() -> Path:
         # needed to help Python find the file
-        p = Path('~/.hpexrc').expanduser()
-        if not p.is_file():
-            print('making new .hpexrc')
-            # make new file with the defaults
-            d = HPexSettingsTools.create_settings_dict()
-            f = p.open('wb')
-            pickle.dump(d, f)
-            f.close()
+        return Path('~/.hpexrc').expanduser()
+
+    @classmethod
+    def load_settings(cls) -> MappingProxyType:
+        now = time.monotonic()
+        snapshot = cls._snapshot
+        if snapshot is not None and now - cls._checked_at < SETTINGS_RECHECK_INTERVAL:
+            return snapshot
+
+        with cls._lock:
+            p = cls.settings_path()
+            try:
+                st = p.stat()
+                key = (st.st_ino, st.st_mtime_ns, st.st_size)
+            except FileNotFoundError:
+                key = None
+            cls._checked_at = now
+            if cls._snapshot is not None and key == cls._file_key:
+                return cls._snapshot
+
+            if key is None:
+                print('making new .hpexrc')
+                # make new file with the defaults
+                d = cls.create_settings_dict()
+                cls._save_locked(d)
+                return cls._snapshot
 
-            return d
+            #print('is_file')
+            with p.open('rb') as f:
+                d = pickle.load(f)
+            # if the current version number is greater than the version number in the file, 
+            if d['version'] < current_hpex_version:
+                # now we need to upgrade. this iterates over every entry
+                # in the new dictionary and checks if a value for it
+                # exists in the old dict. if so, it writes it to the new
+                # dict, and otherwise, it keeps that key at the default value.
+                print('updating version, old is', d['version'], 'new is', current_hpex_version)
+                d_keys = d.keys()
+                new_d = cls.create_settings_dict()
+                for key in new_d:
+                    print('key', key, 'found ', end='')
+                    if key in d_keys:
+                        print('true')
+                        new_d[key] = d[key]
+                    else:
+                        print('false')
 
-        #print('is_file')
-        f = p.open('rb')
-        # if the current version number is greater than the version number in the file, 
-        d = pickle.load(f)
-        if d['version'] < current_hpex_version:
-            # now we need to upgrade. this iterates over every entry
-            # in the new dictionary and checks if a value for it
-            # exists in the old dict. if so, it writes it to the new
-            # dict, and otherwise, it keeps that key at the default value.
-            print('updating version, old is', d['version'], 'new is', current_hpex_version)
-            d_keys = d.keys()
-            new_d = HPexSettingsTools.create_settings_dict()
-            for key in new_d:
-                print('key', key, 'found ', end='')
-                if key in d_keys:
-                    print('true')
-                    new_d[key] = d[key]
-                else:
-                    print('false')
+                # set version key to current version, it will have been
+                # overwritten by the loop above
+                new_d['version'] = current_hpex_version
+                # now we need to save that to the file, and the new
+                # improved dict is what everybody gets
+                cls._save_locked(new_d)
+                return cls._snapshot
 
-            # set version key to current version, it will have been
-            # overwritten by the loop above
-            new_d['version'] = current_hpex_version
-            # now we need to save that to the file
-            f.close()
-            
-            f = p.open('wb')
-            pickle.dump(new_d, f)
-            f.close()
+            cls._snapshot = MappingProxyType(d)
+            cls._file_key = key
+            return cls._snapshot
 
-            # and return the new improved dict
-            return new_d
+    @classmethod
+    def save_settings(cls, settings):
+        """Write `settings` (any mapping) to ~/.hpexrc, atomically,
+        and make it what load_settings() returns from now on."""
+        with cls._lock:
+            cls._save_locked(dict(settings))
 
-        # finally, otherwise just return the dict we read before
-        f.close()
-        return d
+    @classmethod
+    def _save_locked(cls, d: dict):
+        p = cls.settings_path()
+        # the temporary file has to be in the same directory, or the
+        # rename wouldn't be atomic
+        fd, tmp = tempfile.mkstemp(dir=p.parent, prefix='.hpexrc.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(d, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, p)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        st = p.stat()
+        # our own copy, so the caller can't change it under us
+        cls._snapshot = MappingProxyType(dict(d))
+        cls._file_key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        cls._checked_at = time.monotonic()
     
     """Create a new settings dictionary with default values and return it."""
     @staticmethod
@@ -78,6 +143,16 @@ class HPexSettingsTools:
             'disable_pty_search': False,
             'reset_directory_on_disconnect': True,
             'ask_for_overwrite': True,
-            'start_in_xmodem': False
+            'start_in_xmodem': False,
+            # seconds before a cached remote listing is fetched
+            # again; '0' keeps it until HPex changes something
+            'listing_cache_ttl': '0',
+            # tune USB serial adapters for latency when opening them,
+            # see tty_tuning.py
+            'low_latency': False,
+            # send T(2) and T(3) ASCII objects with their escapes
+            # already translated, see hp48_codec.pretranslate(). Off
+            # unless asked for: it rewrites the file on the way.
+            'pretranslate_ascii': False
         }
 
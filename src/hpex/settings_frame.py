@@ -17,7 +17,9 @@ class SettingsFrame(wx.Frame):
         self.parent = parent
 
     def go(self):
-        self.current_settings = HPexSettingsTools.load_settings()
+        # a copy we can change, since what load_settings() gives out
+        # is read-only
+        self.current_settings = dict(HPexSettingsTools.load_settings())
         
         self.main_sizer = wx.GridBagSizer()
 
@@ -76,6 +78,14 @@ class SettingsFrame(wx.Frame):
                 self.file_mode_choices.index(
                     self.current_settings['file_mode']))
 
+        self.listing_cache_ttl_choices = ['0', '10', '30', '60', '300']
+        self.listing_cache_ttl_choice = wx.Choice(
+            self, wx.ID_ANY, choices=self.listing_cache_ttl_choices)
+
+        self.listing_cache_ttl_choice.SetSelection(
+            self.listing_cache_ttl_choices.index(
+                self.current_settings['listing_cache_ttl']))
+
         self.parity_choices = [
             '0 (None)', '1 (Odd)', '2 (Even)', '3 (Mark)', '4 (Space)']
         
@@ -104,11 +114,18 @@ class SettingsFrame(wx.Frame):
 
             self.pty_search_check = wx.CheckBox(
                 self, wx.ID_ANY,
-                'Disable pty search, look only for ttyUSB ports')
+                'Disable pty search, look only for USB serial ports')
 
             self.pty_search_check.SetValue(
                 self.current_settings['disable_pty_search'])
 
+            self.low_latency_check = wx.CheckBox(
+                self, wx.ID_ANY,
+                'Low-latency mode for USB serial adapters')
+
+            self.low_latency_check.SetValue(
+                self.current_settings['low_latency'])
+
         
         self.ask_for_overwrite_check = wx.CheckBox(
             self, wx.ID_ANY,
@@ -117,6 +134,13 @@ class SettingsFrame(wx.Frame):
         self.ask_for_overwrite_check.SetValue(
             self.current_settings['ask_for_overwrite'])
 
+        self.pretranslate_check = wx.CheckBox(
+            self, wx.ID_ANY,
+            'Translate ASCII objects before sending with XModem')
+
+        self.pretranslate_check.SetValue(
+            self.current_settings['pretranslate_ascii'])
+
         if _system != 'Windows':
             # Nothing but XModem on Windows
             self.start_in_xmodem_check = wx.CheckBox(
@@ -145,6 +169,13 @@ class SettingsFrame(wx.Frame):
         
         self.main_sizer.Add(self.parity_choice, pos=(row, 1))
         row += 1
+        self.main_sizer.Add(
+            wx.StaticText(
+                self, wx.ID_ANY, ' Remote listing cache (s, 0 = no expiry):'),
+            pos=(row, 0), flag=wx.ALIGN_CENTER_VERTICAL | wx.ALL)
+
+        self.main_sizer.Add(self.listing_cache_ttl_choice, pos=(row, 1))
+        row += 1
 
         if _system != 'Windows':
             self.main_sizer.Add(
@@ -167,6 +198,10 @@ class SettingsFrame(wx.Frame):
                 self.pty_search_check, pos=(row, 0), span=(1, 2))
             row += 1
 
+            self.main_sizer.Add(
+                self.low_latency_check, pos=(row, 0), span=(1, 2))
+            row += 1
+
         if _system != 'Windows':
             
             self.main_sizer.Add(
@@ -177,6 +212,10 @@ class SettingsFrame(wx.Frame):
             self.ask_for_overwrite_check, pos=(row, 0), span=(1, 2))
         row += 1
 
+        self.main_sizer.Add(
+            self.pretranslate_check, pos=(row, 0), span=(1, 2))
+        row += 1
+
         if _system != 'Windows':
             self.main_sizer.Add(
                 self.start_in_xmodem_check, pos=(row, 0), span=(1, 2))
@@ -199,6 +238,7 @@ class SettingsFrame(wx.Frame):
             self.current_settings['kermit_cksum'] = self.kermit_cksum_choices[self.kermit_cksum_choice.GetSelection()]
             self.current_settings['reset_directory_on_disconnect'] = self.reset_on_disconnect_check.GetValue()
             self.current_settings['disable_pty_search'] = self.pty_search_check.GetValue()
+            self.current_settings['low_latency'] = self.low_latency_check.GetValue()
             
         # Nothing we can really do about these lines...
         self.current_settings['startup_dir'] = self.startup_dir_chooser.GetPath()
@@ -206,17 +246,14 @@ class SettingsFrame(wx.Frame):
 
 
         self.current_settings['parity'] = self.parity_choices[self.parity_choice.GetSelection()]
+        self.current_settings['listing_cache_ttl'] = self.listing_cache_ttl_choices[self.listing_cache_ttl_choice.GetSelection()]
 
         self.current_settings['ask_for_overwrite'] = self.ask_for_overwrite_check.GetValue()
+        self.current_settings['pretranslate_ascii'] = self.pretranslate_check.GetValue()
 
 
         #print(self.current_settings)
-        # I could just use the builtin open() here, but I want to keep
-        # my file access consistent across the settings frame. Because
-        # load_settings uses Path, this does too.
-        pickle.dump(
-            self.current_settings,
-            Path('~/.hpexrc').expanduser().open('wb'))
+        HPexSettingsTools.save_settings(self.current_settings)
         self.Close()
         
     def cancel(self, event):
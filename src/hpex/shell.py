@@ -0,0 +1,319 @@
+import asyncio
+import cmd
+import fnmatch
+import glob
+import inspect
+import os
+import platform
+import shlex
+import sys
+import threading
+
+_system = platform.system()
+
+from hpex.async_connectors import XModemServerException
+from hpex.async_io import run_in_background
+from hpex.listing_cache import path_to_str
+from hpex.sessions import XModemSession, SessionError
+from hpex.settings import HPexSettingsTools
+
+if _system != 'Windows':
+    from hpex.sessions import KermitSession
+
+# `hpex shell PORT`: an FTP-style prompt on one calculator. The whole
+# shell is one session (sessions.py), so the connect and the HOME/path
+# dance happen once, at the start, instead of once per file.
+#
+# Tab completion of calculator names only ever looks at the session's
+# listing cache, so it never touches the serial line. After a put, rm
+# or !command the cache for the directory is gone, and completion
+# offers nothing until the next ls.
+#
+# XModemSession's methods are coroutines; they run on the shared
+# background loop from async_io.py, so ^C can cancel them (which sends
+# the CANs) like anything else there.
+
+class HPexShell(cmd.Cmd):
+    intro = "Type 'help' for commands. Names complete from the last listing."
+
+    def __init__(self, args):
+        super().__init__()
+        self.settings = HPexSettingsTools.load_settings()
+        if args.baud:
+            # the loaded settings are read-only
+            self.settings = dict(self.settings, baud_rate=args.baud)
+
+        if args.kermit:
+            use_xmodem = False
+        elif args.xmodem:
+            use_xmodem = True
+        else:
+            use_xmodem = self.settings['start_in_xmodem']
+        if _system == 'Windows':
+            # Nothing but XModem on Windows
+            use_xmodem = True
+
+        if use_xmodem:
+            self.session = XModemSession(args.port, self.settings)
+            self.mode = 'XModem'
+        else:
+            self.session = KermitSession(args.port, self.settings)
+            self.mode = 'Kermit'
+
+        print(f'Connecting to the {self.mode} server on {args.port}...')
+        if not self.call('ensure_open'):
+            sys.exit(1)
+        self.show_listing()
+        self.cmdloop()
+
+    def call(self, method, *args, quiet=False):
+        """Run a session method, waiting for it if it's a coroutine.
+        Errors are printed, and return None."""
+        try:
+            result = getattr(self.session, method)(*args)
+            if inspect.iscoroutine(result):
+                result = self.wait_for(result)
+            return True if result is None else result
+        except KeyboardInterrupt:
+            print('\nCancelled. You may have to press [CANCEL] or [ATTN] on the calculator.')
+        except SessionError as e:
+            print(f'Error: {e}')
+        except (XModemServerException, asyncio.TimeoutError, OSError,
+                asyncio.CancelledError) as e:
+            print(f'Error: {e!r}')
+            self.session.drop()
+            if not quiet:
+                print('Lost the connection; the next command will connect again.')
+        return None
+
+    @staticmethod
+    def wait_for(coro):
+        # A cancelled concurrent future returns straight away, while
+        # the coroutine is still sending its CANs, so we wait for it
+        # to really be done before the next command can use the port.
+        finished = threading.Event()
+
+        async def run():
+            try:
+                return await coro
+            finally:
+                finished.set()
+
+        future = run_in_background(run())
+        try:
+            return future.result()
+        except KeyboardInterrupt:
+            future.cancel()
+            finished.wait(5)
+            raise
+
+    def cmdloop(self, intro=None):
+        # ^C at the prompt just gives a new prompt
+        while True:
+            try:
+                return super().cmdloop(intro)
+            except KeyboardInterrupt:
+                print('^C')
+                intro = ''
+
+    @property
+    def prompt(self):
+        return f'hpex {path_to_str(self.session.hp_path)}> '
+
+    def cached_objects(self):
+        cached = self.session.listing_cache.get(self.session.hp_path)
+        return [] if cached is None else cached[1]
+
+    def complete_names(self, text, directories_only=False):
+        return [o.name for o in self.cached_objects()
+                if o.name.startswith(text)
+                and (o.vtype == 'Directory' or not directories_only)]
+
+    @staticmethod
+    def complete_local(text):
+        return [p + os.sep if os.path.isdir(p) else p
+                for p in glob.glob(os.path.expanduser(text) + '*')]
+
+    def show_listing(self, refresh=False):
+        listing = self.call('listing', refresh)
+        if listing is None:
+            return
+        memfree, objects = listing
+        print(f'{path_to_str(self.session.hp_path)}  {memfree} bytes free')
+        for o in objects:
+            print(f'{o.name:<16} {o.size:>10}  {o.vtype:<20} {o.crc}')
+
+    @staticmethod
+    def split(arg):
+        try:
+            return shlex.split(arg)
+        except ValueError as e:
+            print(f'Error: {e}')
+            return []
+
+    def ensure_open(self) -> bool:
+        # reconnect after a lost connection
+        if self.session.is_open:
+            return True
+        return self.call('ensure_open') is not None
+
+    def precmd(self, line):
+        return line.strip()
+
+    def emptyline(self):
+        pass
+
+    def default(self, line):
+        if line.startswith('!'):
+            self.do_remote(line[1:])
+        else:
+            print(f"Unknown command '{line.split()[0]}'. Type 'help' for commands.")
+
+    def do_ls(self, arg):
+        """ls [-r]: list the current directory. -r reads it from the
+        calculator again instead of the cache."""
+        if self.ensure_open():
+            self.show_listing(refresh=arg.strip() == '-r')
+
+    def do_cd(self, arg):
+        """cd DIR: change directory on the calculator. 'cd ..' goes up
+        and 'cd' alone goes HOME."""
+        if self.ensure_open():
+            self.call('cd', arg.strip() or 'HOME')
+
+    def complete_cd(self, text, line, begidx, endidx):
+        return self.complete_names(text, directories_only=True)
+
+    def do_get(self, arg):
+        """get [-o] NAME...: copy objects into the local directory.
+        -o overwrites local files instead of renaming."""
+        names = self.split(arg)
+        overwrite = '-o' in names
+        names = [n for n in names if n != '-o']
+        if not names:
+            print('Usage: get [-o] NAME...')
+            return
+        if not self.ensure_open():
+            return
+        for name in names:
+            dest = self.call('get', name, os.getcwd(), overwrite)
+            if dest is None:
+                return
+            print(f'{name} -> {dest}')
+
+    def complete_get(self, text, line, begidx, endidx):
+        return self.complete_names(text)
+
+    def do_mget(self, arg):
+        """mget [-o] PATTERN...: get every object matching the
+        wildcards, like mget A* PRG?"""
+        patterns = self.split(arg)
+        overwrite = '-o' in patterns
+        patterns = [p for p in patterns if p != '-o']
+        if not self.ensure_open():
+            return
+        listing = self.call('listing')
+        if listing is None:
+            return
+        names = [o.name for o in listing[1] if o.vtype != 'Directory'
+                 and any(fnmatch.fnmatchcase(o.name, p) for p in patterns)]
+        if not names:
+            print('Nothing matches.')
+            return
+        self.do_get(' '.join(shlex.quote(n) for n in names) + (' -o' if overwrite else ''))
+
+    complete_mget = complete_get
+
+    def do_put(self, arg):
+        """put FILE...: send local files to the current directory."""
+        files = self.split(arg)
+        if not files:
+            print('Usage: put FILE...')
+            return
+        if not self.ensure_open():
+            return
+        for f in files:
+            size = self.call('put', f)
+            if size is None:
+                return
+            print(f'{f} ({size} bytes)')
+
+    def complete_put(self, text, line, begidx, endidx):
+        return self.complete_local(text)
+
+    def do_mput(self, arg):
+        """mput PATTERN...: put every local file matching the
+        wildcards."""
+        files = sorted(f for p in self.split(arg)
+                       for f in glob.glob(os.path.expanduser(p))
+                       if os.path.isfile(f))
+        if not files:
+            print('Nothing matches.')
+            return
+        self.do_put(' '.join(shlex.quote(f) for f in files))
+
+    complete_mput = complete_put
+
+    def do_rm(self, arg):
+        """rm NAME...: purge objects on the calculator."""
+        if not self.ensure_open():
+            return
+        for name in self.split(arg):
+            if self.call('remove', name) is None:
+                return
+
+    complete_rm = complete_get
+
+    def do_mem(self, arg):
+        """mem: show free memory."""
+        if not self.ensure_open():
+            return
+        listing = self.call('listing', True)
+        if listing is not None:
+            print(f'{listing[0]} bytes free')
+
+    def do_remote(self, arg):
+        """remote COMMAND, or !COMMAND: run COMMAND on the calculator.
+        The XModem server doesn't send anything back."""
+        if not arg.strip():
+            print('Usage: !COMMAND')
+            return
+        if not self.ensure_open():
+            return
+        out = self.call('run_command', arg.strip())
+        if isinstance(out, str) and out.strip():
+            print(out.strip())
+
+    def do_lcd(self, arg):
+        """lcd DIR: change the local directory."""
+        try:
+            os.chdir(os.path.expanduser(arg.strip() or '~'))
+        except OSError as e:
+            print(f'Error: {e}')
+            return
+        if isinstance(self.session, XModemSession) or not self.session.is_open:
+            print(os.getcwd())
+            return
+        # Kermit has a working directory of its own
+        self.call('command', f'cd {{{os.getcwd()}}}')
+        print(os.getcwd())
+
+    def complete_lcd(self, text, line, begidx, endidx):
+        return [p for p in self.complete_local(text) if p.endswith(os.sep)]
+
+    def do_lls(self, arg):
+        """lls: list the local directory."""
+        for name in sorted(os.listdir('.')):
+            print(name + (os.sep if os.path.isdir(name) else ''))
+
+    def do_quit(self, arg):
+        """quit [-f]: disconnect. -f ends the server on the calculator
+        too."""
+        self.call('close', arg.strip() == '-f', quiet=True)
+        return True
+
+    do_exit = do_quit
+
+    def do_EOF(self, arg):
+        print()
+        return self.do_quit('')
@@ -0,0 +1,419 @@
+import platform
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+_system = platform.system()
+
+import wx
+from pubsub import pub
+
+from hpex.helpers import KermitProcessTools, StringTools, XModemProcessTools
+from hpex.port_coordinator import PortCoordinator, PRIORITY_TRANSFER
+from hpex.settings import HPexSettingsTools
+# The panel is built with the main window, so the connectors and
+# hp_xmodem (which bring in pyserial and friends) are imported when
+# the first transfer needs them, like in hpex_gui.py.
+
+# The transfer queue replaces a FileSendDialog or FileGetDialog per
+# file. Sends and gets are added to the panel at the bottom of the
+# main window and run one after another, each as soon as the one
+# before it finishes.
+#
+# While a file transfers, the next send in the queue is prepared on a
+# worker thread: it's stat()ed, checksummed, read and split into
+# XModem packets (hp_xmodem.PreparedFile), and checked against the
+# calculator's free memory. All of that used to happen between
+# transfers, with the port sitting idle.
+#
+# Nothing refreshes the remote listing until the whole queue is done,
+# and then it's done once, instead of after every file.
+
+@dataclass
+class QueuedTransfer:
+    direction: str # 'send' or 'get'
+    name: str # the file's name, or the variable's
+    path: Path # the file to send, or the directory to get into
+    size: int = 0
+    overwrite: bool = False
+    state: str = 'Queued'
+    # the read-ahead (a Future of a Prepared), for sends
+    prepared: object = None
+
+
+@dataclass
+class Prepared:
+    """What the read-ahead finds out about a file before it's sent."""
+    size: int
+    # the object's size on the calculator, if it's an HP binary object
+    object_size: float
+    checksum: str
+    # None in Kermit mode, which reads the file itself
+    payload: 'PreparedFile' = None
+
+
+def prepare_send(path, use_xmodem, object_info) -> Prepared:
+    from hpex.hp_xmodem import PreparedFile
+    path = Path(path).expanduser()
+    # the checksum usually comes from the cache, since the local pane
+    # had it worked out when the file was on screen
+    info = object_info.lookup(path)
+    # Kermit reads the file itself, so only XModem sends can have
+    # their ASCII objects translated on the way
+    payload = PreparedFile.read(
+        path, HPexSettingsTools.load_settings()['pretranslate_ascii']) \
+        if use_xmodem else None
+    return Prepared(info.size, info.object_size, info.checksum, payload)
+
+
+class TransferQueuePanel(wx.Panel):
+    def __init__(self, parent):
+        wx.Panel.__init__(self, parent)
+        self.parent = parent
+        self.topic = 'TransferQueue'
+        self.ptopic = parent.topic
+
+        self.transfers = []
+        # the one running now
+        self.current = None
+        self.job = None
+        self.connector = None
+        # memory left on the calculator, counting what we've sent
+        # since it was last listed
+        self.memfree = None
+        self.changed_remote = False
+        # one worker is plenty: it only has to stay a file ahead
+        self.read_ahead_pool = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='hpex read-ahead')
+
+        pub.subscribe(self.kermit_newdata, f'kermit.newdata.{self.topic}')
+        pub.subscribe(self.kermit_failed, f'kermit.failed.{self.topic}')
+        pub.subscribe(self.kermit_cancelled, f'kermit.cancelled.{self.topic}')
+        pub.subscribe(self.kermit_done, f'kermit.done.{self.topic}')
+        pub.subscribe(self.xmodem_newdata, f'xmodem.newdata.{self.topic}')
+        pub.subscribe(self.xmodem_failed, f'xmodem.failed.{self.topic}')
+        pub.subscribe(self.xmodem_cancelled, f'xmodem.cancelled.{self.topic}')
+        pub.subscribe(self.xmodem_done, f'xmodem.done.{self.topic}')
+
+        self.sizer = wx.BoxSizer(wx.VERTICAL)
+        self.transfer_list = wx.ListCtrl(
+            self, wx.ID_ANY, style=wx.LC_REPORT | wx.LC_SINGLE_SEL)
+        self.transfer_list.InsertColumn(0, 'Name')
+        self.transfer_list.InsertColumn(1, 'Direction')
+        self.transfer_list.InsertColumn(2, 'Size (bytes)')
+        self.transfer_list.InsertColumn(3, 'Status')
+
+        self.progress_text = wx.StaticText(self, wx.ID_ANY, 'No transfers.')
+        self.progress_bar = wx.Gauge(self)
+
+        self.cancel_button = wx.Button(self, wx.ID_CANCEL, 'Cancel All')
+        self.cancel_button.Bind(wx.EVT_BUTTON, self.cancel)
+        self.cancel_button.Disable()
+        self.clear_button = wx.Button(self, wx.ID_ANY, 'Clear Finished')
+        self.clear_button.Bind(wx.EVT_BUTTON, self.clear_finished)
+
+        self.button_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        self.button_sizer.Add(self.progress_bar, 1, wx.EXPAND | wx.ALL)
+        self.button_sizer.Add(self.cancel_button, 0, wx.EXPAND | wx.ALL)
+        self.button_sizer.Add(self.clear_button, 0, wx.EXPAND | wx.ALL)
+
+        self.sizer.Add(self.progress_text, 0, wx.EXPAND | wx.ALL)
+        self.sizer.Add(self.button_sizer, 0, wx.EXPAND | wx.ALL)
+        self.sizer.Add(self.transfer_list, 1, wx.EXPAND | wx.ALL)
+        self.SetSizerAndFit(self.sizer)
+
+    @property
+    def port(self):
+        return StringTools.trim_serial_port(self.parent.serial_port_box.GetValue())
+
+    @property
+    def use_xmodem(self):
+        return self.parent.xmodem_mode
+
+    def add_send(self, path):
+        path = Path(path).expanduser()
+        self.add(QueuedTransfer('send', path.name, path, path.stat().st_size))
+
+    def add_get(self, var, current_dir, overwrite):
+        self.add(QueuedTransfer('get', var.name, Path(current_dir),
+                                int(float(var.size)), overwrite))
+
+    def add(self, transfer):
+        self.transfers.append(transfer)
+        self.transfer_list.Append(
+            (transfer.name,
+             'To calculator' if transfer.direction == 'send' else 'From calculator',
+             str(transfer.size),
+             transfer.state))
+        self.transfer_list.SetColumnWidth(0, wx.LIST_AUTOSIZE)
+        if self.current is None:
+            # what the last listing said, if we have one
+            if self.memfree is None and self.parent.connected \
+               and getattr(self.parent, 'memfree', None) is not None:
+                self.memfree = float(self.parent.memfree)
+            self.start_next()
+        else:
+            self.read_ahead()
+        self.cancel_button.Enable()
+
+    def set_state(self, transfer, state):
+        transfer.state = state
+        self.transfer_list.SetItem(self.transfers.index(transfer), 3, state)
+
+    def queued(self) -> list:
+        return [t for t in self.transfers if t.state == 'Queued']
+
+    def read_ahead(self):
+        # start preparing the next send that isn't already
+        for transfer in self.queued():
+            if transfer.direction == 'send':
+                if transfer.prepared is None:
+                    transfer.prepared = self.read_ahead_pool.submit(
+                        prepare_send, transfer.path, self.use_xmodem,
+                        self.parent.object_info)
+                return
+
+    def start_next(self):
+        # Called when the queue was idle, and each time a transfer
+        # finishes.
+        self.current = None
+        queued = self.queued()
+        if not queued:
+            self.finished()
+            return
+        if self.use_xmodem and not self.parent.can_transfer():
+            # Disconnected, or about to be: the server has quit or
+            # been told to, so nothing more can go. (XModem sends
+            # without a connection go to XRECV, not through here.)
+            self.stop_queue('Not sent')
+            self.finished()
+            return
+
+        transfer = queued[0]
+        if transfer.direction == 'send':
+            if transfer.prepared is None:
+                self.read_ahead()
+            if not transfer.prepared.done():
+                # come back when it's ready (this is the only time the
+                # queue waits on the read-ahead)
+                self.current = transfer
+                self.set_state(transfer, 'Preparing')
+                transfer.prepared.add_done_callback(
+                    lambda f: wx.CallAfter(self.start_prepared, transfer))
+                return
+        self.start_prepared(transfer)
+
+    def start_prepared(self, transfer):
+        if transfer.state not in ('Queued', 'Preparing'):
+            # cancelled while it was being prepared
+            return
+        self.current = transfer
+        self.progress_text.SetLabelText(
+            f'{self.transfers.index(transfer) + 1} of {len(self.transfers)}: {transfer.name}')
+        self.progress_bar.SetValue(0)
+
+        if transfer.direction == 'send':
+            try:
+                prepared = transfer.prepared.result()
+            except OSError as e:
+                self.set_state(transfer, f"Couldn't read: {e.strerror}")
+                self.start_next()
+                return
+            if prepared.payload is not None and \
+               len(prepared.payload.data) != transfer.size:
+                # pretranslated, so the size column shows what's sent
+                transfer.size = len(prepared.payload.data)
+                self.transfer_list.SetItem(
+                    self.transfers.index(transfer), 2, str(transfer.size))
+            # checked here rather than in the read-ahead, since the
+            # memory left depends on what went before
+            if self.memfree is not None and prepared.object_size > self.memfree:
+                self.set_state(transfer, f'Not enough memory ({int(self.memfree)} bytes free)')
+                self.start_next()
+                return
+            if prepared.checksum:
+                self.set_state(transfer, f'Sending ({prepared.checksum})')
+            else:
+                self.set_state(transfer, 'Sending')
+            self.run_send(transfer, prepared)
+        else:
+            self.set_state(transfer, 'Receiving')
+            self.run_get(transfer)
+
+        # get the next one ready while this one goes
+        self.read_ahead()
+
+    def run_send(self, transfer, prepared):
+        if self.use_xmodem:
+            self.run_xmodem(transfer, prepared.payload, 'send_connect', '')
+        else:
+            self.run_kermit(transfer, f'send {transfer.path}')
+
+    def run_get(self, transfer):
+        if self.use_xmodem:
+            cmd = 'get_connect_overwrite' if transfer.overwrite else 'get_connect'
+            self.run_xmodem(transfer, transfer.name, cmd, transfer.path)
+        else:
+            command = 'set file collision overwrite,' if transfer.overwrite else ''
+            command += f'cd {transfer.path},get {transfer.name}'
+            self.run_kermit(transfer, command)
+
+    # the asyncio connectors where the port allows it, like
+    # HPexGUI.run_xmodem()
+    def run_xmodem(self, transfer, fname, command, current_path):
+        from hpex.async_io import can_drive
+        if can_drive(self.port):
+            from hpex.async_connectors import AsyncXModemConnector as XModemConnector
+        else:
+            from hpex.xmodem_pubsub import XModemConnector
+        connector = XModemConnector()
+        self.submit(
+            transfer,
+            ('xmodem', command, transfer.direction, str(transfer.path), transfer.name),
+            connector,
+            (self.port, self, fname, command, current_path, self.topic))
+
+    def run_kermit(self, transfer, command):
+        from hpex.async_io import can_drive
+        if can_drive(self.port):
+            from hpex.async_connectors import AsyncKermitConnector as KermitConnector
+        else:
+            from hpex.kermit_pubsub import KermitConnector
+        connector = KermitConnector()
+        self.submit(
+            transfer,
+            ('kermit', command),
+            connector,
+            (self.port, self, command, self.topic))
+
+    def submit(self, transfer, key, connector, args):
+        self.job = PortCoordinator.for_port(self.port).submit(
+            key, connector.run, args,
+            owner=connector, priority=PRIORITY_TRANSFER)
+        self.connector = self.job.owner
+        # The connectors' events don't say which transfer they're
+        # for, and a failure can come after the done event, so we
+        # only move on once the job itself has finished. Its
+        # CallAfter comes after any of the connector's.
+        self.job.add_done_callback(
+            lambda job: wx.CallAfter(self.job_finished, transfer))
+
+    def set_result(self, state):
+        # from the connector events, for the transfer that's running
+        if self.current is not None:
+            self.set_state(self.current, state)
+
+    def job_finished(self, transfer):
+        if transfer.state.startswith(('Sending', 'Receiving')):
+            # the connector never said how it went
+            self.set_state(transfer, 'Failed')
+        if transfer.state == 'Done':
+            self.changed_remote = True
+            if transfer.direction == 'send' and self.memfree is not None:
+                self.memfree -= transfer.prepared.result().object_size
+        self.progress_bar.SetValue(100 if transfer.state == 'Done' else 0)
+        self.start_next()
+
+    def finished(self):
+        self.cancel_button.Disable()
+        self.memfree = None
+        failed = sum(t.state not in ('Done', 'Cancelled') for t in self.transfers)
+        if failed:
+            self.progress_text.SetLabelText(f'Finished, {failed} failed.')
+        else:
+            self.progress_text.SetLabelText('Finished.')
+        # one refresh for the whole queue
+        if self.changed_remote:
+            self.changed_remote = False
+            self.parent.transfer_done()
+
+    def stop_queue(self, state):
+        # the XModem server quits when a transfer fails or is
+        # cancelled, so nothing after it can go
+        for transfer in self.queued():
+            self.set_state(transfer, state)
+
+    def stop(self, state) -> bool:
+        """Mark everything that hasn't reached the port yet with
+        `state`, including the current transfer if it's still waiting.
+        Returns False if a transfer is running on the port, which
+        carries on unless its connector is cancelled too."""
+        self.stop_queue(state)
+        transfer = self.current
+        if transfer is None:
+            return True
+        if transfer.state == 'Preparing':
+            # nothing on the port yet
+            self.set_state(transfer, state)
+            self.start_next()
+        elif self.job.cancel():
+            # still waiting for the port, so the job_finished it
+            # leads to just moves on
+            self.set_state(transfer, state)
+        else:
+            return False
+        return True
+
+    def cancel(self, event):
+        if self.stop('Cancelled'):
+            return
+        if self.use_xmodem:
+            self.connector.cancel()
+        elif self.connector.isalive():
+            self.connector.cancel_kermit()
+
+    def clear_finished(self, event):
+        for index in reversed(range(len(self.transfers))):
+            transfer = self.transfers[index]
+            if transfer is not self.current and transfer.state != 'Queued':
+                del self.transfers[index]
+                self.transfer_list.DeleteItem(index)
+
+    def kermit_newdata(self, data, cmd):
+        p = KermitProcessTools.kermit_line_to_progress(data)
+        if p is not None:
+            self.progress_bar.SetValue(p)
+
+    def kermit_done(self, cmd, out):
+        self.parent.SetStatusText(f"Transferred '{self.current.name}'.")
+        self.set_result('Done')
+
+    def kermit_failed(self, cmd, out):
+        # Kermit is started again for every file, so one failure
+        # doesn't stop the rest
+        errors = [line for line in KermitProcessTools.strip_blank_lines(out).split('\n')
+                  if '?' in line]
+        self.parent.SetStatusText(
+            f'Kermit failed to transfer {self.current.name}.')
+        self.set_result('Failed: ' + (errors[-1] if errors else 'Kermit error'))
+
+    def kermit_cancelled(self, cmd, out):
+        self.parent.SetStatusText(
+            'Kermit transfer cancelled; you may have to press [ATTN] or [CANCEL].')
+        self.set_result('Cancelled')
+
+    def xmodem_newdata(self, file_count, total, success, error, should_update):
+        if should_update:
+            self.progress_bar.SetValue(
+                XModemProcessTools.packet_count_to_progress(success, file_count))
+
+    def xmodem_done(self, file_count, total, success, error):
+        self.parent.SetStatusText(f"Transferred '{self.current.name}'.")
+        self.set_result('Done')
+
+    def xmodem_failed(self, cmd):
+        self.parent.SetStatusText(
+            f'XModem failed to transfer {self.current.name}. Calculator is now disconnected.')
+        self.stop_queue('Not sent')
+        wx.CallAfter(
+            pub.sendMessage,
+            f'xmodem.transfercancelled.{self.ptopic}')
+        self.set_result('Failed')
+
+    def xmodem_cancelled(self):
+        self.parent.SetStatusText(
+            f'XModem transfer to {self.port} cancelled. Calculator is now disconnected.')
+        wx.CallAfter(
+            pub.sendMessage,
+            f'xmodem.transfercancelled.{self.ptopic}')
+        self.set_result('Cancelled')
@@ -0,0 +1,392 @@
+import io
+import os
+import platform
+import selectors
+import socket
+import time
+from urllib.parse import urlsplit
+
+_system = platform.system()
+
+import serial
+
+from hpex.cancel_io import CancelPipe
+from hpex.tty_tuning import tune_port
+
+# Every connector used to build its own serial.Serial, with its own
+# copy of the parity mapping, and then read from it a byte or two at a
+# time: every getc() and every byte of an ACK loop was its own read()
+# call, and so several syscalls.
+#
+# A Transport sits between the protocols and the port instead. Reads
+# pull in everything that's waiting in one go and keep it in a buffer,
+# so most of the protocol's little reads never touch the port. Writes
+# are collected until the next read (or flush()), so a command byte
+# and the packet after it go out in one write. The backend underneath
+# is pluggable, so the same protocol code works over a real serial
+# port, a pty, or a socket.
+#
+# Since everything goes through here, the Transport also counts reads
+# and writes, and anything that wants to watch the raw traffic can set
+# Transport.observer.
+#
+# A port doesn't have to be local, either. pyserial understands
+# rfc2217://host:port (a serial port shared with RFC 2217, like
+# ser2net does) and socket://host:port (the raw bytes over TCP), so
+# the calculators can hang off another machine. socket:// ports get a
+# plain socket of our own, which we can select() on. rfc2217:// ports
+# are left to pyserial, because of the telnet negotiation, and get
+# polled.
+
+# the parity strings in the settings file, as pyserial constants
+PARITIES = {
+    '0 (None)': serial.PARITY_NONE,
+    '1 (Odd)': serial.PARITY_ODD,
+    '2 (Even)': serial.PARITY_EVEN,
+    '3 (Mark)': serial.PARITY_MARK,
+    '4 (Space)': serial.PARITY_SPACE,
+}
+
+NETWORK_SCHEMES = ('rfc2217://', 'socket://')
+
+def is_network_port(port) -> bool:
+    """True if `port` is an rfc2217:// or socket:// URL rather than a
+    device."""
+    return port.startswith(NETWORK_SCHEMES)
+
+def split_port_url(port):
+    """Return (scheme, host, port number) for a network port URL."""
+    url = urlsplit(port)
+    if not url.hostname or url.port is None:
+        raise ValueError(f"'{port}' should look like {url.scheme}://host:port")
+    return url.scheme, url.hostname, url.port
+
+def open_serial(port, settings, timeout=1) -> serial.SerialBase:
+    """Open `port` with the baud rate and parity in `settings`, and
+    tune it for latency if the low_latency setting is on. `port` can
+    also be any URL pyserial knows."""
+    ser = serial.serial_for_url(
+        port,
+        int(settings['baud_rate']),
+        parity=PARITIES.get(settings['parity'], serial.PARITY_NONE),
+        timeout=timeout,
+        write_timeout=timeout)
+    if settings.get('low_latency') and _system != 'Windows' \
+       and not is_network_port(port):
+        tune_port(port, ser.fileno())
+    return ser
+
+def open_socket(port, timeout=1) -> socket.socket:
+    """Connect to socket://host:port."""
+    _, host, number = split_port_url(port)
+    sock = socket.create_connection((host, number), timeout)
+    # every packet waits for its ACK, so don't let Nagle hold the
+    # ACKs (or anything else) back
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+# how much we ask the backend for at once
+READ_CHUNK = 4096
+
+# how often we check for cancel when a backend can't be select()ed
+POLL_INTERVAL = .05
+
+
+class TTYBackend:
+    """A serial port, opened and configured by pyserial."""
+    def __init__(self, ser: serial.SerialBase):
+        self.ser = ser
+        self.name = ser.port
+        # Windows serial ports and rfc2217:// ports have no fd to
+        # select() on, so read_some() does the waiting there, a
+        # POLL_INTERVAL at a time. Changing the timeout reconfigures
+        # the port (over the network, for rfc2217), so it's set once.
+        self.fd = None
+        if _system != 'Windows':
+            try:
+                self.fd = ser.fileno()
+            except (AttributeError, io.UnsupportedOperation):
+                pass
+        if self.fd is None:
+            ser.timeout = POLL_INTERVAL
+
+    def fileno(self):
+        return self.fd
+
+    def read_some(self, timeout) -> bytes:
+        if self.fd is not None:
+            # pyserial keeps the fd non-blocking, and we've already
+            # waited for it to be readable
+            return os.read(self.fd, READ_CHUNK)
+        return self.ser.read(max(1, self.ser.in_waiting))
+
+    def in_waiting(self) -> int:
+        return self.ser.in_waiting
+
+    def write(self, data):
+        self.ser.write(data)
+
+    def drain(self):
+        # wait until the UART has sent everything
+        self.ser.flush()
+
+    def interrupt(self):
+        # only matters without an fd, where read_some() blocks in
+        # pyserial, and then only for up to POLL_INTERVAL
+        if self.fd is None and hasattr(self.ser, 'cancel_read'):
+            self.ser.cancel_read()
+
+    def close(self):
+        self.ser.close()
+
+
+class PtyBackend:
+    """The master side of a pty (or any other fd), for talking to a
+    program rather than a port."""
+    def __init__(self, fd, name='pty'):
+        self.fd = fd
+        self.name = name
+        os.set_blocking(fd, False)
+
+    def fileno(self):
+        return self.fd
+
+    def read_some(self, timeout) -> bytes:
+        return os.read(self.fd, READ_CHUNK)
+
+    def in_waiting(self) -> int:
+        return 0
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(self.fd, view):]
+            except BlockingIOError:
+                with selectors.DefaultSelector() as selector:
+                    selector.register(self.fd, selectors.EVENT_WRITE)
+                    selector.select()
+
+    def drain(self):
+        pass
+
+    def interrupt(self):
+        pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+class SocketBackend:
+    """A connected socket, like a serial port shared over the
+    network."""
+    def __init__(self, sock, name=None):
+        self.sock = sock
+        self.name = name or str(sock.getpeername())
+        sock.setblocking(False)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def read_some(self, timeout) -> bytes:
+        return self.sock.recv(READ_CHUNK)
+
+    def in_waiting(self) -> int:
+        return 0
+
+    def write(self, data):
+        self.sock.setblocking(True)
+        try:
+            self.sock.sendall(data)
+        finally:
+            self.sock.setblocking(False)
+
+    def drain(self):
+        pass
+
+    def interrupt(self):
+        pass
+
+    def close(self):
+        self.sock.close()
+
+
+class Transport:
+    """Buffered reads and coalesced writes on top of a backend. Reads
+    return early with whatever they have if `timeout` passes, like
+    pyserial's, or if cancel() is called."""
+    def __init__(self, backend, timeout=1):
+        self.backend = backend
+        self.timeout = timeout
+        self.buffer = bytearray()
+        self.pending = bytearray()
+        self.cancel_pipe = CancelPipe()
+        # seconds from cancel() to a read noticing it, for
+        # benchmarks/cancel_latency.py
+        self.woken_after = None
+        # called as observer(direction, data) for everything that
+        # crosses the port, direction being 'read' or 'write'
+        self.observer = None
+        self.stats = {'reads': 0, 'bytes_read': 0,
+                      'writes': 0, 'bytes_written': 0}
+
+        self.selector = None
+        if backend.fileno() is not None:
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(backend.fileno(), selectors.EVENT_READ)
+            self.selector.register(self.cancel_pipe, selectors.EVENT_READ)
+
+    @classmethod
+    def open(cls, port, settings, timeout=1):
+        """Open serial port `port` with the settings in `settings`.
+        socket:// ports are connected directly."""
+        if port.startswith('socket://'):
+            return cls(SocketBackend(open_socket(port, timeout), port), timeout)
+        return cls(TTYBackend(open_serial(port, settings, timeout)), timeout)
+
+    @property
+    def name(self):
+        return self.backend.name
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_pipe.is_set()
+
+    def cancel(self):
+        """Make any read in progress, and every read after it, return
+        straight away."""
+        self.cancel_pipe.set()
+        self.backend.interrupt()
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self.buffer) + self.backend.in_waiting()
+
+    def _fill(self, timeout) -> bool:
+        """Wait up to `timeout` seconds for data and add it to the
+        buffer. Returns False on timeout or cancel."""
+        if self.pending:
+            self.flush(drain=False)
+        if self._check_cancelled():
+            return False
+
+        if self.selector is not None:
+            ready = self.selector.select(timeout)
+            if self._check_cancelled() or not ready:
+                return False
+            try:
+                data = self.backend.read_some(timeout)
+            except BlockingIOError:
+                return False
+        else:
+            data = self._poll(timeout)
+        if not data:
+            return False
+
+        self.stats['reads'] += 1
+        self.stats['bytes_read'] += len(data)
+        if self.observer is not None:
+            self.observer('read', data)
+        self.buffer.extend(data)
+        return True
+
+    def _poll(self, timeout) -> bytes:
+        # for backends without an fd: each read_some() gives up after
+        # POLL_INTERVAL, so we can notice cancel() in between
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            data = self.backend.read_some(POLL_INTERVAL)
+            if data or self._check_cancelled():
+                return data
+            if deadline is not None and time.monotonic() >= deadline:
+                return b''
+
+    def _check_cancelled(self) -> bool:
+        if self.cancelled and self.woken_after is None:
+            self.woken_after = self.cancel_pipe.elapsed()
+        return self.cancelled
+
+    def _take(self, n) -> bytes:
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+    def _deadline(self, timeout):
+        if timeout is None:
+            timeout = self.timeout
+        return None if timeout is None else time.monotonic() + timeout
+
+    @staticmethod
+    def _left(deadline):
+        return None if deadline is None else max(0, deadline - time.monotonic())
+
+    def read(self, n=1) -> bytes:
+        """Return up to `n` bytes, waiting only if there aren't any
+        yet. b'' means the timeout passed."""
+        if not self.buffer:
+            self._fill(self.timeout)
+        return self._take(n)
+
+    def read_exact(self, n, timeout=None) -> bytes:
+        """Return `n` bytes, or fewer if `timeout` (the whole read,
+        not per byte) passes first."""
+        deadline = self._deadline(timeout)
+        while len(self.buffer) < n:
+            if not self._fill(self._left(deadline)):
+                break
+        return self._take(n)
+
+    def read_until(self, terminator: bytes, timeout=None) -> bytes:
+        """Return everything up to and including `terminator`, or
+        whatever has arrived if `timeout` passes first."""
+        deadline = self._deadline(timeout)
+        start = 0
+        while True:
+            i = self.buffer.find(terminator, start)
+            if i != -1:
+                return self._take(i + len(terminator))
+            start = max(0, len(self.buffer) - len(terminator) + 1)
+            if not self._fill(self._left(deadline)):
+                return self._take(len(self.buffer))
+
+    def expect(self, expected: bytes, timeout=None) -> bytes:
+        """Discard input until one of the bytes in `expected` arrives,
+        and return it. b'' means it didn't arrive in time."""
+        deadline = self._deadline(timeout)
+        while True:
+            for i, c in enumerate(self.buffer):
+                if c in expected:
+                    del self.buffer[:i + 1]
+                    return bytes([c])
+            self.buffer.clear()
+            if not self._fill(self._left(deadline)):
+                return b''
+
+    def write(self, data):
+        """Queue `data`. It's sent on the next read or flush()."""
+        self.pending.extend(data)
+        return len(data)
+
+    def flush(self, drain=True):
+        """Send everything write() has queued. With `drain`, also
+        wait until it's actually left the port."""
+        if self.pending:
+            data = bytes(self.pending)
+            self.pending.clear()
+            self.stats['writes'] += 1
+            self.stats['bytes_written'] += len(data)
+            if self.observer is not None:
+                self.observer('write', data)
+            self.backend.write(data)
+        if drain:
+            self.backend.drain()
+
+    def close(self):
+        try:
+            self.flush()
+        except Exception as e:
+            print(f'{self.name}: flush on close', repr(e))
+        if self.selector is not None:
+            self.selector.close()
+        self.cancel_pipe.close()
+        self.backend.close()
@@ -0,0 +1,118 @@
+import array
+import os
+import platform
+from pathlib import Path
+
+_system = platform.system()
+
+if _system == 'Linux':
+    import fcntl
+    import termios
+
+# HP XModem and Kermit (the way we use it) are both stop-and-wait:
+# every packet waits for an ACK before the next one goes out, so every
+# packet pays whatever delay the port adds on the way in. USB-serial
+# adapters add a lot. FTDI chips hold received bytes for up to their
+# latency timer (16 ms by default) before sending them over USB, and
+# the kernel may batch them up again on top of that.
+#
+# With the 'low_latency' setting on, open_serial() in transport.py
+# calls tune_port() to turn all of that down:
+#  - ASYNC_LOW_LATENCY on the port, through TIOCSSERIAL
+#  - the FTDI latency timer in sysfs, if we're allowed to write it
+#  - raw termios, with VMIN=1 and VTIME=0 so a read never waits for
+#    more bytes than are there
+#
+# The first two belong to the device, not to our open file, so they
+# stay set after we close the port. That also helps Kermit, which
+# opens the port itself.
+
+# from linux/serial.h
+ASYNC_LOW_LATENCY = 1 << 13
+# the flags field of struct serial_struct, counting in ints
+_SERIAL_FLAGS_INDEX = 4
+
+# the lowest the FTDI driver accepts, in milliseconds
+LATENCY_TIMER_MS = 1
+
+def latency_timer_path(port):
+    """Return the sysfs latency_timer file for `port`, or None if it
+    doesn't have one (it isn't an FTDI adapter, or isn't local)."""
+    name = Path(os.path.realpath(port)).name
+    path = Path('/sys/bus/usb-serial/devices', name, 'latency_timer')
+    return path if path.exists() else None
+
+def _tune_latency_timer(port) -> list:
+    path = latency_timer_path(port)
+    if path is None:
+        return []
+    try:
+        old = int(path.read_text())
+    except (OSError, ValueError):
+        return []
+    if old <= LATENCY_TIMER_MS:
+        return []
+    if not os.access(path, os.W_OK):
+        return [f'latency_timer is {old} ms, but {path} is not writable']
+    try:
+        path.write_text(str(LATENCY_TIMER_MS))
+    except OSError as e:
+        return [f'could not set latency_timer: {e.strerror}']
+    return [f'latency_timer {old} -> {LATENCY_TIMER_MS} ms']
+
+def _tune_serial_flags(fd) -> list:
+    buf = array.array('i', [0] * 32)
+    try:
+        fcntl.ioctl(fd, termios.TIOCGSERIAL, buf)
+        if buf[_SERIAL_FLAGS_INDEX] & ASYNC_LOW_LATENCY:
+            return []
+        buf[_SERIAL_FLAGS_INDEX] |= ASYNC_LOW_LATENCY
+        fcntl.ioctl(fd, termios.TIOCSSERIAL, buf)
+    except OSError:
+        # ptys and some USB drivers don't have serial_struct at all
+        return []
+    return ['ASYNC_LOW_LATENCY set']
+
+def _tune_termios(fd) -> list:
+    old = termios.tcgetattr(fd)
+    new = [old[0], old[1], old[2], old[3], old[4], old[5], list(old[6])]
+    new[0] &= ~(termios.IGNBRK | termios.BRKINT | termios.PARMRK | termios.ISTRIP
+                | termios.INLCR | termios.IGNCR | termios.ICRNL)
+    new[1] &= ~termios.OPOST
+    new[3] &= ~(termios.ICANON | termios.ECHO | termios.ECHOE | termios.ECHONL
+                | termios.ISIG | termios.IEXTEN)
+    new[6][termios.VMIN] = 1
+    new[6][termios.VTIME] = 0
+
+    changes = []
+    for index, name in ((0, 'iflag'), (1, 'oflag'), (3, 'lflag')):
+        if new[index] != old[index]:
+            changes.append(f'{name} {old[index]:#o} -> {new[index]:#o}')
+    for index, name in ((termios.VMIN, 'VMIN'), (termios.VTIME, 'VTIME')):
+        # tcgetattr() gives these as one-byte strings while ICANON is
+        # on, and as ints otherwise
+        was = old[6][index]
+        if isinstance(was, bytes):
+            was = ord(was)
+        if new[6][index] != was:
+            changes.append(f'{name} {was} -> {new[6][index]}')
+
+    if changes:
+        termios.tcsetattr(fd, termios.TCSANOW, new)
+    return changes
+
+def tune_port(port, fd=None) -> list:
+    """Turn down the receive latency of `port` as far as we can, and
+    return a list of what was changed. The termios and TIOCSSERIAL
+    changes need the open port's `fd`; without it only the sysfs
+    latency timer is touched. Does nothing off Linux."""
+    if _system != 'Linux':
+        return []
+
+    changes = _tune_latency_timer(port)
+    if fd is not None:
+        changes += _tune_serial_flags(fd)
+        changes += _tune_termios(fd)
+    if changes:
+        print(f'{port}: low latency:', ', '.join(changes))
+    return changes
@@ -0,0 +1,151 @@
+import functools
+import struct
+from array import array
+from collections.abc import Sequence
+
+from hpex.helpers import XModemProcessTools
+# registers the 'hp48' codec, which the names are in
+import hpex.hp48_codec
+
+# The XModem server's reply to 'L' used to be walked a byte at a time
+# with slices, and every entry turned straight into an HPVariable of
+# four strings: the name decoded, the size halved into a float and
+# formatted, the prolog looked up and the CRC formatted as hex. A big
+# directory (or a port 1 card full of libraries, listed from HOME)
+# spent most of its time and memory on strings nobody looked at.
+#
+# Now the reply is parsed with struct.unpack_from over a memoryview,
+# and an XModemListing keeps each field in a flat array of ints, with
+# the packet itself holding the names. The strings are only made when
+# an entry is looked at, by an XModemVariable, which has the same
+# name, size, vtype and crc as an HPVariable and can go anywhere one
+# can. benchmarks/remote_listing.py measures the difference.
+
+# Variable in HOME that holds the calculator's original path while
+# we're connected, so that disconnecting can put it back. It's hidden
+# from the listing.
+PATH_VAR = '$$$p'
+
+# The programs that look after it. Connecting saves the path and homes
+# in one go, and disconnecting goes back: DUP to duplicate the name,
+# EVAL to get the variable value, SWAP to swap between value and
+# variable name, PURGE to delete variable, EVAL to change path. A
+# connection that isn't going to go back clears out one left behind
+# by a link that dropped, if there is one.
+SAVE_PATH = f"PATH HOME '{PATH_VAR}' STO"
+RESTORE_PATH = f"HOME '{PATH_VAR}' DUP EVAL SWAP PURGE EVAL"
+DISCARD_PATH = f"HOME IFERR '{PATH_VAR}' PURGE THEN END"
+
+# after the name: prolog (2 bytes), size in nibbles (3 bytes, which is
+# two and one here) and CRC (2 bytes), all little-endian
+ENTRY = struct.Struct('<HHBH')
+
+# prolog_to_type() builds its table on every call, and there are only
+# a couple of dozen prologs
+type_name = functools.lru_cache(maxsize=None)(XModemProcessTools.prolog_to_type)
+
+
+class XModemVariable:
+    """One entry of an XModemListing, formatted when it's asked for."""
+    __slots__ = ('name', 'nibbles', 'prolog', 'checksum')
+
+    def __init__(self, name, nibbles, prolog, checksum):
+        self.name = name
+        self.nibbles = nibbles
+        self.prolog = prolog
+        self.checksum = checksum
+
+    @property
+    def size(self) -> str:
+        # bytes, which can be half of one
+        return str(self.nibbles / 2)
+
+    @property
+    def vtype(self) -> str:
+        return type_name(self.prolog)
+
+    @property
+    def crc(self) -> str:
+        # what KermitProcessTools.checksum_to_hexstr() makes
+        return f'#{self.checksum:X}h'
+
+    def __eq__(self, other):
+        if not isinstance(other, XModemVariable):
+            return NotImplemented
+        return (self.name, self.nibbles, self.prolog, self.checksum) == \
+            (other.name, other.nibbles, other.prolog, other.checksum)
+
+    def __repr__(self):
+        return f'XModemVariable({self.name!r}, {self.size}, {self.vtype!r}, {self.crc!r})'
+
+
+class XModemListing(Sequence):
+    """The objects in a directory, as the XModem server listed them."""
+    def __init__(self, data=b''):
+        self.data = bytes(data)
+        # where each name starts in data, and how long it is
+        self.name_starts = array('I')
+        self.name_lengths = array('B')
+        self.prologs = array('H')
+        self.nibbles = array('I')
+        self.checksums = array('H')
+        # names are decoded the first time they're asked for
+        self.names = []
+
+    def __len__(self):
+        return len(self.prologs)
+
+    def name(self, index) -> str:
+        name = self.names[index]
+        if name is None:
+            start = self.name_starts[index]
+            name = self.data[start:start + self.name_lengths[index]].decode('hp48')
+            self.names[index] = name
+        return name
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        return XModemVariable(self.name(index), self.nibbles[index],
+                              self.prologs[index], self.checksums[index])
+
+    def __repr__(self):
+        return f'<XModemListing of {len(self)} objects>'
+
+
+def parse_listing(l: bytes) -> XModemListing:
+    """Turn the server's reply to 'L' into an XModemListing. Each
+    entry is a length byte, that many bytes of name, then the prolog,
+    size and CRC."""
+    listing = XModemListing(l)
+    data = memoryview(listing.data)
+    hidden = PATH_VAR.encode()
+    unpack_from = ENTRY.unpack_from
+    end = len(data)
+    index = 0
+    while index < end:
+        length = data[index]
+        start = index + 1
+        index = start + length
+        try:
+            prolog, size_low, size_high, crc = unpack_from(data, index)
+        except struct.error:
+            # cut short; the old parser would have made a garbled
+            # entry of what was left, so we just stop
+            print('listing ends partway through an entry')
+            break
+        index += ENTRY.size
+
+        if data[start:index - ENTRY.size] == hidden:
+            # our own bookkeeping, not the user's
+            continue
+
+        listing.name_starts.append(start)
+        listing.name_lengths.append(length)
+        listing.prologs.append(prolog)
+        listing.nibbles.append(size_high << 16 | size_low)
+        listing.checksums.append(crc)
+    listing.names = [None] * len(listing.prologs)
+    return listing
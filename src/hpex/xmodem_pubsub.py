@@ -1,34 +1,55 @@
+import fnmatch
+import io
 import os
-import math
-import time
 from pathlib import Path
-import tempfile
 
 import xmodem
 from pubsub import pub
-import serial
 
 from hpex.settings import HPexSettingsTools
-from hpex.hp_variable import HPVariable
-from hpex.helpers import KermitProcessTools, XModemProcessTools # needed for checksum_to_hexstr
-from hpex.hp_xmodem import HPXModem
+from hpex.hp_xmodem import HPXModem, PreparedFile, hp_packet_count
+# parse_listing and the path programs are used from here by
+# async_connectors.py
+from hpex.xmodem_listing import parse_listing, PATH_VAR, \
+    SAVE_PATH, RESTORE_PATH, DISCARD_PATH
+# registers the 'hp48' codec, for names and programs going out
+import hpex.hp48_codec
+from hpex.transport import Transport
 # TODO: test what the output of Conn4x gives---do the received files
 # have the extra \x00 bytes at the end?
 
 ACK = b'\x06'
+# How long the line has to stay quiet before clear_extra_bytes()
+# decides the server is done talking. At 9600 baud a byte takes about
+# a millisecond, so this is a generous gap between characters.
+DRAIN_IDLE_GAP = .05
+
+
 class XModemConnector:
     def getc(self, size, timeout=.1):
         #print('getc', size)
         #data = self.ser.read(size)
         #print('data', data)
-        return self.ser.read(size) or None
+        # the xmodem module wants the whole block in one call, or
+        # nothing
+        return self.ser.read_exact(size) or None
                     
     def putc(self, data, timeout=.1):
         #print('putc', data)
+        # After cancelling, reads come back empty right away, and the
+        # xmodem module would answer each of those with a NAK. The
+        # CANs have already gone out by then, so keep quiet. We still
+        # have to say the write worked, though: while recv() is
+        # waiting for the first packet, it sleeps a second every time
+        # putc() fails, which held up a cancelled get for 4 seconds.
+        if self.cancelled:
+            return len(data)
         return self.ser.write(data) or None
 
-    # fname is either a string (file to get or receive), or if command
-    # == 'disconnect', a temporary file that contains the original path.
+    # fname is a string: the file to get or receive, or the directory
+    # to change to. For 'disconnect', it's PATH_VAR if 'connect' saved
+    # the path there (the connectdone event says whether it did), and
+    # '' to leave the calculator where it is. 'connect' doesn't use it.
     def run(self, port, parent, fname, command, current_path, ptopic,
             use_callafter=True, alt_options=None): # ptopic for parent
         if use_callafter:
@@ -62,49 +83,14 @@ class XModemConnector:
 
             
         self.cancelled = False
-        if self.command == 'send_connect':
-            # The issue with sending a zero-length file is that the
-            # modem never calls the callback function.
-            # This leaves us with a couple options:
-            #  - Use a time-delay if length is 0 after opening the
-            #    sending dialog and just close, because the send
-            #    is successful
-            #    But what if the send fails?
-            #  - Prevent sending zero-length file with XModem.
-            #    This would be easy to implement but it is an
-            #    annoying arbitrary restriction.
-            #    An explanation would soften it though.
-            
-            print('send_connect, self.fname is', self.fname)
-            print('cwd is', os.getcwd())
-            # 128 bytes per XModem packet, and we round up.
-            self.packet_count = math.ceil(
-                os.path.getsize(self.fname) / 128)
-
-
-        # assemble options for serial port
-        self.ser = serial.Serial()
-        self.ser.port = port
         if not alt_options:
             settings = HPexSettingsTools.load_settings()
         else:
             settings = alt_options
-        self.ser.baud = settings['baud_rate']
-
-        if settings['parity'] == '0 (None)':
-            self.ser.parity = serial.PARITY_NONE
-        elif settings['parity'] == '1 (Odd)':
-            self.ser.parity = serial.PARITY_ODD
-        elif settings['parity'] == '2 (Even)':
-            self.ser.parity = serial.PARITY_EVEN
-        elif settings['parity'] == '3 (Mark)':
-            self.ser.parity = serial.PARITY_MARK
-        elif settings['parity'] == '4 (Space)':
-            self.ser.parity = serial.PARITY_SPACE
-
-        self.ser.timeout = self.ser_timeout # fine, slightly bad naming
-        self.ser.write_timeout = self.ser_timeout
-        
+        # the same settings for the whole run, instead of loading
+        # them again halfway through talking to the server
+        self.settings = settings
+
         # On Windows, trying to refresh after a file transfer results
         # in an Access Denied error. The way to avoid this is to try
         # to open the serial port repeatedly until it works.
@@ -118,15 +104,14 @@ class XModemConnector:
                 self.failure()
                     
             try:
-                self.ser.open()
+                # self.ser_timeout: fine, slightly bad naming
+                self.ser = Transport.open(port, settings, self.ser_timeout)
+                break
 
             except Exception as e:
                 #print(e)
                 pass
 
-            if self.ser.is_open:
-                #print('open')
-                break
             tries += 1
             
             return
@@ -137,7 +122,7 @@ class XModemConnector:
         if command == 'connect':
             self.connect_to_server()
         elif command == 'disconnect':
-            self.disconnect_from_server(fname)
+            self.disconnect_from_server(restore=fname == PATH_VAR)
         elif command == 'refresh':
             # run M and L
             memory, objects = self.run_M_L()
@@ -154,103 +139,24 @@ class XModemConnector:
         #
         # Personally, I like mine better :).
         elif command == 'send_connect':
-            print('sending file, send_connect')
-            # send_connect means that HPex is connected to the XModem server
-            try:
-                self.clear_extra_bytes()
-                self.ser.flush()
-                self.sendCommand(b'P')
-                f = Path(fname)
-                self.sendCommandPacket(f.name)
-                self.modem = HPXModem(self.ser)
-                self.success = self.modem.send(f.open('rb'), retry=4, callback=self.callback)
-                
-            except Exception as e:
-                print(e)
-                # we probably won't get here, but if we do, we still can
-                # throw an error in the calling dialog
-                print('xmodem failed at modem send')
-                
-                self.failure()
-            
-                return
+            # fname can also be a list, to send several files over
+            # the one connection
+            if isinstance(fname, list):
+                self.run_batch(fname, self.send_one)
+            else:
+                self.send_one(fname)
 
-            if not self.success and not self.cancelled:
-                #print('not self.success and not self.cancelled')
-                self.failure()
-                
         elif 'get_connect' in command:
-            # 'get_connect_overwrite' is passed by FileGetDialog, when
-            # the user specifies that they would like to overwrite
-            final_name = Path(self.current_path,fname).expanduser()
-            original_name = final_name
-            
-            if command != 'get_connect_overwrite':
-                counter = 1
-                while final_name.exists():
-                    # this is to emulate the weird non-collision
-                    # filename that Kermit makes so that we don't need
-                    # multiple dialog messages
-                    final_name = Path(original_name.parent, original_name.name + '.~' + str(counter) + '~').expanduser()
-                    print(final_name)
-                    counter += 1
-
-            try:
-                self.ser.flush()
-                self.sendCommand(b'G')
-                self.sendCommandPacket(fname)
-                self.stream = final_name.open('wb')
-                # when receiving, success is zero on failure or bytes
-                # successfully sent. We just have to assume that
-                # non-zero is success
-                self.success = self.modem.recv(
-                    self.stream, retry=9, timeout=self.ser_timeout,
-                    quiet=False)
-                # Since you can't stop the modem easily, we can cancel
-                # it on the other side.
-                # TODO: do we need to though?
-
-                # MUST CLOSE THE STREAM OR ELSE IT IS EMPTY ON LINUX
-                # and possibly Windows, but it's definitely platform-dependent
-                self.stream.close()
-                if self.use_callafter and not self.cancelled:
-                    wx.CallAfter(
-                        pub.sendMessage,
-                        f'xmodem.done.{self.ptopic}',
-                        file_count=0,
-                        total=0,
-                        success=0,
-                        error=0)                
-                else:
-                    pub.sendMessage(
-                        f'xmodem.done.{self.ptopic}',
-                        file_count=0,
-                        total=0,
-                        success=0,
-                        error=0)
-
-            except Exception as e:
-                print(e)
-                # we probably won't get here, but if we do, we still can
-                # throw an error in the calling dialog
-                #print('xmodem failed at modem recv')
-                
-                self.failure()
-                self.stream.close()
-            
-                return
-
-            if not self.success and not self.cancelled:
-                #print('not self.success and not self.cancelled')
-                self.failure()
-                
+            if isinstance(fname, list):
+                self.run_batch(fname, self.get_one, command)
+            else:
+                self.get_one(fname, command)
 
         elif command == 'chdir':
             # fname is the directory to change to
             print('change to', fname)
             try:
-                self.sendCommand(b'E')
-                self.sendCommandPacket(fname)
+                self.runProgram(fname)
             except:
                 self.failure()
                 return
@@ -262,8 +168,7 @@ class XModemConnector:
             
         elif command == 'updir':
             try:
-                self.sendCommand(b'E')
-                self.sendCommandPacket('UPDIR')
+                self.runProgram('UPDIR')
             except:
                 self.failure()
                 return
@@ -275,8 +180,7 @@ class XModemConnector:
             
         elif command == 'home':
             try:
-                self.sendCommand(b'E')
-                self.sendCommandPacket('HOME')
+                self.runProgram('HOME')
             except:
                 self.failure()
                 return
@@ -289,6 +193,177 @@ class XModemConnector:
         print('self.ser.close')
         self.ser.close()
 
+    def send_one(self, fname) -> bool:
+        """Send the file `fname` with 'P'. Returns True if it went."""
+        # The issue with sending a zero-length file is that the
+        # modem never calls the callback function.
+        # This leaves us with a couple options:
+        #  - Use a time-delay if length is 0 after opening the
+        #    sending dialog and just close, because the send
+        #    is successful
+        #    But what if the send fails?
+        #  - Prevent sending zero-length file with XModem.
+        #    This would be easy to implement but it is an
+        #    annoying arbitrary restriction.
+        #    An explanation would soften it though.
+
+        print('send_connect, fname is', fname)
+        print('cwd is', os.getcwd())
+        # fname can be a PreparedFile, which has been read and split
+        # into packets already (the GUI's transfer queue does that
+        # while the file before it is sending). A path is read here,
+        # the same way, so it's pretranslated like any other send.
+        if not isinstance(fname, PreparedFile):
+            try:
+                fname = PreparedFile.read(
+                    fname, self.settings['pretranslate_ascii'])
+            except OSError as e:
+                print("couldn't read", e)
+                self.failure()
+                return False
+        # HPXModem sends 1024-byte packets where it can, so
+        # this isn't just the size over 128.
+        self.packet_count = hp_packet_count(len(fname.data))
+
+        print('sending file, send_connect')
+        # send_connect means that HPex is connected to the XModem server
+        try:
+            self.clear_extra_bytes()
+            self.ser.flush()
+            self.sendCommandPacket(fname.name, command=b'P')
+            self.modem = HPXModem(self.ser)
+            self.success = self.modem.send(
+                io.BytesIO(fname.data), retry=4, callback=self.callback,
+                packets=fname.packets)
+
+        except Exception as e:
+            print(e)
+            # we probably won't get here, but if we do, we still can
+            # throw an error in the calling dialog
+            print('xmodem failed at modem send')
+
+            self.failure()
+
+            return False
+
+        if not self.success and not self.cancelled:
+            #print('not self.success and not self.cancelled')
+            self.failure()
+        return bool(self.success) and not self.cancelled
+
+    def get_one(self, fname, command) -> bool:
+        """Get `fname` with 'G' into self.current_path. Returns
+        True if it came."""
+        if self.use_callafter:
+            import wx
+
+        # 'get_connect_overwrite' is passed by FileGetDialog, when
+        # the user specifies that they would like to overwrite
+        final_name = Path(self.current_path,fname).expanduser()
+        original_name = final_name
+
+        if command != 'get_connect_overwrite':
+            counter = 1
+            while final_name.exists():
+                # this is to emulate the weird non-collision
+                # filename that Kermit makes so that we don't need
+                # multiple dialog messages
+                final_name = Path(original_name.parent, original_name.name + '.~' + str(counter) + '~').expanduser()
+                print(final_name)
+                counter += 1
+
+        try:
+            self.ser.flush()
+            self.sendCommandPacket(fname, command=b'G')
+            self.stream = final_name.open('wb')
+            # when receiving, success is zero on failure or bytes
+            # successfully sent. We just have to assume that
+            # non-zero is success
+            self.success = self.modem.recv(
+                self.stream, retry=9, timeout=self.ser_timeout,
+                quiet=False)
+            # Since you can't stop the modem easily, we can cancel
+            # it on the other side.
+            # TODO: do we need to though?
+
+            # MUST CLOSE THE STREAM OR ELSE IT IS EMPTY ON LINUX
+            # and possibly Windows, but it's definitely platform-dependent
+            self.stream.close()
+            if self.cancelled:
+                # cancel() has already told the dialog
+                pass
+            elif self.use_callafter:
+                wx.CallAfter(
+                    pub.sendMessage,
+                    f'xmodem.done.{self.ptopic}',
+                    file_count=0,
+                    total=0,
+                    success=0,
+                    error=0)                
+            else:
+                pub.sendMessage(
+                    f'xmodem.done.{self.ptopic}',
+                    file_count=0,
+                    total=0,
+                    success=0,
+                    error=0)
+
+        except Exception as e:
+            print(e)
+            # we probably won't get here, but if we do, we still can
+            # throw an error in the calling dialog
+            #print('xmodem failed at modem recv')
+
+            self.failure()
+            self.stream.close()
+
+            return False
+
+        if not self.success and not self.cancelled:
+            #print('not self.success and not self.cancelled')
+            self.failure()
+        return bool(self.success) and not self.cancelled
+
+    def run_batch(self, names, transfer, *args):
+        """Run `transfer` on each of `names` in turn, over the port
+        that's already open, stopping at the first failure. Each file
+        still gets its own newdata and done events, and a filestart
+        event before it."""
+        if self.use_callafter:
+            import wx
+
+        # Names on the calculator can be wildcards, which we match
+        # against the listing ourselves.
+        if transfer == self.get_one and any(set('*?[') & set(n) for n in names):
+            memory, objects = self.run_M_L()
+            if objects is None:
+                return
+            names = [o.name for o in objects if o.vtype != 'Directory'
+                     and any(fnmatch.fnmatchcase(o.name, n) for n in names)]
+            if not names:
+                print('no objects match')
+                self.failure()
+                return
+
+        for index, name in enumerate(names):
+            if self.cancelled:
+                return
+            if self.use_callafter:
+                wx.CallAfter(
+                    pub.sendMessage,
+                    f'xmodem.filestart.{self.ptopic}',
+                    index=index,
+                    count=len(names),
+                    name=str(name))
+            else:
+                pub.sendMessage(
+                    f'xmodem.filestart.{self.ptopic}',
+                    index=index,
+                    count=len(names),
+                    name=str(name))
+            if not transfer(name, *args):
+                return
+
     def checksumStr(self, s: str) -> int:
         result = 0
         for i in s:
@@ -307,46 +382,62 @@ class XModemConnector:
         self.ser.write(s)
 
 
-    def sendCommandPacket(self, instr: str):
-        """Send command packet s to the XModem server and wait for ACK."""
+    def sendCommandPacket(self, instr: str, command: bytes = b''):
+        """Send command packet s to the XModem server and wait for ACK.
+
+        If `command` is given, the command byte goes out in the same
+        write as the packet, so the server gets both in one go.
+        """
         c = b''
         retry_count = 0
+        # in the calculator's own character set, a byte per character
+        # (UTF-8 made a name with Σ in it two bytes too long)
+        data = instr.encode('hp48')
         # We have to construct it like this, otherwise extra bytes get
         # added for no apparent reason
-        s = bytearray()
-        s.append((len(instr) & 0xff00) >> 8)
-        s.append((len(instr) & 0xff))
-        s.extend(bytearray(instr, 'utf-8'))
-        s.append(self.checksumStr(instr) & 0xff)
+        s = bytearray(command)
+        s.append((len(data) & 0xff00) >> 8)
+        s.append((len(data) & 0xff))
+        s.extend(data)
+        s.append(self.checksumBytes(data) & 0xff)
 
         self.ser.write(s)
         self.ser.flush()
-        c = self.ser.read()
+        c = self.ser.expect(ACK)
         while c != ACK and not self.cancelled:
             if retry_count == 3:
                 # too many retries, something is wrong
                 self.failure()
                 return
             
-            c = self.ser.read()
+            c = self.ser.expect(ACK)
             retry_count += 1
             print(c)
 
 
+    def runProgram(self, *programs: str):
+        """Run `programs` on the calculator with the 'E' command.
+
+        Consecutive RPL fragments are joined into one program, so
+        they cost a single exchange with the server instead of one
+        each.
+        """
+        self.sendCommandPacket(' '.join(programs), command=b'E')
+
     def getCommandPacket(self) -> bytes:
         self.ser.flush()
         # read the size packet
-        size_packet = self.ser.read(2)
+        size_packet = self.ser.read_exact(2)
         if len(size_packet) == 2:
             # maybe something in here that limits the length to 10000
             # it's in YModem.pas
             size = size_packet[0] * 256 + size_packet[1]
             print('packet size', size)
             # now read as many bytes as specified in the size packet
-            data = self.ser.read(size)
+            data = self.ser.read_exact(size)
             print('packet data', data)
             # finally, read the checksum of the data and check it
-            chk = self.ser.read(1)
+            chk = self.ser.read_exact(1)
             print('chk, checksumXY:', hex(ord(chk)), hex(self.checksumBytes(data) & 0xff))
             if ord(chk) == (self.checksumBytes(data) & 0xff):
                 # data is valid
@@ -357,6 +448,11 @@ class XModemConnector:
 
     def failure(self):
         cmd = self.command
+        # Reads fail straight away once we've been cancelled, but
+        # that's not a failure as far as the user is concerned (and
+        # we've already said so if an earlier step failed).
+        if self.cancelled:
+            return
         # used to stop checking for ACK
         self.cancelled = True
         if self.use_callafter:
@@ -375,38 +471,25 @@ class XModemConnector:
 
 
     def clear_extra_bytes(self):
-        """Read from self.ser until there is no more data."""
-        r = self.ser.read()        
-        # read all the extra packets sent
-        while r != b'':
-            self.ser.write(ACK)
-            self.ser.flush()
-            r = self.ser.read()
+        """Read from self.ser until the line has been quiet for
+        DRAIN_IDLE_GAP seconds, ACKing each burst of extra data."""
+        # We used to read one byte at a time with the full serial
+        # timeout, which meant every call cost at least a second even
+        # when the line was already empty. Now we take everything
+        # that's waiting in one read and only wait out a short gap
+        # between characters.
+        self.ser.timeout = DRAIN_IDLE_GAP
+        try:
+            r = self.ser.read(max(1, self.ser.in_waiting))
+            # read all the extra packets sent
+            while r != b'':
+                self.ser.write(ACK)
+                self.ser.flush()
+                r = self.ser.read(max(1, self.ser.in_waiting))
+        finally:
+            self.ser.timeout = self.ser_timeout
 
 
-    def get_hp_path(self):
-        # this creates a file with mode w+b, for reading and writing.
-        tmp = tempfile.TemporaryFile()
-        try:
-            self.clear_extra_bytes()
-            self.sendCommand(b'E')
-            self.sendCommandPacket("PATH '$$$p' STO")
-            self.clear_extra_bytes()
-            self.sendCommand(b'G')
-            self.sendCommandPacket('$$$p')
-            self.success = self.modem.recv(
-                tmp, retry=9, timeout=1,
-                quiet=True)
-            if self.success:
-                self.clear_extra_bytes()
-                self.sendCommand(b'E')
-                self.sendCommandPacket("'$$$p' PURGE")
-            return tmp
-        except:
-            print('failed to get path')
-            self.failure()
-            return None
-        
     def run_M_L(self):
         print('run_M_L')
         if self.use_callafter:
@@ -429,7 +512,6 @@ class XModemConnector:
             memory = self.getCommandPacket()
             print('memory in try', memory)
             #self.ser.timeout = self.ser_timeout
-            self.clear_extra_bytes()
         except:
             self.failure()
             return -1, None # prevent unpack errors on failure, -1 is meaningless
@@ -447,10 +529,11 @@ class XModemConnector:
         # Finally, get the listing of the current directory.
         if self.cancelled: return -1, None
         try:
+            # getCommandPacket() blocks until the listing arrives, so
+            # there's no need to sleep first.
             self.clear_extra_bytes()
             self.sendCommand(b'L')
             self.ser.flush()
-            time.sleep(.3)
             l = self.getCommandPacket()
         except:
             self.failure()
@@ -460,123 +543,54 @@ class XModemConnector:
             self.failure()
             return -1, None
         
-        index = 0
-        print(len(l))
-        objects = []
-        # process for later
-        while index < len(l):
-            if self.cancelled: return -1, None
-            # 1st byte is object name length
-            # n bytes following are object name
-            # 2 bytes are object prolog
-            # 3 bytes are object size
-            # 2 bytes are HP CRC
-            lsize = l[index]
-            index += 1
-            
-            name = l[index:index + lsize]
-            index += lsize
-            
-            prologstr = l[index:index + 2]
-            prolog = prologstr[1] * 256 + prologstr[0]
-            index += 2
-            
-            # object size is 3 bytes, which encode the size of the
-            # object multiplied by 2 (to account for nibbles)
-            
-            objsize = l[index:index + 3]
-            size = objsize[2] * 65536 + objsize[1] * 256 + objsize[0]
-            size /= 2
-            index += 3
-            
-            objcrc = l[index:index + 2]
-            crc = objcrc[1] * 256 + objcrc[0]
-            index += 2
-            
-            objects.append(HPVariable(XModemProcessTools.bytes_to_utf8(name),
-                                      str(size),
-                                      XModemProcessTools.prolog_to_type(prolog),
-                                      KermitProcessTools.checksum_to_hexstr(crc)))
-
-        return memory, objects
+        if self.cancelled: return -1, None
+        return memory, parse_listing(l)
 
     def connect_to_server(self):
         import wx
-        # Home the calculator
-        self.sendCommand(b'E')
-        self.sendCommandPacket('HOME')
+        # Home the calculator. If we're going to reset the directory
+        # on disconnect, the original path is saved into HOME in the
+        # same program, so it never has to cross the serial line.
+        # Whether it was is decided here, once, and handed back with
+        # connectdone: the setting can change before we disconnect.
+        path_saved = self.settings['reset_directory_on_disconnect']
+        try:
+            self.clear_extra_bytes()
+            self.runProgram(SAVE_PATH if path_saved else DISCARD_PATH)
+        except Exception as e:
+            print(e)
+            self.failure()
+            return
         
         if self.cancelled: return
         memory, objects = self.run_M_L()
         
         if self.cancelled: return
         
-        if HPexSettingsTools.load_settings()['reset_directory_on_disconnect']:
-            pathfile = self.get_hp_path()
-        else:
-            pathfile = None
-            
         print(memory, objects)
 
+        wx.CallAfter(
+            pub.sendMessage,
+            f'xmodem.connectdone.{self.ptopic}',
+            mem=int(memory),
+            varlist=objects,
+            path_saved=path_saved)
 
-        if not self.cancelled:
-            wx.CallAfter(
-                pub.sendMessage,
-                f'xmodem.connectdone.{self.ptopic}',
-                mem=int(memory),
-                pathfile=pathfile,
-                varlist=objects)
-
-    def disconnect_from_server(self, pathfile):
+    def disconnect_from_server(self, restore):
         import wx
         if self.cancelled: return
         # Restore original directory if desired, and send command 'Q'
         # to quit server on calculator.
         try:
-            if HPexSettingsTools.load_settings()['reset_directory_on_disconnect']:
+            self.clear_extra_bytes()
+            if restore:
                 print('reset directory')
-                if self.cancelled:
-                    print('cancelled')
-                    return
-
-                pathfile.seek(0)
-                print(pathfile.read())
-                pathfile.seek(0)
-                self.clear_extra_bytes()
-                self.ser.flush()
-                self.sendCommand(b'P')
-                self.sendCommandPacket("$$$p")
-                self.modem = HPXModem(self.ser)
-                self.success = self.modem.send(pathfile, retry=4)
-                
-                if self.cancelled:
-                    print('cancelled')
-                    self.modem.abort()
-                    # if we cancel at or beyond this point, the file
-                    # has probably already been sent. we should delete
-                    # it as a result.
-                    # TODO: actually test this on real hardware
-                    print('deleting $$$p')
-                    self.clear_extra_bytes()
-                    self.sendCommand(b'E')
-                    self.sendCommandPacket("'$$$p' PURGE")
-                    print('$$$p deleted')
-
-                    return
-                
-                self.clear_extra_bytes()
+                self.runProgram(RESTORE_PATH)
 
-                if self.cancelled:
-                    self.modem.abort()
-                    return
-                
-                self.sendCommand(b'E')
-                # DUP to duplicate the name, EVAL to get the variable
-                # value, SWAP to swap between value and variable name,
-                # PURGE to delete variable, EVAL to change path.
-                self.sendCommandPacket("'$$$p' DUP EVAL SWAP PURGE EVAL")
+            if self.cancelled:
+                print('cancelled')
+                return
 
-            self.clear_extra_bytes()
             self.sendCommand(b'Q')
             
         except Exception as e:
@@ -637,6 +651,9 @@ class XModemConnector:
         self.modem.abort()
         # cancel any current server operation
         self.cancelled = True
+        # and wake up whatever read is waiting on the port
+        if isinstance(self.ser, Transport):
+            self.ser.cancel()
         if self.use_callafter:
             import wx
             wx.CallAfter(
@@ -5,11 +5,11 @@ from pathlib import Path
 
 import xmodem
 from pubsub import pub
-import serial
 
 from hpex.settings import HPexSettingsTools
 from hpex.hp_variable import HPVariable
 from hpex.helpers import KermitProcessTools, XModemProcessTools # needed for checksum_to_hexstr
+from hpex.transport import Transport
 
 # Although there is a bit of duplicate code, putting this here as a
 # separate class keeps XModemConnector smaller and reduces the already
@@ -18,7 +18,7 @@ from hpex.helpers import KermitProcessTools, XModemProcessTools # needed for che
 class XModemXSendConnector:
     def getc(self, size, timeout=.1):
         #print('getc')
-        return self.ser.read(size) or None
+        return self.ser.read_exact(size) or None
                     
     def putc(self, data, timeout=.1):
         #print('putc')
@@ -66,24 +66,9 @@ class XModemXSendConnector:
             settings = HPexSettingsTools.load_settings()
         else:
             settings = alt_options
-        baud = settings['baud_rate']
-        parity = None
-        if settings['parity'] == '0 (None)':
-            parity = serial.PARITY_NONE
-        elif settings['parity'] == '1 (Odd)':
-            parity = serial.PARITY_ODD
-        elif settings['parity'] == '2 (Even)':
-            parity = serial.PARITY_EVEN
-        elif settings['parity'] == '3 (Mark)':
-            parity = serial.PARITY_MARK
-        elif settings['parity'] == '4 (Space)':
-            parity = serial.PARITY_SPACE
-
         try:
-            self.ser = serial.Serial(
-                # short timeout so we get something like what Kermit
-                # has
-                port, baud, parity=parity, timeout=self.ser_timeout, write_timeout=self.ser_timeout)
+            # short timeout so we get something like what Kermit has
+            self.ser = Transport.open(port, settings, self.ser_timeout)
             self.modem = xmodem.XMODEM(self.getc, self.putc)
         except Exception as e:
             print(e)
@@ -197,6 +182,9 @@ class XModemXSendConnector:
         self.cancelled = True
         self.should_update = False
         self.modem.abort(timeout=1)
+        # XMODEM.send() is probably waiting for an ACK, with a three
+        # second timeout. Wake it up so it gives up now.
+        self.ser.cancel()
 
         if self.use_callafter:
             import wx